@@ -1,3 +1,4 @@
 """Available metrics."""
 from .fid import FID
 from .lpips import LPIPS
+from .activation_cache import ActivationCache
@@ -0,0 +1,185 @@
+"""Persistent cache of InceptionV3 activations and FID statistics."""
+
+import hashlib
+from pathlib import Path
+import numpy as np
+import torch
+from .running_stats import RunningStatistics
+
+CACHE_VERSION = 'pt_inception-2015-12-05'
+
+def _hash(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+def is_deterministic(transformation):
+    """Check if a transformation always gives the same output for the same image."""
+    if transformation is None:
+        return True
+    for t in getattr(transformation, 'transforms', [transformation]):
+        if type(t).__name__.startswith('Random'):
+            return False
+    return True
+
+def get_dataset_keys(dataset, dims):
+    """Get the cache group and the image keys of a Dataset.
+
+    The group identifies the image source, transformation and feature
+    dimension. The keys identify each image by path and modification time.
+    Returns (None, None) if the dataset can not be cached (images without
+    path or random transformations).
+    """
+    if not hasattr(dataset, 'get_image_keys'):
+        return None, None
+    transformation = getattr(dataset, 'transformation', None)
+    if not is_deterministic(transformation):
+        return None, None
+
+    source = getattr(dataset, 'img_dir', None) or getattr(dataset, 'shard_dir', None)
+    group = _hash(f'{CACHE_VERSION}|{dims}|{Path(source).resolve()}|{transformation!r}')
+    return group, dataset.get_image_keys()
+
+
+class ActivationCache():
+    """Persistent store of InceptionV3 activations.
+
+    Activations are stored per image, so images added to a folder or
+    regenerated (new modification time) are the only ones recomputed.
+    Statistics (mu, sigma) are stored per image set.
+
+    Attributes
+    ----------
+    cache_dir : str
+        Folder to save the cached values.
+    """
+    def __init__(self, cache_dir):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._groups = {}
+
+    def _group_file(self, group):
+        return self.cache_dir / f'activations_{group}.npz'
+
+    def _stats_file(self, group, keys):
+        set_key = '\n'.join([group] + sorted(keys))
+        return self.cache_dir / f'stats_{_hash(set_key)}.npz'
+
+    def _load_group(self, group):
+        if group not in self._groups:
+            file = self._group_file(group)
+            if file.exists():
+                with np.load(file) as data:
+                    keys, act = data['keys'].tolist(), data['act']
+            else:
+                keys, act = [], None
+            self._groups[group] = {
+                'rows': {k: i for i, k in enumerate(keys)},
+                'keys': keys,
+                'act': act,
+            }
+        return self._groups[group]
+
+    def find_activations(self, group, keys):
+        """Find cached activations.
+
+        Returns the rows of the cached activations array of the keys
+        found, and the indexes of the keys not found in the cache.
+        """
+        cached = self._load_group(group)
+        rows = []
+        missing = []
+        for i, k in enumerate(keys):
+            row = cached['rows'].get(k)
+            if row is None:
+                missing.append(i)
+            else:
+                rows.append(row)
+        return np.array(rows, dtype=np.int64), missing
+
+    def load_activations(self, group, keys, dims):
+        """Load cached activations.
+
+        Returns the activations array (float32) and the indexes of the
+        keys not found in the cache, whose rows are left as zeros.
+        """
+        act = np.zeros((len(keys), dims), dtype=np.float32)
+        rows, missing = self.find_activations(group, keys)
+        found = np.setdiff1d(np.arange(len(keys)), missing)
+        if len(found) > 0:
+            act[found] = self._load_group(group)['act'][rows]
+        return act, missing
+
+    def save_activations(self, group, keys, act):
+        """Add activations to the cache."""
+        cached = self._load_group(group)
+        act = np.asarray(act, dtype=np.float32)
+        start = len(cached['keys'])
+        cached['keys'] = cached['keys'] + list(keys)
+        cached['rows'].update({k: start + i for i, k in enumerate(keys)})
+        if cached['act'] is None:
+            cached['act'] = act
+        else:
+            cached['act'] = np.concatenate([cached['act'], act])
+
+        file = self._group_file(group)
+        tmp_file = file.with_name(f'{file.stem}.tmp.npz')
+        np.savez(tmp_file, keys=np.array(cached['keys']), act=cached['act'])
+        tmp_file.replace(file)
+
+    def load_statistics(self, group, keys):
+        """Load cached (mu, sigma). Returns None if not found."""
+        file = self._stats_file(group, keys)
+        if not file.exists():
+            return None
+        with np.load(file) as data:
+            return data['mu'], data['sigma']
+
+    def save_statistics(self, group, keys, mu, sigma):
+        """Save (mu, sigma) of an image set."""
+        file = self._stats_file(group, keys)
+        tmp_file = file.with_name(f'{file.stem}.tmp.npz')
+        np.savez(tmp_file, mu=mu, sigma=sigma)
+        tmp_file.replace(file)
+
+    def get_statistics(self, imgs, dims, get_activations):
+        """Get (mu, sigma) of the images in a DataLoader using the cache.
+
+        Only images not in the cache are passed to `get_activations`.
+        Returns None if the DataLoader can not be cached.
+
+        Parameters
+        ----------
+        imgs : torch.utils.data.DataLoader
+            Images to evaluate.
+        dims : int
+            Dimensionality of the features.
+        get_activations : function
+            Function that receives a DataLoader and returns the
+            activations as a (n_imgs, dims) array.
+        """
+        group, keys = get_dataset_keys(imgs.dataset, dims)
+        if group is None:
+            return None
+
+        stats = self.load_statistics(group, keys)
+        if stats is not None:
+            return stats
+
+        statistics = RunningStatistics(dims)
+        rows, missing = self.find_activations(group, keys)
+        cached_act = self._load_group(group)['act']
+        for start in range(0, len(rows), 1024):
+            statistics.update(cached_act[rows[start:start + 1024]])
+
+        if len(missing) > 0:
+            missing_imgs = torch.utils.data.DataLoader(
+                torch.utils.data.Subset(imgs.dataset, missing),
+                batch_size=imgs.batch_size,
+                shuffle=False,
+                num_workers=imgs.num_workers)
+            new_act = get_activations(missing_imgs)
+            self.save_activations(group, [keys[i] for i in missing], new_act)
+            statistics.update(new_act)
+
+        mu, sigma = statistics.get()
+        self.save_statistics(group, keys, mu, sigma)
+        return mu, sigma
@@ -2,12 +2,13 @@
 
 Source: https://github.com/mseitzer/pytorch-fid"""
 
-import math
 import torch
 from torch.nn.functional import adaptive_avg_pool2d
-from pytorch_fid import fid_score
-from pytorch_fid.inception import InceptionV3
 import numpy as np
+from .activation_cache import ActivationCache
+from .running_stats import RunningStatistics
+from .sharded import sharded_fid_statistics, sharded_fid_activations
+from ..utils.lazy import lazy_import
 try:
     from tqdm import tqdm
 except ImportError:
@@ -16,6 +17,9 @@ except ImportError:
         """Dummy function for tqdm."""
         return x
 
+fid_score = lazy_import('pytorch_fid.fid_score')
+inception = lazy_import('pytorch_fid.inception')
+
 class FID():
     """Wrapper to compute Fréchet Inception Distance (FID).
     Attributes
@@ -32,12 +36,27 @@ class FID():
     batch_size : int
         Batch size to use.
         (Default: 32).
+    cache_dir : str
+        Folder to cache activations and statistics of DataLoaders
+        whose images are read from files (see ActivationCache).
+        If None, nothing is cached.
+        (Default: None).
+    n_workers : int
+        Number of processes that share the images of a DataLoader
+        (see metrics.sharded). Each process uses one of the GPUs,
+        in turn, or the CPU. If 1, images are evaluated in this process.
+        (Default: 1).
     """
-    def __init__(self, dims=2048, cuda=False, init_model=True, batch_size=32):
+    def __init__(self, dims=2048, cuda=False, init_model=True, batch_size=32, cache_dir=None,
+                 n_workers=1):
         self.cuda = cuda
+        self.n_workers = n_workers
         self.dims = dims
         self.batch_size = batch_size
         self._last_num_imgs = 0
+        self.cache = None
+        if cache_dir is not None:
+            self.cache = ActivationCache(cache_dir)
 
         self.model = None
         if init_model:
@@ -49,64 +68,82 @@ class FID():
 
     def _init_model(self):
         if self.model is None:
-            block_idx = InceptionV3.BLOCK_INDEX_BY_DIM[self.dims]
-            self.model = InceptionV3([block_idx])
+            block_idx = inception.InceptionV3.BLOCK_INDEX_BY_DIM[self.dims]
+            self.model = inception.InceptionV3([block_idx])
             if self.cuda:
                 self.model = self.model.to('cuda')
             self.model.eval()
 
-    def _get_activations(self, imgs):
-
-        as_dataloader = isinstance(imgs, torch.utils.data.DataLoader)
-        if as_dataloader:
-            n_imgs = np.sum([len(batch) for batch in imgs])
-        else:
-            n_imgs = len(imgs)
-        pred_arr = np.empty((n_imgs, self.dims))
-
-        def _get_values(batch, start_idx):
-            if self.cuda:
-                batch = batch.cuda()
-            with torch.no_grad():
-                pred = self.model(batch)[0]
+    def batch_activations(self, batch):
+        """Activations of a batch of images, as a numpy array."""
+        self._init_model()
+        if self.cuda:
+            batch = batch.cuda()
+        with torch.no_grad():
+            pred = self.model(batch)[0]
 
-            # If model output is not scalar, apply global spatial average pooling.
-            # This happens if you choose a dimensionality not equal 2048.
-            if pred.size(2) != 1 or pred.size(3) != 1:
-                pred = adaptive_avg_pool2d(pred, output_size=(1, 1))
+        # If model output is not scalar, apply global spatial average pooling.
+        # This happens if you choose a dimensionality not equal 2048.
+        if pred.size(2) != 1 or pred.size(3) != 1:
+            pred = adaptive_avg_pool2d(pred, output_size=(1, 1))
 
-            pred = pred.squeeze(3).squeeze(2).cpu().numpy()
-            pred_arr[start_idx:start_idx + len(batch)] = pred
+        return pred.squeeze(3).squeeze(2).cpu().numpy()
 
-        start_idx = 0
-        if as_dataloader:
+    def _iter_activations(self, imgs):
+        """Yield the activations of each batch of images as numpy arrays."""
+        if isinstance(imgs, torch.utils.data.DataLoader):
             for batch in tqdm(imgs):
-                _get_values(batch, start_idx)
-                start_idx = start_idx + len(batch)
+                yield self.batch_activations(batch)
         else:
-            for _ in tqdm(range(math.ceil(len(imgs) / self.batch_size))):
-                batch = imgs[start_idx:start_idx + self.batch_size]
-                _get_values(batch, start_idx)
-                start_idx = start_idx + len(batch)
+            for start_idx in tqdm(range(0, len(imgs), self.batch_size)):
+                yield self.batch_activations(imgs[start_idx:start_idx + self.batch_size])
+
+    def _get_activations(self, imgs):
+        act = list(self._iter_activations(imgs))
+        if len(act) == 0:
+            return np.empty((0, self.dims))
+        return np.concatenate(act)
 
-        return pred_arr
+    def _get_activations_sharded(self, imgs):
+        return sharded_fid_activations(imgs.dataset, self.n_workers, dims=self.dims,
+                                       batch_size=imgs.batch_size, cuda=self.cuda)
 
     def compute_statistics_of_imgs(self, imgs):
-        """Compute image features statistics."""
-        act = self._get_activations(imgs)
-        mu = np.mean(act, axis=0)
-        sigma = np.cov(act, rowvar=False)
-        return mu, sigma
+        """Compute image features statistics.
+
+        Images are read in a single pass, and only the running mean and
+        covariance are kept in memory.
+        """
+        sharded = self.n_workers > 1 and isinstance(imgs, torch.utils.data.DataLoader)
+        if self.cache is not None and isinstance(imgs, torch.utils.data.DataLoader):
+            get_activations = self._get_activations_sharded if sharded else self._get_activations
+            stats = self.cache.get_statistics(imgs, self.dims, get_activations)
+            if stats is not None:
+                return stats
+        if sharded:
+            return sharded_fid_statistics(imgs.dataset, self.n_workers, dims=self.dims,
+                                          batch_size=imgs.batch_size, cuda=self.cuda)
+        statistics = RunningStatistics(self.dims)
+        for act in self._iter_activations(imgs):
+            statistics.update(act)
+        return statistics.get()
 
     def get(self, images1, images2):
         """Calculate FID between images."""
         self._last_num_imgs = len(images1) + len(images2)
 
-        self._init_model()
         m1, s1 = self.compute_statistics_of_imgs(images1)
         m2, s2 = self.compute_statistics_of_imgs(images2)
         return FID.calculate_frechet_distance(m1, s1, m2, s2)
 
+    def get_from_statistics(self, statistics, images):
+        """Calculate FID between precomputed (mu, sigma) and images."""
+        self._last_num_imgs = len(images)
+
+        m1, s1 = statistics
+        m2, s2 = self.compute_statistics_of_imgs(images)
+        return FID.calculate_frechet_distance(m1, s1, m2, s2)
+
     @staticmethod
     def calculate_frechet_distance(m1,s1,m2,s2):
         """Calculate FID."""
@@ -5,11 +5,10 @@ Source: https://github.com/richzhang/PerceptualSimilarity/"""
 
 import random
 import math
-import itertools
 import warnings
 import torch
-import lpips
 import numpy as np
+from ..utils.lazy import lazy_import
 try:
     from tqdm import tqdm
 except ImportError:
@@ -18,6 +17,8 @@ except ImportError:
         """Dummy function for tqdm."""
         return x
 
+lpips = lazy_import('lpips')
+
 class LPIPS():
     """Wrapper to compute Perceptual Similarity Metric (LPIPS).
 
@@ -42,8 +43,12 @@ class LPIPS():
     max_pairs : int
         Maximum number of pairs to use.
         (Default: 10000).
+    pnet_rand : bool
+        If True, use random backbone weights (no download, for tests).
+        (Default: False).
     """
-    def __init__(self, net='alex', cuda=False, rescale=True, no_grad=True, batch_size=32, max_pairs=10000):
+    def __init__(self, net='alex', cuda=False, rescale=True, no_grad=True, batch_size=32, max_pairs=10000,
+                 pnet_rand=False):
         self.cuda = cuda
         self.rescale = rescale
         self.no_grad = no_grad
@@ -53,7 +58,7 @@ class LPIPS():
 
         with warnings.catch_warnings():
             warnings.simplefilter("ignore")
-            self.model = lpips.LPIPS(net=net, version='0.1')
+            self.model = lpips.LPIPS(net=net, version='0.1', pnet_rand=pnet_rand)
         if no_grad:
             self.model.eval()
         if cuda:
@@ -106,8 +111,18 @@ class LPIPS():
     def _lpips(self, img0, img1, normalize, use_all_pairs):
         if use_all_pairs:
             all_pairs = self._get_all_pairs(img0, img1)
-        else:
-            all_pairs = np.array([(i, i) for i in range(len(img0))])
+            self._last_num_pairs = len(all_pairs)
+            emb0 = self.embed(img0, normalize=normalize)
+            emb1 = self.embed(img1, normalize=normalize)
+            pred_arr = torch.empty(0)
+            for start_idx in range(0, len(all_pairs), self.batch_size):
+                i0 = torch.from_numpy(all_pairs[start_idx:start_idx + self.batch_size, 0])
+                i1 = torch.from_numpy(all_pairs[start_idx:start_idx + self.batch_size, 1])
+                values = (emb0[i0.to(emb0.device)] - emb1[i1.to(emb1.device)]).pow(2).sum(dim=1)
+                pred_arr = torch.cat((pred_arr, values.cpu()))
+            return pred_arr.view(-1, 1, 1, 1)
+
+        all_pairs = np.array([(i, i) for i in range(len(img0))])
         self._last_num_pairs = len(all_pairs)
 
         pred_arr = torch.empty(0)
@@ -134,11 +149,125 @@ class LPIPS():
         return pred_arr
 
     def _get_all_pairs(self, list1, list2):
-        i1 = list(range(len(list1)))
-        i2 = list(range(len(list2)))
-        all_pairs = list(itertools.product(i1, i2))
-        random.shuffle(all_pairs)
-        return np.array(all_pairs[:min(len(all_pairs), self.max_pairs)])
+        n1, n2 = len(list1), len(list2)
+        flat_idx = random.sample(range(n1 * n2), min(n1 * n2, self.max_pairs))
+        return np.stack(np.divmod(np.array(flat_idx, dtype=np.int64), n2), axis=1)
+
+    def _embed_batch(self, batch, normalize):
+        if self.cuda:
+            batch = batch.cuda()
+        if normalize:
+            batch = 2 * batch - 1
+        outs = self.model.net.forward(self.model.scaling_layer(batch))
+        embedding = []
+        for kk in range(self.model.L):
+            feats = lpips.normalize_tensor(outs[kk])
+            weight = self.model.lins[kk].model[-1].weight.view(1, -1, 1, 1)
+            if (weight < 0).any():
+                msg = 'LPIPS embeddings need non-negative linear layer weights.'
+                raise ValueError(msg)
+            feats = feats * weight.sqrt() / math.sqrt(feats.shape[2] * feats.shape[3])
+            embedding.append(feats.flatten(start_dim=1))
+        return torch.cat(embedding, dim=1)
+
+    def embed(self, imgs, normalize=None, device=None):
+        """Calculate the LPIPS embedding of each image.
+
+        The backbone features of each layer are unit-normalized, scaled by
+        the square root of the linear layer weights and by the spatial size,
+        and flattened. The LPIPS distance between two images is the squared
+        Euclidean distance between their embeddings, so each image goes
+        through the network only once. Each 256x256 image uses about 2.5 MB
+        with 'alex'.
+
+        Parameters
+        ----------
+        imgs : torch.Tensor or torch.utils.data.DataLoader
+            Images to embed.
+        normalize : bool
+            If True, rescale images from [0,1] to [-1,1].
+            If None, uses `rescale`.
+            (Default: None).
+        device : torch.device or str
+            Device where the embeddings are kept, e.g. 'cpu' for large
+            image sets. If None, the model device.
+            (Default: None).
+
+        Returns
+        -------
+        torch.Tensor
+            (n_imgs, n_features) embeddings.
+        """
+        if normalize is None:
+            normalize = self.rescale
+        if isinstance(imgs, torch.utils.data.DataLoader):
+            batches = imgs
+        else:
+            batches = (imgs[i:i + self.batch_size] for i in range(0, len(imgs), self.batch_size))
+
+        embeddings = []
+        for batch in batches:
+            if self.no_grad:
+                with torch.no_grad():
+                    embedding = self._embed_batch(batch, normalize)
+            else:
+                embedding = self._embed_batch(batch, normalize)
+            embeddings.append(embedding if device is None else embedding.to(device))
+        return torch.cat(embeddings)
+
+    @staticmethod
+    def distances(embeddings1, embeddings2, chunk_size=None):
+        """All-pairs LPIPS between two sets of embeddings (see `embed`).
+
+        Parameters
+        ----------
+        embeddings1 : torch.Tensor
+            (n_imgs1, n_features) embeddings. May be on another device
+            (e.g. CPU) than `embeddings2` if `chunk_size` is given.
+        embeddings2 : torch.Tensor
+            (n_imgs2, n_features) embeddings.
+        chunk_size : int
+            If given, `embeddings1` is moved to the device of `embeddings2`
+            in chunks of this many rows.
+            (Default: None).
+
+        Returns
+        -------
+        torch.Tensor
+            (n_imgs1, n_imgs2) LPIPS values, on the device of `embeddings2`.
+        """
+        if chunk_size is not None:
+            return torch.cat([
+                LPIPS.distances(embeddings1[i:i + chunk_size].to(embeddings2.device, non_blocking=True),
+                                embeddings2)
+                for i in range(0, len(embeddings1), chunk_size)])
+        sq1 = embeddings1.pow(2).sum(dim=1, keepdim=True)
+        sq2 = embeddings2.pow(2).sum(dim=1, keepdim=True)
+        values = sq1 + sq2.T - 2 * embeddings1 @ embeddings2.T
+        return values.clamp_min(0)
+
+    def get_all_pairs(self, images1, images2):
+        """Calculate LPIPS between all pairs of images.
+
+        `images1` are embedded once and kept in memory, `images2` are
+        processed in batches (a DataLoader or tensor).
+
+        Returns
+        -------
+        torch.Tensor
+            (n_imgs1, n_imgs2) LPIPS values, on CPU.
+        """
+        emb1 = self.embed(images1)
+        if isinstance(images2, torch.utils.data.DataLoader):
+            batches = images2
+        else:
+            batches = (images2[i:i + self.batch_size] for i in range(0, len(images2), self.batch_size))
+
+        values = []
+        for batch in tqdm(batches):
+            values.append(LPIPS.distances(emb1, self.embed(batch)).cpu())
+        self._last_num_pairs = len(emb1) * sum(v.shape[1] for v in values)
+        return torch.cat(values, dim=1)
 
     def get(self, images1,images2, all_pairs=False):
         """Calculate LPIPS between pairs of images."""
@@ -0,0 +1,52 @@
+"""Streaming mean and covariance of feature vectors."""
+
+import numpy as np
+
+class RunningStatistics():
+    """Mean and covariance accumulated batch by batch.
+
+    Uses the parallel (Chan et al.) form of Welford's algorithm in float64,
+    so memory is O(dims²) regardless of the number of samples, and partial
+    results (e.g. computed by different workers) can be merged.
+
+    Attributes
+    ----------
+    dims : int
+        Dimensionality of the feature vectors.
+    """
+    def __init__(self, dims):
+        self.dims = dims
+        self.n = 0
+        self.mean = np.zeros(dims, dtype=np.float64)
+        self.m2 = np.zeros((dims, dims), dtype=np.float64)
+
+    def _combine(self, n, mean, m2):
+        if n == 0:
+            return
+        n_total = self.n + n
+        delta = mean - self.mean
+        self.mean += delta * (n / n_total)
+        self.m2 += m2 + np.outer(delta, delta) * (self.n * n / n_total)
+        self.n = n_total
+
+    def update(self, act):
+        """Add a batch of feature vectors, with shape (n, dims)."""
+        act = np.asarray(act, dtype=np.float64).reshape(-1, self.dims)
+        if len(act) == 0:
+            return
+        mean = act.mean(axis=0)
+        centered = act - mean
+        self._combine(len(act), mean, centered.T @ centered)
+
+    def merge(self, other):
+        """Add the values accumulated by another RunningStatistics."""
+        self._combine(other.n, other.mean, other.m2)
+
+    def get(self):
+        """Return (mu, sigma), as numpy.mean and numpy.cov would.
+
+        As with numpy.cov, sigma is NaN if less than two samples were added.
+        """
+        if self.n < 2:
+            return self.mean.copy(), np.full((self.dims, self.dims), np.nan)
+        return self.mean.copy(), self.m2 / (self.n - 1)
@@ -0,0 +1,153 @@
+"""Split metric evaluation of an image set across worker processes.
+
+Each worker receives a contiguous shard of the dataset indices and a
+device (one of the available GPUs, in turn, or the CPU), and returns a
+partial result. Partial results are returned in shard order, so they can
+be concatenated (activations, per-image values) or reduced (e.g. with
+RunningStatistics.merge).
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Subset
+
+from .running_stats import RunningStatistics
+
+
+def get_devices(n_workers, cuda=True):
+    """Device of each worker: the GPUs in turn, if available, or the CPU."""
+    if cuda and torch.cuda.is_available():
+        return [f'cuda:{i % torch.cuda.device_count()}' for i in range(n_workers)]
+    return ['cpu'] * n_workers
+
+def split_indices(n, n_shards):
+    """Split range(n) in up to `n_shards` contiguous non-empty shards."""
+    return [s for s in np.array_split(np.arange(n), max(1, min(n_shards, n))) if len(s) > 0]
+
+def _init_worker(device, n_threads):
+    torch.set_num_threads(n_threads)
+    if device.startswith('cuda'):
+        torch.cuda.set_device(torch.device(device))
+
+def _run_shard(worker, device, n_threads, dataset, indices, batch_size, kwargs):
+    _init_worker(device, n_threads)
+    loader = DataLoader(Subset(dataset, indices.tolist()), batch_size=batch_size, shuffle=False)
+    return worker(loader, device, **kwargs)
+
+def run_sharded(worker, dataset, n_workers, batch_size=32, cuda=True, **kwargs):
+    """Run `worker` over shards of a dataset in parallel processes.
+
+    Parameters
+    ----------
+    worker : function
+        Module-level function called as `worker(loader, device, **kwargs)`
+        in each process, where `loader` is a DataLoader over the shard.
+        Its output must be picklable.
+    dataset : torch.utils.data.Dataset
+        Dataset to split. Must be picklable.
+    n_workers : int
+        Number of processes.
+    batch_size : int
+        Batch size of the shard DataLoaders.
+        (Default: 32)
+    cuda : bool
+        If True, use the available GPUs.
+        (Default: True)
+
+    Returns the list of worker outputs, in shard order.
+    """
+    shards = split_indices(len(dataset), n_workers)
+    devices = get_devices(len(shards), cuda)
+    n_threads = max(1, (os.cpu_count() or 1) // len(shards))
+    context = torch.multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=len(shards), mp_context=context) as executor:
+        futures = [executor.submit(_run_shard, worker, device, n_threads, dataset,
+                                   indices, batch_size, kwargs)
+                   for indices, device in zip(shards, devices)]
+        return [f.result() for f in futures]
+
+
+def fid_activations_worker(loader, device, dims=2048, return_statistics=True):
+    """InceptionV3 activations of a shard.
+
+    Returns a RunningStatistics if `return_statistics`, otherwise the
+    activations array.
+    """
+    from .fid import FID  # pylint: disable=import-outside-toplevel
+    fid = FID(dims=dims, cuda=device.startswith('cuda'), init_model=False,
+              batch_size=loader.batch_size)
+    if not return_statistics:
+        return fid._get_activations(loader)  # pylint: disable=protected-access
+    statistics = RunningStatistics(dims)
+    for act in fid._iter_activations(loader):  # pylint: disable=protected-access
+        statistics.update(act)
+    return statistics
+
+def lpips_pairs_worker(loader, device, net='alex', normalize=False, pnet_rand=False):
+    """LPIPS between the image pairs of a shard of a PairDataset."""
+    from .lpips import LPIPS  # pylint: disable=import-outside-toplevel
+    lpips = LPIPS(net=net, cuda=device.startswith('cuda'), pnet_rand=pnet_rand)
+    out = []
+    with torch.no_grad():
+        for batch1, batch2 in loader:
+            if lpips.cuda:
+                batch1 = batch1.cuda()
+                batch2 = batch2.cuda()
+            out.append(lpips.model.forward(batch1, batch2, normalize=normalize).cpu())
+    if len(out) == 0:
+        return torch.empty(0, 1, 1, 1)
+    return torch.cat(out)
+
+
+class PairDataset(torch.utils.data.Dataset):
+    """Random pairs (dataset1[i], dataset2[perm[i]]).
+
+    `perm` is a seeded random permutation of the indices of `dataset2`,
+    truncated to the shortest dataset, so images are paired at random (as
+    two shuffled DataLoaders would), but in the same way in every process.
+    Pairing by index would compare translations of the same source image,
+    and each image with itself for the same dataset.
+    """
+    def __init__(self, dataset1, dataset2, seed=0):
+        self.dataset1 = dataset1
+        self.dataset2 = dataset2
+        n = min(len(dataset1), len(dataset2))
+        generator = torch.Generator().manual_seed(seed)
+        self.indices2 = torch.randperm(len(dataset2), generator=generator)[:n].tolist()
+
+    def __len__(self):
+        return len(self.indices2)
+
+    def __getitem__(self, idx):
+        return self.dataset1[idx], self.dataset2[self.indices2[idx]]
+
+
+def sharded_fid_statistics(dataset, n_workers, dims=2048, batch_size=32, cuda=True):
+    """(mu, sigma) of the InceptionV3 activations of a dataset, computed by shards."""
+    total = RunningStatistics(dims)
+    for part in run_sharded(fid_activations_worker, dataset, n_workers, batch_size, cuda,
+                            dims=dims, return_statistics=True):
+        total.merge(part)
+    return total.get()
+
+def sharded_fid_activations(dataset, n_workers, dims=2048, batch_size=32, cuda=True):
+    """InceptionV3 activations of a dataset, computed by shards."""
+    parts = run_sharded(fid_activations_worker, dataset, n_workers, batch_size, cuda,
+                        dims=dims, return_statistics=False)
+    if len(parts) == 0:
+        return np.empty((0, dims))
+    return np.concatenate(parts)
+
+def sharded_lpips(dataset1, dataset2, n_workers, batch_size=32, cuda=True, normalize=False,
+                  seed=0, pnet_rand=False):
+    """LPIPS between random pairs of images (see PairDataset), computed by shards.
+
+    `pnet_rand` uses random backbone weights (no download, for tests).
+    """
+    parts = run_sharded(lpips_pairs_worker, PairDataset(dataset1, dataset2, seed=seed), n_workers,
+                        batch_size, cuda, normalize=normalize, pnet_rand=pnet_rand)
+    if len(parts) == 0:
+        return torch.empty(0, 1, 1, 1)
+    return torch.cat(parts)
@@ -0,0 +1,138 @@
+"""Adapter-only (LoRA) checkpoints.
+
+Generators built with `add_lora=True` have low-rank adapters (`lora_A`,
+`lora_B`) on their convolutions. An adapter checkpoint keeps only these
+tensors, with a hash of the base weights they were trained on, so each
+fine-tuned variant of a model is a small file that can only be loaded on
+top of the same base.
+
+`AdapterSwitcher` keeps one set of base generators in memory and switches
+between adapters by copying them in place, without rebuilding or reloading
+the networks.
+"""
+import hashlib
+import torch
+
+LORA_KEYS = ('lora_A', 'lora_B')
+
+def is_adapter_key(key):
+    """True if the state dict key is a LoRA adapter tensor."""
+    return key.rsplit('.', 1)[-1] in LORA_KEYS
+
+def adapter_state_dict(module):
+    """State dict entries of the LoRA adapters of a module."""
+    return {k: v for k, v in module.state_dict().items() if is_adapter_key(k)}
+
+def base_state_dict(module):
+    """State dict entries of a module, without the LoRA adapters."""
+    return {k: v for k, v in module.state_dict().items() if not is_adapter_key(k)}
+
+def base_weights_hash(module):
+    """SHA-256 of the base weights (names, dtypes, shapes and values) of a module."""
+    digest = hashlib.sha256()
+    for key, value in sorted(base_state_dict(module).items()):
+        value = value.detach().reshape(-1).cpu().contiguous()
+        digest.update(f'{key}:{value.dtype}:{tuple(value.shape)};'.encode())
+        digest.update(value.view(torch.uint8).numpy().tobytes())
+    return digest.hexdigest()
+
+def load_base_weights(module, state_dict):
+    """
+    Load base weights into a module with LoRA adapters.
+
+    Adapter entries of `state_dict` are ignored, and the adapters of the
+    module are kept. All base weights of the module must be in `state_dict`.
+    """
+    state_dict = {k: v for k, v in state_dict.items() if not is_adapter_key(k)}
+    missing, unexpected = module.load_state_dict(state_dict, strict=False)
+    missing = [k for k in missing if not is_adapter_key(k)]
+    if missing or unexpected:
+        raise RuntimeError(f'Error loading base weights. Missing keys: {missing}. '
+                           f'Unexpected keys: {unexpected}.')
+
+def check_base_hash(name, expected, module):
+    """Raise ValueError if the module base weights do not have the expected hash."""
+    current = base_weights_hash(module)
+    if current != expected:
+        raise ValueError(f'Adapters of {name} were trained on different base weights '
+                         f'(hash {expected[:12]}, model has {current[:12]}).')
+
+
+class AdapterSwitcher:
+    """
+    One set of base generators, with adapters switched in place.
+
+    Adapters are loaded once (they are small), checked against the hash of
+    the base weights, and kept on the generators device. `use` copies an
+    adapter into the generator parameters, so switching costs a few small
+    copies, and no network is rebuilt.
+
+    The generators must not be moved to another device after the switcher
+    is created.
+
+    Attributes
+    ----------
+    generators: dict
+        Generators (with `add_lora=True`) by name, e.g., {'gen_AtoB': ..., 'gen_BtoA': ...}.
+    active: str or None
+        Name of the adapter in use, or None for the base weights.
+    """
+    def __init__(self, generators):
+        self.generators = generators
+        self.active = None
+        self._base_hash = {name: base_weights_hash(gen) for name, gen in generators.items()}
+        self._targets = {name: adapter_state_dict(gen) for name, gen in generators.items()}
+        for name, targets in self._targets.items():
+            if len(targets) == 0:
+                raise ValueError(f'{name} has no LoRA adapters (add_lora=False).')
+        self._adapters = {}
+
+    @property
+    def names(self):
+        """Names of the loaded adapters."""
+        return list(self._adapters)
+
+    def add(self, name, adapters):
+        """
+        Load an adapter set.
+
+        Parameters
+        ------------
+        name: str
+            Adapter set name.
+        adapters: str, Path or dict
+            Adapter checkpoint (`CycleGAN.save_adapters`), or its content.
+        """
+        if not isinstance(adapters, dict):
+            adapters = torch.load(adapters, weights_only=True, map_location='cpu')
+        loaded = {}
+        for gen_name, targets in self._targets.items():
+            if adapters['base_hash'][gen_name] != self._base_hash[gen_name]:
+                raise ValueError(f'Adapters {name} of {gen_name} were trained on different base weights.')
+            state = adapters[gen_name]
+            if set(state) != set(targets):
+                raise ValueError(f'Adapters {name} of {gen_name} do not match the generator adapters.')
+            loaded[gen_name] = {}
+            for key, target in targets.items():
+                if state[key].shape != target.shape:
+                    raise ValueError(f'Adapter {name} {gen_name}.{key} has shape {tuple(state[key].shape)}, '
+                                     f'expected {tuple(target.shape)}.')
+                loaded[gen_name][key] = state[key].to(device=target.device, dtype=target.dtype)
+        self._adapters[name] = loaded
+
+    def use(self, name=None):
+        """Switch to an adapter set, or to the base weights if `name` is None."""
+        with torch.no_grad():
+            for gen_name, targets in self._targets.items():
+                for key, target in targets.items():
+                    if name is None:
+                        if key.endswith('lora_B'):
+                            target.zero_()
+                    else:
+                        target.copy_(self._adapters[name][gen_name][key])
+        self.active = name
+        return self
+
+    def __getitem__(self, gen_name):
+        """Generator by name, with the active adapters."""
+        return self.generators[gen_name]
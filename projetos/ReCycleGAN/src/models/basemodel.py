@@ -1,5 +1,6 @@
 """Module with BaseModel class."""
 from abc import ABC, abstractmethod
+import torch
 from torch import optim
 from torch.optim.lr_scheduler import StepLR
 
@@ -45,11 +46,20 @@ class BaseModel(ABC):
         """
         # self.load_state_dict(torch.load(path))
 
-    def setup_optimizers(self, model_params, lr=0.0002, beta1=0.5, beta2=0.999):
+    def setup_optimizers(self, model_params, lr=0.0002, beta1=0.5, beta2=0.999, fused=False):
         """
         Setup optimizers for the model with default learning rate and betas.
-        """
-        return optim.Adam(model_params, lr=lr, betas=(beta1, beta2))
+
+        If `fused`, the parameters are updated by a single fused kernel on GPU,
+        or by multi-tensor (foreach) operations on CPU.
+        """
+        kwargs = {}
+        if fused:
+            if torch.device(self.device).type == 'cuda':
+                kwargs['fused'] = True
+            else:
+                kwargs['foreach'] = True
+        return optim.Adam(model_params, lr=lr, betas=(beta1, beta2), **kwargs)
 
     def setup_schedulers(self, optimizer, step_size=20, gamma=0.5):
         """
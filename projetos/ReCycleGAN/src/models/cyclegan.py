@@ -1,6 +1,7 @@
 # pylint: disable=invalid-name
 """Module with CycleGAN class."""
 import gc
+from contextlib import nullcontext
 import torch
 from torch import nn
 
@@ -8,6 +9,8 @@ from .basemodel import BaseModel
 from .networks import Generator, Discriminator, CycleGANLoss
 from .networks import get_norm_layer, ReplayBuffer, PathLengthPenalty
 from .losses import Loss
+from .adapters import is_adapter_key, adapter_state_dict, base_weights_hash
+from .adapters import load_base_weights, check_base_hash
 
 class CycleGAN(BaseModel):
     """
@@ -21,6 +24,13 @@ class CycleGAN(BaseModel):
     - n_downsampling: Number of downsampling layers in generators. Default is 2.
     - norm_type: Normalization layer type: 'batch', 'instance' or 'none'. Default is 'instance'.
     - add_skip: If True, add skip connections to the generators. Default is False.
+    - attention_chunk_size: Query chunk size of the self-attention layers on CPU, which bounds
+    their memory (see SelfAttention). Default is None.
+    - add_lora: If True, add LoRA adapters to the generators. Default is False.
+    - lora_rank: LoRA rank. Default is 4.
+    - train_lora_only: If True, the generator base weights are frozen, and only their
+    LoRA adapters are trained (requires add_lora). Generator normalization layers stay
+    in eval mode, so batch normalization running statistics are not updated. Default is False.
     - use_replay_buffer: If True, use a replay buffer for adversarial loss. Default is False.
     - replay_buffer_size: Size of the replay buffer. Default is 50.
     - vanilla_loss: If True, use BCEWithLogitsLoss. Otherwise, use MSELoss. Default is True.
@@ -35,6 +45,19 @@ class CycleGAN(BaseModel):
     - step_size: Step size for learning rate scheduler. Default is 20.
     - gamma: Gamma for learning rate scheduler. Default is 0.5.
     - amp: If True, use automatic mixed precision. Default is False.
+    - fused_forward: If True, translation and identity images of each generator
+    are computed in a single batched forward. Not available with batch normalization,
+    as the batch statistics would mix both inputs. Default is False.
+    - compile_step: If True, generators and discriminators are compiled with torch.compile
+    (static shapes; a smaller last batch compiles once more). Not available with the PLP
+    loss, which needs double backward. Only used on CUDA devices: on CPU (where compiled
+    kernels need a C++ compiler) the networks are kept in eager mode. Default is False.
+    - compile_mode: torch.compile mode, e.g. 'default', 'reduce-overhead' (CUDA graphs)
+    or 'max-autotune'. Default is 'default'.
+    - fused_optimizer: If True, use fused (GPU) or foreach (CPU) Adam. Default is False.
+    - checkpoint_residual: If True, recompute the activations of the generator residual
+    blocks in the backward pass instead of storing them. Not available with batch
+    normalization, as the running statistics would be updated twice. Default is False.
     - device: 'cuda' or 'cpu'. Default is 'cpu'.
     """
     def __init__(self, input_nc=3, output_nc=3,
@@ -42,7 +65,8 @@ class CycleGAN(BaseModel):
                  norm_type='instance',
                  add_skip=False,
                  add_attention=None,
-                 add_lora=False, lora_rank=4,
+                 attention_chunk_size=None,
+                 add_lora=False, lora_rank=4, train_lora_only=False,
                  use_replay_buffer=False,
                  replay_buffer_size=50,
                  vanilla_loss=True,
@@ -52,8 +76,20 @@ class CycleGAN(BaseModel):
                  amp=False,
                  lr=0.0002, beta1=0.5, beta2=0.999,
                  step_size=20, gamma=0.5,
+                 fused_forward=False,
+                 compile_step=False, compile_mode='default',
+                 fused_optimizer=False,
+                 checkpoint_residual=False,
                  device='cpu'):
         super().__init__(device)
+        if fused_forward and norm_type == 'batch':
+            raise ValueError("fused_forward can not be used with norm_type='batch'.")
+        if checkpoint_residual and norm_type == 'batch':
+            raise ValueError("checkpoint_residual can not be used with norm_type='batch'.")
+        if compile_step and plp_loss_weight > 0:
+            raise ValueError("compile_step can not be used with the PLP loss (plp_loss_weight > 0).")
+        if train_lora_only and not add_lora:
+            raise ValueError("train_lora_only requires add_lora=True.")
 
         torch.cuda.empty_cache()
         gc.collect()
@@ -70,14 +106,17 @@ class CycleGAN(BaseModel):
             'add_lora': add_lora,
             'lora_rank': lora_rank,
             'add_attention': add_attention,
-            'norm_layer': norm_layer 
+            'attention_chunk_size': attention_chunk_size,
+            'norm_layer': norm_layer,
+            'checkpoint_residual': checkpoint_residual,
         }
 
         disc_params = {
             'input_nc': input_nc,
             'n_features': n_features, 
             'norm_layer': nn.InstanceNorm2d,
-            'add_attention': add_attention
+            'add_attention': add_attention,
+            'attention_chunk_size': attention_chunk_size,
         }
 
         self.gen_AtoB = Generator(**gen_params).to(self.device)
@@ -90,12 +129,21 @@ class CycleGAN(BaseModel):
         self.cycle_loss = nn.L1Loss().to(self.device)
         self.identity_loss = nn.L1Loss().to(self.device)
 
+        gen_parameters = []
+        for gen in [self.gen_AtoB, self.gen_BtoA]:
+            for name, param in gen.named_parameters():
+                if train_lora_only and not is_adapter_key(name):
+                    param.requires_grad_(False)
+                else:
+                    gen_parameters.append(param)
+
         # Setup optimizers using the BaseModel's helper function
-        self.optimizer_G = self.setup_optimizers(
-            list(self.gen_AtoB.parameters()) + list(self.gen_BtoA.parameters()), lr, beta1, beta2
-        )
-        self.optimizer_D_A = self.setup_optimizers(self.dis_A.parameters(), lr, beta1, beta2)
-        self.optimizer_D_B = self.setup_optimizers(self.dis_B.parameters(), lr, beta1, beta2)
+        self.optimizer_G = self.setup_optimizers(gen_parameters, lr, beta1, beta2,
+                                                 fused=fused_optimizer)
+        self.optimizer_D_A = self.setup_optimizers(self.dis_A.parameters(), lr, beta1, beta2,
+                                                   fused=fused_optimizer)
+        self.optimizer_D_B = self.setup_optimizers(self.dis_B.parameters(), lr, beta1, beta2,
+                                                   fused=fused_optimizer)
 
         self.scheduler_G = self.setup_schedulers(self.optimizer_G, step_size, gamma)
         self.scheduler_D_A = self.setup_schedulers(self.optimizer_D_A, step_size, gamma)
@@ -116,10 +164,34 @@ class CycleGAN(BaseModel):
         self.plp_A = PathLengthPenalty(beta=plp_beta, step=plp_step, device=device)
         self.plp_B = PathLengthPenalty(beta=plp_beta, step=plp_step, device=device)
 
+        self.fused_forward = fused_forward
         self.amp = amp
         if self.amp:
             self.scaler = torch.amp.GradScaler()
 
+        self.train_lora_only = train_lora_only
+        self.compiled = False
+        if compile_step:
+            self.compiled = self._compile_networks(compile_mode)
+
+
+    def _compile_networks(self, mode='default'):
+        """
+        Compile generators and discriminators in place (state dict keys are kept).
+
+        Returns False, and keeps the eager networks, if torch.compile is not available
+        or the device is not a GPU.
+        """
+        if not hasattr(torch, 'compile') or not hasattr(nn.Module, 'compile'):
+            print('torch.compile not available: running in eager mode')
+            return False
+        if torch.device(self.device).type != 'cuda':
+            print(f'torch.compile not used on {self.device}: running in eager mode')
+            return False
+        for net in [self.gen_AtoB, self.gen_BtoA, self.dis_A, self.dis_B]:
+            net.compile(mode=mode, dynamic=False)
+        return True
+
 
     def __str__(self):
         """String representation of the CycleGAN model."""
@@ -156,6 +228,12 @@ class CycleGAN(BaseModel):
         self.gen_BtoA.train()
         self.dis_A.train()
         self.dis_B.train()
+        if self.train_lora_only:
+            # Frozen base: running statistics are part of the base weights (and of their hash)
+            for gen in [self.gen_AtoB, self.gen_BtoA]:
+                for module in gen.modules():
+                    if isinstance(module, nn.BatchNorm2d):
+                        module.eval()
 
 
     def state_dict(self):
@@ -183,6 +261,21 @@ class CycleGAN(BaseModel):
         return fake_B, fake_A
 
 
+    def fused_forward_with_identity(self, real_A, real_B):
+        """
+        Forward pass for both generators, including the identity images.
+
+        Each generator runs once over the concatenation of the images it
+        translates and the images it should keep unchanged.
+        Returns (fake_B, fake_A, id_A, id_B).
+        """
+        out_B = self.gen_AtoB(torch.cat([real_A, real_B]))
+        out_A = self.gen_BtoA(torch.cat([real_B, real_A]))
+        fake_B, id_B = out_B[:len(real_A)], out_B[len(real_A):]
+        fake_A, id_A = out_A[:len(real_B)], out_A[len(real_B):]
+        return fake_B, fake_A, id_A, id_B
+
+
     def compute_loss(self, real_A, real_B, training=True, amp=False): # pylint: disable=arguments-differ
         """
         Computes the total loss for generators and discriminators
@@ -202,10 +295,13 @@ class CycleGAN(BaseModel):
                 loss_B = torch.tensor(0.0, device=self.device)
             return loss_A, loss_B
 
-        def _get_id_loss(real_A, real_B):
+        def _get_id_loss(real_A, real_B, id_A=None, id_B=None):
             if self.id_loss_weight > 0:
-                loss_A = self.identity_loss(self.gen_BtoA(real_A), real_A)
-                loss_B = self.identity_loss(self.gen_AtoB(real_B), real_B)
+                if id_A is None:
+                    id_A = self.gen_BtoA(real_A)
+                    id_B = self.gen_AtoB(real_B)
+                loss_A = self.identity_loss(id_A, real_A)
+                loss_B = self.identity_loss(id_B, real_B)
             else:
                 loss_A = torch.tensor(0.0, device=self.device)
                 loss_B = torch.tensor(0.0, device=self.device)
@@ -236,11 +332,15 @@ class CycleGAN(BaseModel):
                     real_A.requires_grad_()
                     real_B.requires_grad_()
 
-            fake_B, fake_A = self.forward(real_A, real_B)
+            if self.fused_forward and self.id_loss_weight > 0:
+                fake_B, fake_A, id_A, id_B = self.fused_forward_with_identity(real_A, real_B)
+            else:
+                fake_B, fake_A = self.forward(real_A, real_B)
+                id_A, id_B = None, None
             loss_plp_A, loss_plp_B = _get_plp_loss(real_A, real_B, fake_A, fake_B)
             loss_adv_AtoB, loss_adv_BtoA = _get_adv_loss(fake_A, fake_B)
             loss_cycle_A, loss_cycle_B = _get_cycle_loss(real_A, real_B, fake_A, fake_B)
-            loss_id_A, loss_id_B = _get_id_loss(real_A, real_B)
+            loss_id_A, loss_id_B = _get_id_loss(real_A, real_B, id_A, id_B)
 
             loss_G_ad = loss_adv_AtoB + loss_adv_BtoA
             loss_G_cycle = loss_cycle_A + loss_cycle_B
@@ -286,43 +386,62 @@ class CycleGAN(BaseModel):
         )
 
 
-    def optimize(self, real_A, real_B): # pylint: disable=arguments-differ
+    def optimize(self, real_A, real_B, profiler=None): # pylint: disable=arguments-differ
         """
         Perform one optimization step for the generators and discriminators.
+
+        Args:
+        - real_A: Batch of images from domain A.
+        - real_B: Batch of images from domain B.
+        - profiler: Optional StepProfiler, to time the forward, backward and
+        optimizer step sections. Default is None.
         """
         self.train()
+        section = profiler.section if profiler is not None else lambda name: nullcontext()
 
         if self.amp:
-            with torch.autocast(device_type=str(self.device)):
+            with section('forward'), torch.autocast(device_type=str(self.device)):
                 loss = self.compute_loss(real_A, real_B)
 
             self.optimizer_G.zero_grad()
-            self.scaler.scale(loss.loss_G).backward()
-            self.scaler.step(self.optimizer_G)
+            with section('backward'):
+                self.scaler.scale(loss.loss_G).backward()
+            with section('step'):
+                self.scaler.step(self.optimizer_G)
 
             self.optimizer_D_A.zero_grad()
-            self.scaler.scale(loss.loss_D_A).backward()
-            self.scaler.step(self.optimizer_D_A)
+            with section('backward'):
+                self.scaler.scale(loss.loss_D_A).backward()
+            with section('step'):
+                self.scaler.step(self.optimizer_D_A)
 
             self.optimizer_D_B.zero_grad()
-            self.scaler.scale(loss.loss_D_B).backward()
-            self.scaler.step(self.optimizer_D_B)
-
-            self.scaler.update()
+            with section('backward'):
+                self.scaler.scale(loss.loss_D_B).backward()
+            with section('step'):
+                self.scaler.step(self.optimizer_D_B)
+                self.scaler.update()
         else:
-            loss = self.compute_loss(real_A, real_B)
+            with section('forward'):
+                loss = self.compute_loss(real_A, real_B)
 
             self.optimizer_G.zero_grad()
-            loss.loss_G.backward()
-            self.optimizer_G.step()
+            with section('backward'):
+                loss.loss_G.backward()
+            with section('step'):
+                self.optimizer_G.step()
 
             self.optimizer_D_A.zero_grad()
-            loss.loss_D_A.backward()
-            self.optimizer_D_A.step()
+            with section('backward'):
+                loss.loss_D_A.backward()
+            with section('step'):
+                self.optimizer_D_A.step()
 
             self.optimizer_D_B.zero_grad()
-            loss.loss_D_B.backward()
-            self.optimizer_D_B.step()
+            with section('backward'):
+                loss.loss_D_B.backward()
+            with section('step'):
+                self.optimizer_D_B.step()
 
         return loss
 
@@ -335,14 +454,16 @@ class CycleGAN(BaseModel):
         self.scheduler_D_B.step()
 
 
-    def save_model(self, path='cycle_gan_model.pth', epoch=0):
+    def get_checkpoint(self, epoch=0, extra=None):
         """
-        Save the current model state.
+        Return the current model state (networks and optimizers).
 
         Args:
-        - path: Path to save the model. Default is 'cycle_gan_model.pth'.
+        - epoch: Epoch saved with the state. Default is 0.
+        - extra: Training loop state saved with the model (e.g. early stopping),
+        read back with `read_checkpoint_extra`. Default is None.
         """
-        torch.save({
+        return {
             'gen_AtoB': self.gen_AtoB.state_dict(),
             'gen_BtoA': self.gen_BtoA.state_dict(),
             'dis_A': self.dis_A.state_dict(),
@@ -351,7 +472,32 @@ class CycleGAN(BaseModel):
             'optimizer_D_A': self.optimizer_D_A.state_dict(),
             'optimizer_D_B': self.optimizer_D_B.state_dict(),
             'epoch': epoch,
-        }, path)
+            'extra': extra or {},
+        }
+
+
+    def save_model(self, path='cycle_gan_model.pth', epoch=0, writer=None, score=None, callback=None,
+                   rotate=True, extra=None):
+        """
+        Save the current model state.
+
+        Args:
+        - path: Path to save the model. Default is 'cycle_gan_model.pth'.
+        - epoch: Epoch saved with the state. Default is 0.
+        - writer: CheckpointWriter. If given, the state is saved in the background.
+        Default is None (save now).
+        - score: Checkpoint score for the writer retention policy (lower is better). Default is None.
+        - callback: Called with the path after the file is written. Default is None.
+        - rotate: If False, the file is kept out of the writer retention policy. Default is True.
+        - extra: Training loop state saved with the model. Default is None.
+        """
+        if writer is not None:
+            writer.submit(self.get_checkpoint(epoch, extra), path, score=score, callback=callback,
+                          rotate=rotate)
+            return
+        torch.save(self.get_checkpoint(epoch, extra), path)
+        if callback is not None:
+            callback(path)
 
 
     def load_model(self, path):
@@ -361,7 +507,10 @@ class CycleGAN(BaseModel):
         Args:
         - path: Path to the saved model.
         """
-        checkpoint = torch.load(path, weights_only=True)
+        checkpoint = torch.load(path, weights_only=True, map_location=self.device)
+        if 'base_hash' in checkpoint:
+            raise ValueError(f'{path} is an adapter-only checkpoint: use load_adapters, '
+                             'or restart training from a full checkpoint.')
 
         self.gen_AtoB.load_state_dict(checkpoint['gen_AtoB'])
         self.gen_BtoA.load_state_dict(checkpoint['gen_BtoA'])
@@ -374,6 +523,107 @@ class CycleGAN(BaseModel):
         return checkpoint['epoch']
 
 
+    @staticmethod
+    def read_checkpoint_extra(path):
+        """
+        Read the training loop state saved with a checkpoint (`save_model(extra=...)`).
+
+        The file is memory-mapped, so the network weights are not read.
+        Returns an empty dict for checkpoints saved without it.
+
+        Args:
+        - path: Path to the saved model.
+        """
+        checkpoint = torch.load(path, weights_only=True, map_location='cpu', mmap=True)
+        return checkpoint.get('extra', {})
+
+
+    def load_base(self, path):
+        """
+        Load the network weights of a full checkpoint as the base for LoRA adapters.
+
+        Adapters, if any in the checkpoint, and optimizer states are not loaded.
+
+        Args:
+        - path: Path to the saved model (`save_model`).
+        """
+        checkpoint = torch.load(path, weights_only=True, map_location=self.device)
+
+        load_base_weights(self.gen_AtoB, checkpoint['gen_AtoB'])
+        load_base_weights(self.gen_BtoA, checkpoint['gen_BtoA'])
+        self.dis_A.load_state_dict(checkpoint['dis_A'])
+        self.dis_B.load_state_dict(checkpoint['dis_B'])
+
+        return checkpoint['epoch']
+
+
+    def get_adapters(self, epoch=0):
+        """
+        Return the generator LoRA adapters, with the hashes of their base weights.
+
+        Args:
+        - epoch: Epoch saved with the adapters. Default is 0.
+        """
+        adapters = {
+            'gen_AtoB': adapter_state_dict(self.gen_AtoB),
+            'gen_BtoA': adapter_state_dict(self.gen_BtoA),
+        }
+        if len(adapters['gen_AtoB']) == 0:
+            raise ValueError('The generators have no LoRA adapters (add_lora=False).')
+        adapters['base_hash'] = {
+            'gen_AtoB': base_weights_hash(self.gen_AtoB),
+            'gen_BtoA': base_weights_hash(self.gen_BtoA),
+        }
+        adapters['epoch'] = epoch
+        return adapters
+
+
+    def save_adapters(self, path='cycle_gan_adapters.pth', epoch=0, writer=None, score=None, callback=None,
+                      rotate=True):
+        """
+        Save only the generator LoRA adapters (no base weights, discriminators or optimizers).
+
+        Args:
+        - path: Path to save the adapters. Default is 'cycle_gan_adapters.pth'.
+        - epoch: Epoch saved with the adapters. Default is 0.
+        - writer: CheckpointWriter. If given, the file is saved in the background.
+        Default is None (save now).
+        - score: Checkpoint score for the writer retention policy (lower is better). Default is None.
+        - callback: Called with the path after the file is written. Default is None.
+        - rotate: If False, the file is kept out of the writer retention policy. Default is True.
+        """
+        if writer is not None:
+            writer.submit(self.get_adapters(epoch), path, score=score, callback=callback,
+                          rotate=rotate)
+            return
+        torch.save(self.get_adapters(epoch), path)
+        if callback is not None:
+            callback(path)
+
+
+    def load_adapters(self, path):
+        """
+        Load generator LoRA adapters saved by `save_adapters`.
+
+        Raises ValueError if the current base weights are not the ones
+        the adapters were trained on.
+
+        Args:
+        - path: Path to the saved adapters.
+        """
+        adapters = torch.load(path, weights_only=True, map_location=self.device)
+
+        for name, gen in [('gen_AtoB', self.gen_AtoB), ('gen_BtoA', self.gen_BtoA)]:
+            check_base_hash(name, adapters['base_hash'][name], gen)
+            missing, unexpected = gen.load_state_dict(adapters[name], strict=False)
+            missing = [k for k in missing if is_adapter_key(k)]
+            if missing or unexpected:
+                raise RuntimeError(f'Error loading adapters of {name}. Missing keys: {missing}. '
+                                   f'Unexpected keys: {unexpected}.')
+
+        return adapters['epoch']
+
+
     def generate_samples(self, real_A, real_B, n_images=4):
         """
         Generate samples with real, fake, reconstructed and identity images.
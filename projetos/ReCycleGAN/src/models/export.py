@@ -0,0 +1,125 @@
+# pylint: disable=invalid-name
+"""Export CycleGAN generators for inference.
+
+Only the generators are rebuilt from a training checkpoint, and are saved
+as TorchScript or ONNX artifacts, with a JSON sidecar file describing the
+expected input. The artifacts can be run with `src/scripts/translate_exported.py`,
+which only depends on torch (and onnxruntime, for ONNX files).
+"""
+import json
+from pathlib import Path
+import torch
+from torch.ao.quantization import get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+from .networks import Generator, get_norm_layer
+
+GENERATORS = ['gen_AtoB', 'gen_BtoA']
+
+def build_generator(params):
+    """Build a Generator from the training hyperparameters."""
+    return Generator(
+        input_nc=params['channels'],
+        output_nc=params['channels'],
+        n_residual_blocks=params['n_residual_blocks'],
+        n_features=params['n_features'],
+        n_downsampling=params['n_downsampling'],
+        add_skip=params['add_skip'],
+        add_lora=params.get('add_lora', False),
+        lora_rank=params.get('lora_rank', 4),
+        add_attention=params.get('add_attention'),
+        norm_layer=get_norm_layer(params['norm_type']),
+    )
+
+def load_generators(checkpoint_path, params):
+    """Load the generators of a CycleGAN checkpoint, on CPU and in eval mode.
+
+    Discriminators, optimizers and schedulers in the checkpoint are ignored.
+    Returns a dict with keys 'gen_AtoB' and 'gen_BtoA'.
+    """
+    checkpoint = torch.load(checkpoint_path, weights_only=True, map_location='cpu')
+    generators = {}
+    for name in GENERATORS:
+        generator = build_generator(params)
+        generator.load_state_dict(checkpoint[name])
+        generators[name] = generator.eval()
+    return generators
+
+def quantize_int8(generator, calibration_imgs):
+    """Static int8 quantization of a generator, for CPU inference.
+
+    Dynamic quantization only covers Linear and recurrent layers, so it
+    would leave the convolutions of the generator in float32. Activation
+    ranges are calibrated instead with a few batches of real images.
+
+    Args:
+    - generator: Generator in eval mode.
+    - calibration_imgs: Iterable of image batches, normalized to [-1, 1].
+    """
+    calibration_imgs = list(calibration_imgs)
+    if len(calibration_imgs) == 0:
+        raise ValueError('int8 quantization needs calibration images.')
+    torch.backends.quantized.engine = 'x86' if 'x86' in torch.backends.quantized.supported_engines else 'qnnpack'
+    qconfig = get_default_qconfig_mapping(torch.backends.quantized.engine)
+    prepared = prepare_fx(generator, qconfig, (calibration_imgs[0],))
+    with torch.no_grad():
+        for batch in calibration_imgs:
+            prepared(batch)
+    return convert_fx(prepared)
+
+def export_generator(generator, path, img_size=(256, 256), fmt='torchscript',
+                     channels_last=False, int8=False, calibration_imgs=None):
+    """Export a generator for inference.
+
+    Args:
+    - generator: Generator in eval mode.
+    - path: Output file. A JSON file with the same name describes the input.
+    - img_size: (height, width) of the example input. Default is (256, 256).
+    - fmt: 'torchscript' or 'onnx'. Default is 'torchscript'.
+    - channels_last: If True, use channels_last memory format. Default is False.
+    - int8: If True, quantize to int8 (TorchScript only). Default is False.
+    - calibration_imgs: Image batches used for int8 calibration. Default is None.
+
+    Returns the path of the exported file.
+    """
+    if fmt not in ['torchscript', 'onnx']:
+        raise ValueError(f'Unknown export format: {fmt}')
+    if int8 and fmt != 'torchscript':
+        raise ValueError('int8 quantization is only available for TorchScript exports.')
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    input_nc = generator.initial_layers[1].in_channels
+    example = torch.zeros(1, input_nc, *img_size)
+
+    model = generator.eval()
+    if int8:
+        model = quantize_int8(model, calibration_imgs or [])
+    if channels_last:
+        model = model.to(memory_format=torch.channels_last)
+        example = example.contiguous(memory_format=torch.channels_last)
+
+    with torch.no_grad():
+        if fmt == 'torchscript':
+            traced = torch.jit.trace(model, example)
+            traced = torch.jit.freeze(traced.eval())
+            traced.save(str(path))
+        else:
+            torch.onnx.export(model, example, str(path),
+                              input_names=['input'], output_names=['output'],
+                              dynamic_axes={'input': {0: 'batch', 2: 'height', 3: 'width'},
+                                            'output': {0: 'batch', 2: 'height', 3: 'width'}})
+
+    metadata = {
+        'format': fmt,
+        'channels_last': channels_last,
+        'int8': int8,
+        'input_nc': input_nc,
+        'img_height': img_size[0],
+        'img_width': img_size[1],
+        'mean': 0.5,
+        'std': 0.5,
+    }
+    with open(path.with_suffix('.json'), 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, indent=4)
+    return path
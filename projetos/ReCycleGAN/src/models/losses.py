@@ -15,15 +15,24 @@ class Loss:
     loss_G_id: torch.Tensor
     loss_G_plp: torch.Tensor
 
+LOSS_NAMES = ['loss_G', 'loss_D_A', 'loss_D_B', 'loss_G_ad', 'loss_G_cycle', 'loss_G_id', 'loss_G_plp']
+
 class LossValues:
     """Class for CycleGAN losses as float.
 
+    Losses are accumulated as a running sum on their device, detached
+    from the graph, so adding a step does not force a host-device
+    synchronization. The sums are only read back to the host every
+    `sync_interval` steps and in `normalize`.
+
     Args:
     - n_A (int): Number of batches in domain A.
     - n_B (int): Number of batches in domain B.
     - plp_step (int): Steps between Path Length Penalty calculations.
+    - sync_interval (int): Steps between reads of the sums. If zero, the sums
+    are only read in `normalize`. Default is 0.
     """
-    def __init__(self, n_A, n_B, plp_step):
+    def __init__(self, n_A, n_B, plp_step, sync_interval=0):
         self.loss_G = 0
         self.loss_D_A = 0
         self.loss_D_B = 0
@@ -35,19 +44,33 @@ class LossValues:
         self.n_a = n_A
         self.n_b = n_B
         self.plp_step = plp_step
+        self.sync_interval = sync_interval
+        self._sums = None
+        self._steps = 0
 
     def add(self, loss: Loss):
         """Adds the losses to the respective values."""
-        self.loss_G += loss.loss_G.item()
-        self.loss_D_A += loss.loss_D_A.item()
-        self.loss_D_B += loss.loss_D_B.item()
-        self.loss_G_ad += loss.loss_G_ad.item()
-        self.loss_G_cycle += loss.loss_G_cycle.item()
-        self.loss_G_id += loss.loss_G_id.item()
-        self.loss_G_plp += loss.loss_G_plp.item()
+        values = torch.stack([getattr(loss, name).detach().reshape(()).double()
+                              for name in LOSS_NAMES])
+        if self._sums is None:
+            self._sums = values
+        else:
+            self._sums += values
+        self._steps += 1
+        if self.sync_interval > 0 and self._steps % self.sync_interval == 0:
+            self.sync()
+
+    def sync(self):
+        """Adds the sums on the device to the float values, and resets them."""
+        if self._sums is None:
+            return
+        for name, value in zip(LOSS_NAMES, self._sums.tolist()):
+            setattr(self, name, getattr(self, name) + value)
+        self._sums = None
 
     def normalize(self):
         """Normalizes the losses by the number of samples."""
+        self.sync()
         self.loss_G /= (self.n_a + self.n_b)/2
         self.loss_D_A /= self.n_a
         self.loss_D_B /= self.n_b
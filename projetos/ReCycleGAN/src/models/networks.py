@@ -1,12 +1,11 @@
 # pylint: disable=line-too-long,invalid-name
 """Module with network constructors and loss functions."""
 import math
-import random
 import functools
 import torch
 from torch import nn
 import torch.nn.functional as F
-from peft import LoraConfig
+from torch.utils.checkpoint import checkpoint
 
 class Identity(nn.Module):
     """Identity layer."""
@@ -37,6 +36,60 @@ def get_norm_layer(norm_type='instance'):
     return norm_layer
 
 
+class LoRAMixin:
+    """
+    Low-rank adapter (LoRA) added to the weight of a convolution.
+
+    The layer runs with `weight + alpha / rank * (lora_B @ lora_A)`, reshaped
+    to the weight shape. lora_B starts at zero, so a new layer computes the same
+    as the base convolution. Base weight and bias keep their state dict keys.
+    """
+    def init_lora(self, rank=4, alpha=None):
+        """Create the adapter parameters (alpha defaults to rank, i.e., scale 1)."""
+        self.lora_A = nn.Parameter(torch.empty(rank, self.weight[0].numel()))
+        self.lora_B = nn.Parameter(torch.zeros(self.weight.shape[0], rank))
+        nn.init.kaiming_uniform_(self.lora_A, a=math.sqrt(5))
+        self.lora_scale = (alpha if alpha is not None else rank) / rank
+
+    def lora_weight(self):
+        """Base weight plus the adapter delta."""
+        return self.weight + self.lora_scale * (self.lora_B @ self.lora_A).view_as(self.weight)
+
+class LoRAConv2d(LoRAMixin, nn.Conv2d):
+    """
+    nn.Conv2d with a LoRA adapter.
+
+    Args:
+    - rank: Adapter rank. Default is 4.
+    - alpha: Adapter scale is alpha / rank. Default is rank.
+    Other arguments are passed to nn.Conv2d.
+    """
+    def __init__(self, *args, rank=4, alpha=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.init_lora(rank, alpha)
+
+    def forward(self, x):
+        """Forward pass through the adapted convolution."""
+        return self._conv_forward(x, self.lora_weight(), self.bias)
+
+class LoRAConvTranspose2d(LoRAMixin, nn.ConvTranspose2d):
+    """
+    nn.ConvTranspose2d with a LoRA adapter.
+
+    Args:
+    - rank: Adapter rank. Default is 4.
+    - alpha: Adapter scale is alpha / rank. Default is rank.
+    Other arguments are passed to nn.ConvTranspose2d.
+    """
+    def __init__(self, *args, rank=4, alpha=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.init_lora(rank, alpha)
+
+    def forward(self, x):
+        """Forward pass through the adapted transposed convolution."""
+        return F.conv_transpose2d(x, self.lora_weight(), self.bias, self.stride, self.padding,
+                                  self.output_padding, self.groups, self.dilation)
+
 class ResidualBlock(nn.Module):
     """
     Residual block.
@@ -44,17 +97,18 @@ class ResidualBlock(nn.Module):
     Args:
     - in_features: Number of features.
     - norm_layer: Normalization layer. Default is nn.InstanceNorm2d.
+    - conv_layer: Convolution layer. Default is nn.Conv2d.
     """
-    def __init__(self, in_features, norm_layer=nn.InstanceNorm2d):
+    def __init__(self, in_features, norm_layer=nn.InstanceNorm2d, conv_layer=nn.Conv2d):
         super().__init__()
 
         conv_block = [
             nn.ReflectionPad2d(1),
-            nn.Conv2d(in_features, in_features, 3),
+            conv_layer(in_features, in_features, 3),
             norm_layer(in_features),
             nn.ReLU(inplace=True),
             nn.ReflectionPad2d(1),
-            nn.Conv2d(in_features, in_features, 3),
+            conv_layer(in_features, in_features, 3),
             norm_layer(in_features)
         ]
 
@@ -65,9 +119,23 @@ class ResidualBlock(nn.Module):
         return x + self.conv_block(x)
 
 class SelfAttention(nn.Module):
-    def __init__(self, in_channels):
+    """
+    Self-attention layer over a 4x average-pooled feature map.
+
+    Attention is computed with `F.scaled_dot_product_attention` (unscaled
+    dot products), so flash/memory-efficient kernels are used when available
+    and the (HW/16)x(HW/16) attention matrix is not stored. If no fused kernel
+    is available, the math kernel builds the full matrix.
+
+    Args:
+    - in_channels: Number of input channels.
+    - chunk_size: If given, queries are processed in chunks of this size on CPU,
+    which bounds the memory of the math kernel. Default is None.
+    """
+    def __init__(self, in_channels, chunk_size=None):
         super(SelfAttention, self).__init__()
         self.in_channels = in_channels
+        self.chunk_size = chunk_size
 
         # Reduce spatial dimensions and channels for efficiency
         self.query_conv = nn.Conv2d(in_channels, in_channels // 8, kernel_size=1)
@@ -78,35 +146,34 @@ class SelfAttention(nn.Module):
         self.pool = nn.AvgPool2d(kernel_size=4, stride=4)
 
         self.gamma = nn.Parameter(torch.zeros(1))
-        self.softmax = nn.Softmax(dim=-1)
 
     def forward(self, x):
         """Forward pass through the self-attention layer."""
         batch_size, channels, height, width = x.size()
 
-        # Reduce spatial dimensions for key and query
+        # Reduce spatial dimensions for key, query and value
         x_pooled = self.pool(x)
         pooled_height, pooled_width = x_pooled.shape[2:]
 
-        # Project and reshape query
-        proj_query = self.query_conv(x_pooled)  # Use pooled input for query too
-        proj_query = proj_query.view(batch_size, -1, pooled_height * pooled_width)  # (B, C', HW/16)
-
-        # Project and reshape key (using pooled input)
-        proj_key = self.key_conv(x_pooled)
-        proj_key = proj_key.view(batch_size, -1, pooled_height * pooled_width)  # (B, C', HW/16)
-
-        # Project and reshape value (using pooled input)
-        proj_value = self.value_conv(x_pooled)
-        proj_value = proj_value.view(batch_size, -1, pooled_height * pooled_width)  # (B, C, HW/16)
-
-        # Calculate attention with reduced spatial dimensions
-        energy = torch.bmm(proj_query.permute(0, 2, 1), proj_key)  # (B, HW/16, HW/16)
-        attention = self.softmax(energy)
+        # Single-head (B, 1, HW/16, C) layout, contiguous in C, as expected by the fused kernels
+        proj_query = self.query_conv(x_pooled).flatten(2).transpose(1, 2).unsqueeze(1)  # (B, 1, HW/16, C')
+        proj_key = self.key_conv(x_pooled).flatten(2).transpose(1, 2).unsqueeze(1)  # (B, 1, HW/16, C')
+        proj_value = self.value_conv(x_pooled).flatten(2).transpose(1, 2).unsqueeze(1).contiguous()  # (B, 1, HW/16, C)
+
+        if self.chunk_size is not None and not x.is_cuda:
+            out = torch.cat([
+                F.scaled_dot_product_attention(proj_query[:, :, i:i + self.chunk_size],
+                                               proj_key, proj_value, scale=1.0)
+                for i in range(0, proj_query.shape[2], self.chunk_size)
+            ], dim=2)
+        else:
+            # Fused kernels need the same head size in query, key and value: zero padding
+            # query and key keeps their dot products
+            pad = (0, proj_value.shape[3] - proj_query.shape[3])
+            out = F.scaled_dot_product_attention(F.pad(proj_query, pad), F.pad(proj_key, pad),
+                                                 proj_value, scale=1.0)
 
-        # Apply attention and reshape
-        out = torch.bmm(proj_value, attention.permute(0, 2, 1))  # (B, C, HW/16)
-        out = out.view(batch_size, channels, pooled_height, pooled_width)
+        out = out.squeeze(1).transpose(1, 2).reshape(batch_size, channels, pooled_height, pooled_width)
         out = F.interpolate(out, size=(height, width), mode='bilinear', align_corners=False)
 
         return self.gamma * out + x
@@ -122,10 +189,17 @@ class Generator(nn.Module):
     - n_features: Number of features. Default is 64.
     - n_downsampling: Number of downsampling layers. Default is 2.
     - add_skip: If True, add skip connections. Default is False.
-    - add_lora: If True, add LoRA adapters. Default is False.
-    - lora_rank: define LoRA rank.
+    - add_lora: If True, add LoRA adapters to the encoder, residual and decoder convolutions
+    (initial and final layers are not adapted). Default is False.
+    - lora_rank: LoRA rank. Default is 4.
     - add_attention: If gen, add self-attention layer to the generator. If disc, to the discriminator.
+    - attention_chunk_size: Query chunk size of the self-attention layers on CPU
+    (see SelfAttention). Default is None.
     - norm_layer: Normalization layer. Default is nn.InstanceNorm2d.
+    - checkpoint_residual: If True, the activations of the residual blocks are not stored
+    during training, and are recomputed in the backward pass (torch.utils.checkpoint).
+    Not available with batch normalization, as the recomputation would update the
+    running statistics twice. Default is False.
     """
     def __init__(self,
                  input_nc,
@@ -137,7 +211,9 @@ class Generator(nn.Module):
                  add_lora=False,
                  lora_rank=4,
                  add_attention=None,
-                 norm_layer=nn.InstanceNorm2d):
+                 attention_chunk_size=None,
+                 norm_layer=nn.InstanceNorm2d,
+                 checkpoint_residual=False):
         super().__init__()
 
         self.initial_layers = nn.Sequential(
@@ -147,50 +223,38 @@ class Generator(nn.Module):
             nn.ReLU(inplace=True),
         )
 
-        self.encoder = nn.ModuleList()
         if add_lora:
-            self.lora_modules_encoder = []
+            conv_2d = functools.partial(LoRAConv2d, rank=lora_rank, alpha=lora_rank)
+            conv_transpose_2d = functools.partial(LoRAConvTranspose2d, rank=lora_rank, alpha=lora_rank)
+        else:
+            conv_2d = nn.Conv2d
+            conv_transpose_2d = nn.ConvTranspose2d
 
+        self.encoder = nn.ModuleList()
         for i in range(n_downsampling):
             n_feat = n_features * 2 ** i
-            conv_layer = nn.Conv2d(n_feat, 2 * n_feat, 3, stride=2, padding=1)
             self.encoder.append(nn.Sequential(
-                conv_layer,
+                conv_2d(n_feat, 2 * n_feat, 3, stride=2, padding=1),
                 norm_layer(2 * n_feat),
             ))
 
-            if add_lora:
-                lora_conf = LoraConfig(r=lora_rank, target_modules=[conv_layer], lora_alpha=lora_rank)
-                self.lora_modules_encoder.append(lora_conf)
-
         n_feat = n_features * 2 ** n_downsampling
         self.residual_blocks = nn.Sequential(
-            *[ResidualBlock(n_feat, norm_layer) for _ in range(n_residual_blocks)]
+            *[ResidualBlock(n_feat, norm_layer, conv_2d) for _ in range(n_residual_blocks)]
         )
 
-        if add_lora:
-            self.lora_modules_residual = []
-            for block in self.residual_blocks:
-                for module in block.conv_block:
-                    if isinstance(module, nn.Conv2d):
-                        lora_conf = LoraConfig(r=lora_rank, target_modules=[module], lora_alpha=lora_rank)
-                        self.lora_modules_residual.append(lora_conf)
-
         self.decoder = nn.ModuleList()
-        if add_lora:
-            self.lora_modules_decoder = []
-
         for i in range(n_downsampling):
             n_feat = n_features * 2 ** (n_downsampling - i)
-            conv_layer = nn.ConvTranspose2d(n_feat, n_feat // 2, 3,
-                                   stride=2, padding=1, output_padding=1)
+            conv_layer = conv_transpose_2d(n_feat, n_feat // 2, 3,
+                                           stride=2, padding=1, output_padding=1)
 
             if add_attention in ['gen', 'both']:
                 self.decoder.append(nn.Sequential(
                     conv_layer,
                     norm_layer(n_feat // 2),
                     nn.ReLU(inplace=True),
-                    SelfAttention(in_channels=n_feat // 2)
+                    SelfAttention(in_channels=n_feat // 2, chunk_size=attention_chunk_size)
                 ))
             else:
                 self.decoder.append(nn.Sequential(
@@ -199,20 +263,17 @@ class Generator(nn.Module):
                     nn.ReLU(inplace=True),
                 ))
 
-            if add_lora:
-                lora_conf = LoraConfig(r=lora_rank, target_modules=[conv_layer], lora_alpha=lora_rank)
-                self.lora_modules_decoder.append(lora_conf)
-
-
-
-
         self.final_layers = nn.Sequential(
             nn.ReflectionPad2d(3),
             nn.Conv2d(n_features, output_nc, 7),
             nn.Tanh(),
         )
 
+        if checkpoint_residual and any(isinstance(m, nn.BatchNorm2d) for m in self.residual_blocks.modules()):
+            raise ValueError('checkpoint_residual can not be used with batch normalization.')
+
         self.add_skip = add_skip
+        self.checkpoint_residual = checkpoint_residual
 
     def forward(self, x):
         """Forward pass through the generator."""
@@ -224,7 +285,11 @@ class Generator(nn.Module):
             if self.add_skip:
                 skips.append(x)
 
-        x = self.residual_blocks(x)
+        if self.checkpoint_residual and torch.is_grad_enabled():
+            for block in self.residual_blocks:
+                x = checkpoint(block, x, use_reentrant=False)
+        else:
+            x = self.residual_blocks(x)
 
         if self.add_skip:
             for i, layer in enumerate(self.decoder):
@@ -244,12 +309,15 @@ class Discriminator(nn.Module):
     - n_features: Number of features. Default is 64.
     - norm_layer: Normalization layer. Default is nn.InstanceNorm2d.
     - add_attention: If True, add self-attention layer to the discriminator. Default is False.
+    - attention_chunk_size: Query chunk size of the self-attention layer on CPU
+    (see SelfAttention). Default is None.
     """
     def __init__(self,
                  input_nc,
                  n_features=64,
                  norm_layer=nn.InstanceNorm2d,
                  add_attention=None,
+                 attention_chunk_size=None,
                  ):
         super().__init__()
 
@@ -262,7 +330,7 @@ class Discriminator(nn.Module):
         ]
 
         if add_attention in ['disc', 'both']:
-            layers.append(SelfAttention(in_channels=8 * n_features))
+            layers.append(SelfAttention(in_channels=8 * n_features, chunk_size=attention_chunk_size))
 
         layers.append(nn.Conv2d(8 * n_features, 1, 4, padding=1))
 
@@ -356,24 +424,42 @@ class ReplayBuffer:
 
     def __init__(self, max_size: int = 50):
         self.max_size = max_size
-        self.data = []
+        self.data = None
+        self.size = 0
 
     def push_and_pop(self, data: torch.Tensor):
-        """Add/retrieve an image."""
+        """Add/retrieve a batch of images.
+
+        The buffer is a single tensor (allocated on the first call, on the
+        device of the images), with one extra scratch row. While the buffer
+        is not full, images are stored and returned unchanged. Afterwards,
+        each image is swapped with a random stored image with probability
+        0.5. The choice is made for the whole batch at once, on the device.
+        If two images of the same batch pick the same slot, both receive the
+        old image and only one of them is stored.
+        """
         data = data.detach()
-        res = []
-        for element in data:
-            if len(self.data) < self.max_size:
-                self.data.append(element)
-                res.append(element)
-            else:
-                if random.uniform(0, 1) > 0.5:
-                    i = random.randint(0, self.max_size - 1)
-                    res.append(self.data[i].clone())
-                    self.data[i] = element
-                else:
-                    res.append(element)
-        return torch.stack(res)
+        if self.data is None:
+            self.data = torch.empty((self.max_size + 1, *data.shape[1:]),
+                                    dtype=data.dtype, device=data.device)
+
+        n_fill = min(self.max_size - self.size, len(data))
+        if n_fill > 0:
+            self.data[self.size:self.size + n_fill] = data[:n_fill]
+            self.size += n_fill
+        if n_fill == len(data):
+            return data
+
+        new = data[n_fill:]
+        swap = torch.rand(len(new), device=new.device) > 0.5
+        idx = torch.randint(0, self.max_size, (len(new),), device=new.device)
+        old = self.data[idx].to(new.dtype)
+        res = torch.where(swap.view(-1, *[1] * (new.dim() - 1)), old, new)
+
+        # Images not swapped are written to the scratch row.
+        idx = torch.where(swap, idx, torch.full_like(idx, self.max_size))
+        self.data.index_copy_(0, idx, new.to(self.data.dtype))
+        return torch.cat([data[:n_fill], res])
 
 class PathLengthPenalty(nn.Module):
     """Path Length Regularization.
@@ -65,10 +65,83 @@ def copy_images(df, src_dir, dst_dir, src_name_modifier=''):
         else:
             print(f"File not found: {src_path.name}")
 
-def search_and_copy_b_images(df, src_dir, base_img_dir, dst_dir, threshold=1e-5):
+def image_hash(img, hash_size=8):
+    """
+    Average hash of an image.
+
+    The image is reduced to a (hash_size x hash_size) grayscale thumbnail,
+    and each bit tells if a pixel is brighter than the thumbnail mean.
+    Small pixel differences only flip a few bits.
+
+    Parameters:
+    ------------
+    img: PIL.Image
+        The image.
+    hash_size: int
+        Size of the thumbnail.
+        (Default: 8)
+
+    Returns:
+    ---------
+    int
+        The hash, with hash_size² bits.
+    """
+    thumb = np.asarray(img.convert('L').resize((hash_size, hash_size), Image.BOX), dtype=np.float32)
+    bits = (thumb > thumb.mean()).flatten()
+    return int(''.join('1' if b else '0' for b in bits), 2)
+
+class BKTree():
+    """
+    BK-tree of hashes, to find hashes within a Hamming distance.
+
+    Each node stores a hash, the list of items with that hash, and its
+    children indexed by their distance to the node.
+    """
+    def __init__(self):
+        self.root = None
+
+    @staticmethod
+    def distance(hash1, hash2):
+        """Hamming distance between two hashes."""
+        return (hash1 ^ hash2).bit_count()
+
+    def add(self, hash_value, item):
+        """Add an item with its hash."""
+        if self.root is None:
+            self.root = (hash_value, [item], {})
+            return
+        node = self.root
+        while True:
+            d = self.distance(hash_value, node[0])
+            if d == 0:
+                node[1].append(item)
+                return
+            if d not in node[2]:
+                node[2][d] = (hash_value, [item], {})
+                return
+            node = node[2][d]
+
+    def search(self, hash_value, max_distance):
+        """Items within `max_distance` of the hash, as a list of (distance, item) sorted by distance."""
+        out = []
+        nodes = [self.root] if self.root is not None else []
+        while nodes:
+            node = nodes.pop()
+            d = self.distance(hash_value, node[0])
+            if d <= max_distance:
+                out += [(d, item) for item in node[1]]
+            for d_child, child in node[2].items():
+                if d - max_distance <= d_child <= d + max_distance:
+                    nodes.append(child)
+        return sorted(out, key=lambda x: x[0])
+
+def search_and_copy_b_images(df, src_dir, base_img_dir, dst_dir, threshold=1e-5, max_distance=10):
     """
     Search similar images in the source directory and copy them to the destination directory.
 
+    The source images are indexed by their average hash (see `image_hash`),
+    so only the images with a close hash are compared pixel by pixel.
+
     Parameters:
     ------------
     df: pd.DataFrame
@@ -79,28 +152,38 @@ def search_and_copy_b_images(df, src_dir, base_img_dir, dst_dir, threshold=1e-5)
         The path to the base directory containing the images to be compared with.
     dst_dir: str or Path
         The path to the destination directory where the images will be copied.
+    threshold: float
+        Maximum absolute pixel difference of similar images.
+        (Default: 1e-5)
+    max_distance: int
+        Maximum Hamming distance between the hashes of similar images.
+        (Default: 10)
     """
     dst_dir.mkdir(parents=True, exist_ok=True)
-    all_images = []
-    print("Loading images...")
+    tree = BKTree()
+    print("Indexing images...")
     for file_path in tqdm(src_dir.rglob('*_real_B.png')):
-        img = np.array(Image.open(file_path).convert('RGB'))
-        all_images.append((file_path,img))
+        with Image.open(file_path) as img:
+            tree.add(image_hash(img), file_path)
 
     print("Comparing images...")
+    used = set()
     for _, row in tqdm(df.iterrows()):
         src_path = Path(base_img_dir) / row['file_name']
         src_image = Image.open(src_path).convert('RGB')
-        src_image = np.array(src_image)
+        candidates = tree.search(image_hash(src_image), max_distance)
+        src_image = np.array(src_image, dtype=np.int16)
 
         ok = False
-        for k, (file_path, img) in enumerate(all_images):
-            if np.max(np.abs(src_image - img)) < threshold:
+        for _, file_path in candidates:
+            if file_path in used:
+                continue
+            img = np.array(Image.open(file_path).convert('RGB'), dtype=np.int16)
+            if img.shape == src_image.shape and np.max(np.abs(src_image - img)) < threshold:
                 new_name = file_path.stem.replace('_real_B','_fake_A') + file_path.suffix
-                file_path = file_path.with_name(new_name)
-                with Image.open(file_path) as img:
+                with Image.open(file_path.with_name(new_name)) as img:
                     img.save(dst_dir / src_path.name)
-                all_images.pop(k)
+                used.add(file_path)
                 ok = True
                 break
         if not ok:
@@ -1,31 +1,168 @@
-"""Rebuild the image database using CycleGAN format."""
+"""Rebuild the image database using CycleGAN format.
 
+The rebuild is incremental: images already in the output folders are kept,
+images removed from the CSVs are deleted, and the ZIP file is only
+rewritten if some of its files changed.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import shutil
 import zipfile
 import pandas as pd
 from tqdm import tqdm
 
-def copy_images(df, src_dir, dst_dir):
-    """Copy images from the source directory to the destination directory."""
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+FICLONE = 0x40049409
+STORED_SUFFIXES = ['.jpg', '.jpeg', '.png']
+
+def _reflink(src_path, dst_path):
+    """Copy-on-write clone of a file (Btrfs, XFS). Raises OSError if not supported."""
+    if fcntl is None:
+        raise OSError('reflink not supported')
+    with open(src_path, 'rb') as src, open(dst_path, 'wb') as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            dst.close()
+            os.unlink(dst_path)
+            raise
+
+def _is_up_to_date(src_path, dst_path):
+    if not dst_path.is_file():
+        return False
+    src_stat = src_path.stat()
+    dst_stat = dst_path.stat()
+    if (src_stat.st_dev, src_stat.st_ino) == (dst_stat.st_dev, dst_stat.st_ino):
+        return True
+    return src_stat.st_size == dst_stat.st_size and src_stat.st_mtime_ns <= dst_stat.st_mtime_ns
+
+def link_or_copy(src_path, dst_path, link=True):
+    """Hard link, reflink or copy a file, in this order of preference.
+
+    Returns the method used: 'link', 'reflink' or 'copy'.
+    """
+    if dst_path.exists():
+        dst_path.unlink()
+    if link:
+        try:
+            os.link(src_path, dst_path)
+            return 'link'
+        except OSError:
+            pass
+        try:
+            _reflink(src_path, dst_path)
+            return 'reflink'
+        except OSError:
+            pass
+    shutil.copy2(src_path, dst_path)
+    return 'copy'
+
+def copy_images(df, src_dir, dst_dir, link=True, num_workers=8):
+    """Copy images from the source directory to the destination directory.
+
+    Images already up to date in the destination are skipped, and files
+    in the destination not listed in `df` are removed.
+
+    Parameters:
+    ------------
+    df: pd.DataFrame
+        The DataFrame containing the image file names.
+    src_dir: str or Path
+        The path to the source directory.
+    dst_dir: str or Path
+        The path to the destination directory.
+    link: bool
+        If True, hard link or reflink the images when possible.
+        (Default: True)
+    num_workers: int
+        Number of copy threads.
+        (Default: 8)
+
+    Returns:
+    ---------
+    dict
+        Number of files by action ('skip', 'link', 'reflink', 'copy', 'remove', 'missing').
+    """
+    src_dir = Path(src_dir)
+    dst_dir = Path(dst_dir)
     dst_dir.mkdir(parents=True, exist_ok=True)
-    for _, row in tqdm(df.iterrows()):
-        src_path = Path(src_dir) / row['file_name']
-        dst_path = Path(dst_dir) / row['file_name']
-        if src_path.is_file():
-            shutil.copy(src_path, dst_path)
-        else:
+    counts = {'skip': 0, 'link': 0, 'reflink': 0, 'copy': 0, 'remove': 0, 'missing': 0}
+
+    names = set(df['file_name'])
+    for dst_path in dst_dir.iterdir():
+        if dst_path.is_file() and dst_path.name not in names:
+            dst_path.unlink()
+            counts['remove'] += 1
+
+    pending = []
+    for name in df['file_name']:
+        src_path = src_dir / name
+        dst_path = dst_dir / name
+        if not src_path.is_file():
             print(f"File not found: {src_path.name}")
+            counts['missing'] += 1
+        elif _is_up_to_date(src_path, dst_path):
+            counts['skip'] += 1
+        else:
+            pending.append((src_path, dst_path))
+
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        methods = executor.map(lambda p: link_or_copy(*p, link=link), pending)
+        for method in tqdm(methods, total=len(pending)):
+            counts[method] += 1
+    return counts
+
+def _compress_type(file_path):
+    if file_path.suffix.lower() in STORED_SUFFIXES:
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
 
 def zip_directory(directory_path, zip_path):
-    """Zip a directory into a ZIP file."""
+    """Zip a directory into a ZIP file.
+
+    Already compressed images (JPEG, PNG) are stored without compression.
+    If the ZIP file exists, new files are appended to it, and it is only
+    rewritten if files were changed or removed.
+
+    Returns the number of files written to the ZIP file.
+    """
     directory_path = Path(directory_path)
     zip_path = Path(zip_path)
 
-    with zipfile.ZipFile(zip_path, 'w') as zipf:
-        for file_path in directory_path.rglob('*'):
-            if file_path.is_file():
-                zipf.write(file_path, file_path.relative_to(directory_path.parent))
+    files = {}
+    for file_path in directory_path.rglob('*'):
+        if file_path.is_file():
+            files[file_path.relative_to(directory_path.parent).as_posix()] = file_path
+
+    mode = 'w'
+    to_write = list(files)
+    if zip_path.is_file():
+        with zipfile.ZipFile(zip_path, 'r') as zipf:
+            current = {i.filename: i for i in zipf.infolist()}
+        unchanged = True
+        for name, info in current.items():
+            file_path = files.get(name)
+            if file_path is None:
+                unchanged = False
+                break
+            new_info = zipfile.ZipInfo.from_file(file_path, name)
+            if (new_info.file_size, new_info.date_time) != (info.file_size, info.date_time):
+                unchanged = False
+                break
+        if unchanged:
+            mode = 'a'
+            to_write = [name for name in files if name not in current]
+
+    with zipfile.ZipFile(zip_path, mode) as zipf:
+        for name in tqdm(to_write):
+            zipf.write(files[name], name, compress_type=_compress_type(files[name]))
+    return len(to_write)
 
 
 if __name__ == '__main__':
@@ -43,10 +180,11 @@ if __name__ == '__main__':
 
     for df_name, src, out in zip(df_list, src_folder, out_folder):
         df_imgs = pd.read_csv(base_src_folder / df_name)
-        copy_images(df_imgs, base_src_folder / src, base_out_folder / out)
+        print(f'{out}: {copy_images(df_imgs, base_src_folder / src, base_out_folder / out)}')
 
-    zip_directory(base_out_folder, base_out_folder.with_suffix('.zip'))
-    shutil.rmtree(base_out_folder)
+    # The output folder (hard links, when possible) is kept for the next incremental rebuild.
+    n_files = zip_directory(base_out_folder, base_out_folder.with_suffix('.zip'))
+    print(f'{n_files} files written to {base_out_folder.with_suffix(".zip")}')
 
 
 #Code to run in the Colab CycleGAN notebook
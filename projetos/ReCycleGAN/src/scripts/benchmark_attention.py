@@ -0,0 +1,118 @@
+# pylint: disable=C0413,E0401
+"""Compare the Generator SelfAttention block with the previous bmm implementation.
+
+The block is run on the input of the last decoder layer of the BASE
+generator (n_features channels, full image resolution) at 256, 512 and
+1024 pixels. For each implementation, reports the time of a forward pass,
+the peak memory (CUDA allocator, or process RSS on CPU, measured in a
+fresh interpreter) and the maximum difference to the bmm output.
+
+E.g., $python src/scripts/benchmark_attention.py --sizes 256 512
+"""
+import sys
+import json
+import time
+import argparse
+import subprocess
+from pathlib import Path
+import torch
+import torch.nn.functional as F
+
+sys.path.append(str(Path(__file__).resolve().parent.parent.parent))
+from src.models.networks import SelfAttention
+from src.utils.test_cases import BASE
+from src.utils.profiler import reset_peak_host_memory, peak_host_memory
+
+IMPLEMENTATIONS = ['bmm', 'sdpa', 'sdpa_chunked']
+CHUNK_SIZE = 1024
+
+def bmm_attention(module, x):
+    """Previous SelfAttention forward, with the full attention matrix."""
+    batch_size, channels, height, width = x.size()
+    x_pooled = module.pool(x)
+    pooled_height, pooled_width = x_pooled.shape[2:]
+    proj_query = module.query_conv(x_pooled).view(batch_size, -1, pooled_height * pooled_width)
+    proj_key = module.key_conv(x_pooled).view(batch_size, -1, pooled_height * pooled_width)
+    proj_value = module.value_conv(x_pooled).view(batch_size, -1, pooled_height * pooled_width)
+    energy = torch.bmm(proj_query.permute(0, 2, 1), proj_key)
+    attention = torch.softmax(energy, dim=-1)
+    out = torch.bmm(proj_value, attention.permute(0, 2, 1))
+    out = out.view(batch_size, channels, pooled_height, pooled_width)
+    out = F.interpolate(out, size=(height, width), mode='bilinear', align_corners=False)
+    return module.gamma * out + x
+
+def build(size, device, batch_size=1):
+    """SelfAttention with non-zero gamma and its input."""
+    torch.manual_seed(0)
+    module = SelfAttention(BASE['n_features']).to(device)
+    with torch.no_grad():
+        module.gamma.fill_(1.0)
+    x = torch.randn(batch_size, BASE['n_features'], size, size, device=device)
+    return module, x
+
+def run(module, x, implementation):
+    """Forward pass of one implementation."""
+    if implementation == 'bmm':
+        return bmm_attention(module, x)
+    module.chunk_size = CHUNK_SIZE if implementation == 'sdpa_chunked' else None
+    return module(x)
+
+def measure(size, implementation, device, n_runs=3):
+    """Time (ms) and peak memory (MB) of one implementation, in this process."""
+    module, x = build(size, device)
+    with torch.no_grad():
+        if device == 'cuda':
+            torch.cuda.synchronize()
+            torch.cuda.reset_peak_memory_stats()
+            base = torch.cuda.memory_allocated()
+        else:
+            base = reset_peak_host_memory()
+        time_start = time.perf_counter()
+        for _ in range(n_runs):
+            run(module, x, implementation)
+        if device == 'cuda':
+            torch.cuda.synchronize()
+            peak = (torch.cuda.max_memory_allocated() - base) / 2**20
+        else:
+            peak = peak_host_memory() - base
+    return (time.perf_counter() - time_start) / n_runs * 1000, peak
+
+def max_difference(size, device):
+    """Maximum absolute difference of the SDPA paths to the bmm output."""
+    module, x = build(size, device)
+    with torch.no_grad():
+        reference = bmm_attention(module, x)
+        return {impl: (run(module, x, impl) - reference).abs().max().item()
+                for impl in IMPLEMENTATIONS[1:]}
+
+def main():
+    """Run the benchmark, one fresh interpreter per measurement."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', maxsplit=1)[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[256, 512, 1024])
+    parser.add_argument('--cpu', action='store_true', help='Run on CPU even if a GPU is available.')
+    parser.add_argument('--measure', nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    device = 'cuda' if torch.cuda.is_available() and not args.cpu else 'cpu'
+
+    if args.measure:
+        size, implementation = int(args.measure[0]), args.measure[1]
+        print(json.dumps(measure(size, implementation, device)))
+        return
+
+    for size in args.sizes:
+        if size <= 512:
+            diffs = max_difference(size, device)
+            print(f'{size}px: max diff ' + ', '.join(f'{k}={v:.2e}' for k, v in diffs.items()))
+        for implementation in IMPLEMENTATIONS:
+            cmd = [sys.executable, __file__, '--measure', str(size), implementation]
+            if args.cpu:
+                cmd.append('--cpu')
+            result = subprocess.run(cmd, capture_output=True, text=True, check=False)
+            if result.returncode != 0:
+                print(f'{size}px {implementation:13s} failed: {result.stderr.strip().splitlines()[-1]}')
+                continue
+            elapsed, peak = json.loads(result.stdout.strip().splitlines()[-1])
+            print(f'{size}px {implementation:13s} {elapsed:9.1f} ms, peak memory {peak:8.1f} MB ({device})')
+
+if __name__ == '__main__':
+    main()
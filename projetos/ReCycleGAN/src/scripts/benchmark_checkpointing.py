@@ -0,0 +1,90 @@
+# pylint: disable=C0413,E0401
+"""Peak memory and step time with and without residual activation checkpointing.
+
+Each configuration (batch size, checkpoint_residual) runs CycleGAN.optimize
+with the BASE parameters in a fresh interpreter, and reports the mean step
+time and the peak memory of the training steps (CUDA allocator, or process
+RSS on CPU). Configurations that run out of memory are reported as such.
+
+E.g., $python src/scripts/benchmark_checkpointing.py --batch_sizes 8 16 32
+"""
+import sys
+import json
+import time
+import argparse
+import subprocess
+from pathlib import Path
+import torch
+
+sys.path.append(str(Path(__file__).resolve().parent.parent.parent))
+from src.models.cyclegan import CycleGAN
+from src.utils.test_cases import BASE
+from src.utils.profiler import reset_peak_host_memory, peak_host_memory
+
+MODEL_KEYS = ['n_features', 'n_residual_blocks', 'n_downsampling', 'norm_type', 'add_skip',
+              'add_attention', 'use_replay_buffer', 'replay_buffer_size', 'vanilla_loss',
+              'cycle_loss_weight', 'id_loss_weight', 'plp_loss_weight', 'plp_step', 'plp_beta',
+              'lr', 'beta1', 'beta2', 'step_size', 'gamma']
+
+def measure(batch_size, img_size, checkpoint_residual, device, n_steps=5):
+    """Mean step time (ms) and peak memory (MB) of the training steps."""
+    torch.manual_seed(42)
+    model = CycleGAN(device=device, amp=BASE['amp'] and device == 'cuda',
+                     checkpoint_residual=checkpoint_residual,
+                     **{k: BASE[k] for k in MODEL_KEYS})
+    shape = (batch_size, 3, img_size, img_size)
+    real_A = torch.rand(shape, device=device) * 2 - 1
+    real_B = torch.rand(shape, device=device) * 2 - 1
+    model.optimize(real_A, real_B)
+
+    if device == 'cuda':
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        base = torch.cuda.memory_allocated() / 2**20
+    else:
+        base = reset_peak_host_memory()
+    time_start = time.perf_counter()
+    for _ in range(n_steps):
+        model.optimize(real_A, real_B)
+    if device == 'cuda':
+        torch.cuda.synchronize()
+        peak = torch.cuda.max_memory_allocated() / 2**20
+    else:
+        peak = peak_host_memory()
+    return (time.perf_counter() - time_start) / n_steps * 1000, peak - base
+
+def main():
+    """Run each configuration in a fresh interpreter."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', maxsplit=1)[0])
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[BASE['batch_size']])
+    parser.add_argument('--img_size', type=int, default=BASE['img_height'])
+    parser.add_argument('--n_steps', type=int, default=5)
+    parser.add_argument('--cpu', action='store_true', help='Run on CPU even if a GPU is available.')
+    parser.add_argument('--measure', nargs=2, type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    device = 'cuda' if torch.cuda.is_available() and not args.cpu else 'cpu'
+
+    if args.measure:
+        batch_size, checkpoint_residual = args.measure
+        print(json.dumps(measure(batch_size, args.img_size, bool(checkpoint_residual),
+                                 device, args.n_steps)))
+        return
+
+    print(f'{device}, {args.img_size}x{args.img_size}, n_residual_blocks={BASE["n_residual_blocks"]}')
+    for batch_size in args.batch_sizes:
+        for checkpoint_residual in [0, 1]:
+            cmd = [sys.executable, __file__, '--measure', str(batch_size), str(checkpoint_residual),
+                   '--img_size', str(args.img_size), '--n_steps', str(args.n_steps)]
+            if args.cpu:
+                cmd.append('--cpu')
+            result = subprocess.run(cmd, capture_output=True, text=True, check=False)
+            label = f'batch={batch_size:3d} checkpoint_residual={bool(checkpoint_residual)!s:5s}'
+            if result.returncode != 0:
+                print(f'{label} failed: {result.stderr.strip().splitlines()[-1]}')
+                continue
+            step_time, peak = json.loads(result.stdout.strip().splitlines()[-1])
+            print(f'{label} step={step_time:9.1f} ms, peak memory={peak:8.1f} MB, '
+                  f'{batch_size / step_time * 1000:6.2f} images/s')
+
+if __name__ == '__main__':
+    main()
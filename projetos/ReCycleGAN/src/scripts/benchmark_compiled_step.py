@@ -0,0 +1,77 @@
+# pylint: disable=C0413,E0401
+"""Compare eager and compiled CycleGAN.optimize training steps.
+
+Uses the default training configuration (BASE) at 256x256, without the
+PLP loss (not available with compile_step). Reports steps/s of the eager
+step, the eager step with fused/foreach Adam, and the compiled step with
+fused/foreach Adam. The first steps (compilation) are not timed.
+
+E.g., $python src/scripts/benchmark_compiled_step.py --batch_size 4 --n_steps 10
+"""
+import sys
+import time
+import argparse
+from pathlib import Path
+import torch
+
+sys.path.append(str(Path(__file__).resolve().parent.parent.parent))
+from src.models.cyclegan import CycleGAN
+from src.utils.test_cases import BASE
+
+MODEL_KEYS = ['n_features', 'n_residual_blocks', 'n_downsampling', 'norm_type', 'add_skip',
+              'use_replay_buffer', 'replay_buffer_size', 'vanilla_loss', 'cycle_loss_weight',
+              'id_loss_weight', 'lr', 'beta1', 'beta2', 'step_size', 'gamma']
+
+CONFIGS = {
+    'eager': {},
+    'eager+fused_optimizer': {'fused_optimizer': True},
+    'compiled+fused_optimizer': {'fused_optimizer': True, 'compile_step': True},
+}
+
+def build_model(device, amp, compile_mode, **kwargs):
+    """CycleGAN with the BASE parameters and fixed initial weights."""
+    torch.manual_seed(42)
+    params = {k: BASE[k] for k in MODEL_KEYS}
+    return CycleGAN(device=device, amp=amp, plp_loss_weight=0, plp_step=BASE['plp_step'],
+                    compile_mode=compile_mode, **params, **kwargs)
+
+def steps_per_s(model, real_A, real_B, n_steps, n_warmup, device):
+    """Training steps per second, after `n_warmup` steps."""
+    for _ in range(n_warmup):
+        model.optimize(real_A, real_B)
+    if device == 'cuda':
+        torch.cuda.synchronize()
+    time_start = time.perf_counter()
+    for _ in range(n_steps):
+        model.optimize(real_A, real_B)
+    if device == 'cuda':
+        torch.cuda.synchronize()
+    return n_steps / (time.perf_counter() - time_start)
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', maxsplit=1)[0])
+    parser.add_argument('--batch_size', type=int, default=BASE['batch_size'])
+    parser.add_argument('--img_size', type=int, default=BASE['img_height'])
+    parser.add_argument('--n_steps', type=int, default=20)
+    parser.add_argument('--n_warmup', type=int, default=3)
+    parser.add_argument('--compile_mode', default='default')
+    parser.add_argument('--cpu', action='store_true', help='Run on CPU even if a GPU is available.')
+    args = parser.parse_args()
+
+    device = 'cuda' if torch.cuda.is_available() and not args.cpu else 'cpu'
+    amp = BASE['amp'] and device == 'cuda'
+    shape = (args.batch_size, 3, args.img_size, args.img_size)
+    real_A = torch.rand(shape, device=device) * 2 - 1
+    real_B = torch.rand(shape, device=device) * 2 - 1
+
+    print(f'{device}, amp={amp}, batch={args.batch_size}, {args.img_size}x{args.img_size}')
+    results = {}
+    for name, kwargs in CONFIGS.items():
+        model = build_model(device, amp, args.compile_mode, **kwargs)
+        results[name] = steps_per_s(model, real_A, real_B, args.n_steps, args.n_warmup, device)
+        print(f'{name:26s} {results[name]:7.3f} steps/s, '
+              f'speedup={results[name] / results["eager"]:.2f}x')
+
+if __name__ == '__main__':
+    main()
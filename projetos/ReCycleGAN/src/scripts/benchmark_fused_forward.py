@@ -0,0 +1,77 @@
+# pylint: disable=C0413,E0401
+"""Compare the default and fused generator forward of CycleGAN.compute_loss.
+
+Checks that both paths give the same losses and measures the time of
+compute_loss + backward on CPU and, if available, on GPU.
+"""
+import sys
+import time
+from pathlib import Path
+import torch
+
+sys.path.append(str(Path(__file__).resolve().parent.parent.parent))
+from src.models.cyclegan import CycleGAN
+
+PARAMS = {
+    'n_features': 32,
+    'n_residual_blocks': 5,
+    'n_downsampling': 2,
+    'norm_type': 'instance',
+    'cycle_loss_weight': 10,
+    'id_loss_weight': 5,
+    'plp_loss_weight': 0,
+    'plp_step': 16,
+}
+
+def build_models(device):
+    """Default and fused CycleGAN with the same weights."""
+    torch.manual_seed(42)
+    model = CycleGAN(device=device, **PARAMS)
+    model_fused = CycleGAN(device=device, fused_forward=True, **PARAMS)
+    model_fused.gen_AtoB.load_state_dict(model.gen_AtoB.state_dict())
+    model_fused.gen_BtoA.load_state_dict(model.gen_BtoA.state_dict())
+    model_fused.dis_A.load_state_dict(model.dis_A.state_dict())
+    model_fused.dis_B.load_state_dict(model.dis_B.state_dict())
+    return model, model_fused
+
+def check_parity(model, model_fused, real_A, real_B):
+    """Maximum absolute difference between the losses of both paths."""
+    loss = model.compute_loss(real_A, real_B)
+    loss_fused = model_fused.compute_loss(real_A, real_B)
+    diff = 0.0
+    for name in ['loss_G', 'loss_D_A', 'loss_D_B', 'loss_G_ad', 'loss_G_cycle', 'loss_G_id']:
+        diff = max(diff, abs(getattr(loss, name).item() - getattr(loss_fused, name).item()))
+    return diff
+
+def time_model(model, real_A, real_B, n_steps, device):
+    """Mean time (ms) of compute_loss + backward."""
+    def _step():
+        loss = model.compute_loss(real_A, real_B)
+        (loss.loss_G + loss.loss_D_A + loss.loss_D_B).backward()
+
+    _step()
+    if device == 'cuda':
+        torch.cuda.synchronize()
+    time_start = time.perf_counter()
+    for _ in range(n_steps):
+        _step()
+    if device == 'cuda':
+        torch.cuda.synchronize()
+    return (time.perf_counter() - time_start) / n_steps * 1000
+
+def main(batch_size=4, img_size=128, n_steps=5):
+    """Run the benchmark on all available devices."""
+    devices = ['cpu'] + (['cuda'] if torch.cuda.is_available() else [])
+    for device in devices:
+        model, model_fused = build_models(device)
+        real_A = torch.rand(batch_size, 3, img_size, img_size, device=device) * 2 - 1
+        real_B = torch.rand(batch_size, 3, img_size, img_size, device=device) * 2 - 1
+
+        diff = check_parity(model, model_fused, real_A, real_B)
+        t_default = time_model(model, real_A, real_B, n_steps, device)
+        t_fused = time_model(model_fused, real_A, real_B, n_steps, device)
+        print(f'{device}: default={t_default:.1f} ms, fused={t_fused:.1f} ms, '
+              f'speedup={t_default / t_fused:.2f}x, max loss diff={diff:.2e}')
+
+if __name__ == '__main__':
+    main()
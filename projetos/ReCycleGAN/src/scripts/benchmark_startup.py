@@ -0,0 +1,59 @@
+"""Measure the import time of the script entry points.
+
+Each entry point is imported in a fresh interpreter (so nothing is cached
+in `sys.modules`), and the heavy optional dependencies it loaded are listed.
+
+E.g., $python src/scripts/benchmark_startup.py 5
+"""
+import sys
+import json
+import statistics
+import subprocess
+from pathlib import Path
+
+SCRIPTS_FOLDER = Path(__file__).resolve().parent
+ENTRY_POINTS = ['train_gan', 'test_model', 'evaluate_models']
+HEAVY_MODULES = ['wandb', 'matplotlib', 'seaborn', 'plotly', 'sklearn', 'scipy',
+                 'pytorch_fid', 'lpips', 'peft']
+
+CODE = """
+import sys, time, json
+sys.path.insert(0, {folder!r})
+time_start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - time_start
+loaded = [m for m in {heavy!r} if m in sys.modules]
+print(json.dumps({{'time': elapsed, 'loaded': loaded}}))
+"""
+
+def measure(module, n_runs=3):
+    """Import time (s) of a module over `n_runs` fresh interpreters.
+
+    Raises RuntimeError (with the last error line) if the import fails.
+    """
+    times = []
+    loaded = []
+    for _ in range(n_runs):
+        code = CODE.format(folder=str(SCRIPTS_FOLDER), module=module, heavy=HEAVY_MODULES)
+        result = subprocess.run([sys.executable, '-c', code], capture_output=True,
+                                text=True, check=False)
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.strip().splitlines()[-1])
+        out = json.loads(result.stdout.strip().splitlines()[-1])
+        times.append(out['time'])
+        loaded = out['loaded']
+    return times, loaded
+
+def main(n_runs=3):
+    """Print the import time of each entry point."""
+    for module in ENTRY_POINTS:
+        try:
+            times, loaded = measure(module, n_runs)
+        except RuntimeError as e:
+            print(f'{module:16s} import failed: {e}')
+            continue
+        print(f'{module:16s} median={statistics.median(times):6.2f} s, '
+              f'min={min(times):6.2f} s, heavy modules: {", ".join(loaded) or "-"}')
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 3)
@@ -3,6 +3,7 @@
 import sys
 import shutil
 import itertools
+import functools
 from pathlib import Path
 import pickle
 import numpy as np
@@ -10,15 +11,10 @@ import torch
 from torchvision import transforms
 from torchvision.utils import make_grid
 from PIL import Image
-import matplotlib.pyplot as plt
-from sklearn.manifold import MDS, TSNE
 import pandas as pd
-import seaborn as sns
 from tqdm import tqdm
-import plotly.express as px
-from scipy.stats import wasserstein_distance
 
-from test_model import translate_images
+from test_model import translate_images, translate_generators, init_new_cycle_gan
 
 BASE_FOLDER = Path(__file__).resolve().parent.parent.parent
 sys.path.append(str(BASE_FOLDER))
@@ -27,14 +23,37 @@ from src.utils.utils import save_dict_as_json
 from src.utils.data_loader import get_img_dataloader, copy_dataloader
 from src.metrics.fid import FID
 from src.metrics.lpips import LPIPS
+from src.metrics.sharded import sharded_lpips
+from src.models.adapters import AdapterSwitcher
 from src.utils.data_transform import ImageTools
+from src.utils.lazy import lazy_import
+from src.utils.stages import StageCache
+
+plt = lazy_import('matplotlib.pyplot')
+sns = lazy_import('seaborn')
+px = lazy_import('plotly.express')
+manifold = lazy_import('sklearn.manifold')
+stats = lazy_import('scipy.stats')
+
+ASSETS_FOLDER = BASE_FOLDER / 'docs/assets/evaluation'
+
+def _run_stage(stages, name, key, func, outputs=None):
+    """Run a cached stage, or just call `func()` if `stages` is None."""
+    if stages is None:
+        return func()
+    return stages.run(name, key, func, outputs)
+
+def dataset_key(data_loaders):
+    """Key of the images (paths and modification times) of a model's data loaders."""
+    return StageCache.make_key(*[data_loaders[p].dataset.get_image_keys()
+                                 for p in sorted(data_loaders)])
 
 def create_nd_map(distances, dimensions=2):
     """Create a n-D map of points given a list of distances between the points."""
     distances = np.array(distances)
-    mds = MDS(n_components=len(distances)-1, dissimilarity='precomputed', random_state=42)
+    mds = manifold.MDS(n_components=len(distances)-1, dissimilarity='precomputed', random_state=42)
     points_nd = mds.fit_transform(distances)
-    tsne = TSNE(n_components=dimensions, perplexity=len(distances)-1, random_state=42)
+    tsne = manifold.TSNE(n_components=dimensions, perplexity=len(distances)-1, random_state=42)
     points_2d = tsne.fit_transform(points_nd)
 
     return points_2d
@@ -187,7 +206,37 @@ def build_images(case, device='cuda'):
     translate_images(params)
 
 
-def build_data_loaders(folder_name, option='all'):
+def build_adapter_images(case, adapter_names, device='cuda'):
+    """Generates translated images of LoRA variants of a CycleGAN model.
+
+    The Test Case checkpoint is loaded once as the base model, and each adapter
+    file (data/checkpoints/test_case_{case}/adapters/{name}.pth) is switched in
+    place. Images are saved with the output name 'test_{case}_{name}'.
+    """
+    print(f"Building Translated Images for LoRA adapters of Test Case {case}")
+    restart_folder = BASE_FOLDER / f'data/checkpoints/test_case_{case}'
+    restart_file = list(restart_folder.glob('*.pth'))
+    if len(restart_file) != 1:
+        print(f"Expected one pth file in: {restart_folder}")
+        return
+
+    params = TEST_CASES[str(case)] | {'add_lora': True, 'device': device}
+    params['data_folder'] = BASE_FOLDER / 'data/external/nexet'
+    params['csv_type'] = ''
+    cyclegan = init_new_cycle_gan(params)
+    cyclegan.load_base(restart_file[0])
+    cyclegan.eval()
+
+    switcher = AdapterSwitcher({'gen_AtoB': cyclegan.gen_AtoB, 'gen_BtoA': cyclegan.gen_BtoA})
+    for name in adapter_names:
+        switcher.add(name, restart_folder / 'adapters' / f'{name}.pth')
+    for name in adapter_names:
+        print(f"  Adapter: {name}")
+        switcher.use(name)
+        translate_generators(switcher, params | {'output_name': f'test_{case}_{name}'})
+
+
+def build_data_loaders(folder_name, option='all', use_shards=False):
     """Builds the data loaders for the images."""
     out = {}
     for p in ['A','B']:
@@ -202,53 +251,96 @@ def build_data_loaders(folder_name, option='all'):
             csv_file = images_csv,
             img_dir = BASE_FOLDER / f'data/external/nexet/{f_name}',
             batch_size = 128,
-            transformation = None
+            transformation = None,
+            use_shards = use_shards
         )
     return out
 
 
-def get_fid(data_loaders, use_cuda=True):
-    """Calculates the FID score for all pairs in a list of models."""
-    print('Loading FID model')
-    fid = FID(dims=2048, cuda=use_cuda)
+def get_fid(data_loaders, use_cuda=True, cache_dir=BASE_FOLDER / 'data/external/nexet/fid_cache',
+            stages=None, n_workers=1):
+    """Calculates the FID score for all pairs in a list of models.
+
+    Activations of images already evaluated are read from `cache_dir`.
+    If `stages` (StageCache) is given, the statistics of each model and
+    the FID of each pair are cached stages, so only new models and new
+    pairs are calculated. If `n_workers` > 1, the images of each model
+    are split across worker processes (see metrics.sharded).
+
+    Returns the results and the keys of the statistics stages.
+    """
+    fid = FID(dims=2048, cuda=use_cuda, init_model=False, cache_dir=cache_dir,
+              n_workers=n_workers)
 
     statistics = {}
+    keys = {}
     for k,v in data_loaders.items():
-        print(f"Calculating features statistics for {k}")
-        statistics[k] = {}
-        for p,imgs in v.items():
-            statistics[k][p] = fid.compute_statistics_of_imgs(imgs)
+        keys[k] = StageCache.make_key('fid_stats', fid.dims, dataset_key(v)) if stages else None
+        def _statistics(k=k, v=v):
+            print(f"Calculating features statistics for {k}")
+            return {p: fid.compute_statistics_of_imgs(imgs) for p,imgs in v.items()}
+        statistics[k] = _run_stage(stages, f'fid_stats/{k}', keys[k], _statistics)
 
     pairs = list(itertools.combinations(data_loaders.keys(), 2))
 
     print(f'Calculating FID for all {len(pairs)} pairs')
     results = {'A':{}, 'B':{}}
     for pair in tqdm(pairs):
+        def _fid(pair=pair):
+            out = {}
+            for p in ['A','B']:
+                m1, s1 = statistics[pair[0]][p]
+                m2, s2 = statistics[pair[1]][p]
+                out[p] = fid.calculate_frechet_distance(m1, s1, m2, s2)
+            return out
+        key = StageCache.make_key('fid', keys[pair[0]], keys[pair[1]]) if stages else None
+        values = _run_stage(stages, f'fid/{pair[0]}/{pair[1]}', key, _fid)
         for p in ['A','B']:
-            m1, s1 = statistics[pair[0]][p]
-            m2, s2 = statistics[pair[1]][p]
-            results[p][pair] = fid.calculate_frechet_distance(m1, s1, m2, s2)
+            results[p][pair] = values[p]
     return results
 
 
-def get_lpips(data_loaders, use_cuda=True):
-    """Calculates the LPIPS score for all pairs in a list of models."""
-    print('Loading LPIPS model')
-    lpips = LPIPS(cuda=use_cuda)
+LPIPS_PAIRS_SEED = 0 # Random pairing of images in sharded LPIPS
+
+def get_lpips(data_loaders, use_cuda=True, stages=None, n_workers=1):
+    """Calculates the LPIPS score for all pairs in a list of models.
+
+    If `stages` (StageCache) is given, each pair is a cached stage, so
+    only pairs with new or changed images are calculated. If `n_workers` > 1,
+    the image pairs are split across worker processes (see metrics.sharded),
+    with a seeded random pairing instead of two shuffled DataLoaders.
+    """
+    lpips = None
+    keys = {k: dataset_key(v) for k,v in data_loaders.items()} if stages else {}
+    pairing = f'permutation_{LPIPS_PAIRS_SEED}' if n_workers > 1 else 'shuffled_loaders'
 
     pairs = list(itertools.combinations(data_loaders.keys(), 2))
     print(f'Calculating LPIPS for all {len(pairs)} pairs')
     results = {'A':{}, 'B':{}}
     for p in ['A','B']:
         for pair in pairs + [('Real','Real')]:
-            imgs1 = copy_dataloader(data_loaders[pair[0]][p])
-            imgs2 = copy_dataloader(data_loaders[pair[1]][p])
-            n = min(len(imgs1.dataset), len(imgs2.dataset))
-            imgs1.dataset.set_len(n)
-            imgs2.dataset.set_len(n)
-            results[p][pair] = lpips.lpips_dataloader(
-                imgs1, imgs2, description=str(pair),
-                normalize=False, use_all_pairs=False)
+            def _lpips(pair=pair, p=p):
+                nonlocal lpips
+                if n_workers > 1:
+                    imgs1 = data_loaders[pair[0]][p]
+                    imgs2 = data_loaders[pair[1]][p]
+                    print(f'{pair}: LPIPS in {n_workers} processes')
+                    return sharded_lpips(imgs1.dataset, imgs2.dataset, n_workers,
+                                         batch_size=imgs1.batch_size, cuda=use_cuda,
+                                         normalize=False, seed=LPIPS_PAIRS_SEED)
+                if lpips is None:
+                    print('Loading LPIPS model')
+                    lpips = LPIPS(cuda=use_cuda)
+                imgs1 = copy_dataloader(data_loaders[pair[0]][p])
+                imgs2 = copy_dataloader(data_loaders[pair[1]][p])
+                n = min(len(imgs1.dataset), len(imgs2.dataset))
+                imgs1.dataset.set_len(n)
+                imgs2.dataset.set_len(n)
+                return lpips.lpips_dataloader(
+                    imgs1, imgs2, description=str(pair),
+                    normalize=False, use_all_pairs=False)
+            key = StageCache.make_key('lpips', pairing, p, keys.get(pair[0]), keys.get(pair[1])) if stages else None
+            results[p][pair] = _run_stage(stages, f'lpips/{p}/{pair[0]}/{pair[1]}', key, _lpips)
     return results
 
 def lpips_distance(lpips):
@@ -259,11 +351,28 @@ def lpips_distance(lpips):
         for k in lpips[p]:
             if k[0] != k[1]:
                 v = lpips[p][k]
-                out[p][k] = wasserstein_distance(u.flatten(), v.flatten())
+                out[p][k] = stats.wasserstein_distance(u.flatten(), v.flatten())
     return out
 
-def lpips_detailed(test_case, option='test', use_cuda=True):
-    """Calculate LPIPS for each image."""
+REAL_CHUNK_SIZE = 256 # Real LPIPS embeddings moved to the device at a time
+
+def lpips_detailed(test_case, option='test', use_cuda=True, stages=None):
+    """Calculate LPIPS for each image.
+
+    Real images are embedded once, so each generated image only needs one
+    pass through the LPIPS network. The real embeddings (about 2.5 MB per
+    image) are kept on CPU, and are moved to the device in chunks of
+    `REAL_CHUNK_SIZE` images for each batch. If `stages` (StageCache) is given,
+    the result is cached until the real or generated images change.
+    """
+    if stages is not None:
+        key = StageCache.make_key(
+            'lpips_detailed', option,
+            dataset_key(build_data_loaders('real', option=option)),
+            dataset_key(build_data_loaders(f'test_{test_case}', option=option)))
+        return stages.run(f'lpips_detailed/{test_case}/{option}', key,
+                          lambda: lpips_detailed(test_case, option, use_cuda))
+
     lpips = LPIPS(cuda=use_cuda)
     real = build_data_loaders('real', option=option)
 
@@ -271,35 +380,73 @@ def lpips_detailed(test_case, option='test', use_cuda=True):
     for p in ['A','B']:
         out[p] = {'file_name':[], 'lpips':[]}
 
-        print(f'Loading {p} real images')
-        real_imgs = torch.empty(0)
-        for batch in tqdm(real[p]):
-            real_imgs = torch.concat([real_imgs, batch])
+        print(f'Embedding {p} real images')
+        real_embeddings = lpips.embed(real[p], device='cpu')
+        if use_cuda and torch.cuda.is_available():
+            real_embeddings = real_embeddings.pin_memory()
 
         print(f'Calculating LPIPS for {p} images')
         fake_p = 'B' if p == 'A' else 'A'
         images_csv = BASE_FOLDER / f'data/external/nexet/input_{fake_p}_{option}_filtered.csv'
-        df = pd.read_csv(images_csv)
-        for img_name in tqdm(df['file_name']):
-            img_path = BASE_FOLDER / f'data/external/nexet/output_{fake_p}_test_{test_case}' / img_name
-            image = Image.open(img_path).convert('RGB')
-            image = transforms.ToTensor()(image)
-            out[p]['file_name'].append(img_name)
-            out[p]['lpips'].append(lpips.get(real_imgs, image.unsqueeze(0), all_pairs=True))
+        fake = get_img_dataloader(
+            csv_file = images_csv,
+            img_dir = BASE_FOLDER / f'data/external/nexet/output_{fake_p}_test_{test_case}',
+            batch_size = 128,
+            shuffle = False,
+        )
+        out[p]['file_name'] = list(fake.dataset.image_paths)
+        for batch in tqdm(fake):
+            values = lpips.distances(real_embeddings, lpips.embed(batch),
+                                     chunk_size=REAL_CHUNK_SIZE).cpu()
+            for j in range(values.shape[1]):
+                out[p]['lpips'].append(values[:, j].reshape(-1, 1, 1, 1))
+
+    return out
+
+LPIPS_TABLE_DTYPE = np.dtype([('index', np.int32), ('lpips', np.float32)])
 
+def lpips_table(lpips_values):
+    """Compact per-image table of the detailed LPIPS of a model.
+
+    Returns, for each class, a numpy structured array (LPIPS_TABLE_DTYPE)
+    with the index of the image in `file_name` and its mean LPIPS to the
+    real images, and the list of file names.
+    """
+    out = {}
+    for p in ['A','B']:
+        values = torch.stack(lpips_values[p]['lpips']).mean(dim=1).numpy().flatten()
+        table = np.empty(len(values), dtype=LPIPS_TABLE_DTYPE)
+        table['index'] = np.arange(len(values))
+        table['lpips'] = values
+        out[p] = (table, list(lpips_values[p]['file_name']))
     return out
 
 def _get_percentiles_file_names(file_names, values, percentiles):
-    """Get the file_names associated to each percentile of the values."""
-    combined = list(zip(values, file_names))
-    combined.sort(key=lambda x: x[0])
-    index = []
-    for p in percentiles:
-        index.append(int(np.ceil((p / 100) * (len(values)-1))) - 1)
-    return [combined[index[i]] for i in range(len(index))]
-
-def best_model_histogram(best_model, lpips_values, file_path, bins=20, percentiles = None):
-    """Plot histogram of LPIPS distances for the best model."""
+    """Get the (value, file_name) associated to each percentile of the values.
+
+    Only the order statistics of the requested percentiles are found
+    (np.argpartition), instead of sorting all values.
+    """
+    values = np.asarray(values)
+    ranks = [max(int(np.ceil((p / 100) * (len(values)-1))) - 1, 0) for p in percentiles]
+    order = np.argpartition(values, sorted(set(ranks)))
+    return [(values[order[r]], file_names[order[r]]) for r in ranks]
+
+@functools.lru_cache(maxsize=512)
+def _read_image(img_path):
+    """Image as a tensor, decoded only once for all plots."""
+    image = Image.open(img_path).convert('RGB')
+    return transforms.ToTensor()(image)
+
+def _image_grid(img_folder, percentiles_file_names):
+    images = [_read_image(img_folder / img_name) for _, img_name in percentiles_file_names]
+    return make_grid(torch.stack(images), nrow=len(images)).permute(1, 2, 0)
+
+def best_model_histogram(best_model, table, file_path, bins=20, percentiles = None):
+    """Plot histogram of LPIPS distances for the best model.
+
+    `table` is the output of `lpips_table`.
+    """
     if percentiles is None:
         percentiles = [0, 25, 50, 75, 100]
 
@@ -307,28 +454,18 @@ def best_model_histogram(best_model, lpips_values, file_path, bins=20, percentil
         fake_p = 'B' if p == 'A' else 'A'
         _, axes = plt.subplots(3, 1, figsize=(8, 6))
 
-        all_values = torch.stack(lpips_values[p]['lpips'])
-        values = all_values.mean(dim=1).numpy().flatten()
+        values, file_names = table[p][0]['lpips'], table[p][1]
 
         sns.histplot(values, bins=bins, kde=False, ax=axes[0], edgecolor='black', stat='density', alpha=0.5)
         axes[0].set_xlabel('LPIPS')
         axes[0].set_ylabel('Density')
         axes[0].grid(False)
-        for percentile in percentiles:
-            value_at_percentile = np.percentile(values, percentile)
+        for percentile, value_at_percentile in zip(percentiles, np.percentile(values, percentiles)):
             axes[0].axvline(value_at_percentile, color='red', linestyle='-', linewidth=1)
             axes[0].text(value_at_percentile, axes[0].get_ylim()[1] * 0.9, f'P{percentile:02}', color='red', ha='right', rotation=90)
 
-        file_names = lpips_values[p]['file_name']
         percentiles_file_names = _get_percentiles_file_names(file_names, values, percentiles)
-        images = []
-        for _, img_name in percentiles_file_names:
-            img_path = BASE_FOLDER / f'data/external/nexet/input_{fake_p}' / img_name
-            image = Image.open(img_path).convert('RGB')
-            image = transforms.ToTensor()(image)
-            images.append(image)
-        images_tensor = torch.stack(images)
-        img_grid = make_grid(images_tensor, nrow=len(percentiles)).permute(1, 2, 0)
+        img_grid = _image_grid(BASE_FOLDER / f'data/external/nexet/input_{fake_p}', percentiles_file_names)
         axes[1].imshow(img_grid)
         axes[1].yaxis.set_visible(False)
         num_labels = len(percentiles) * 2 + 1
@@ -336,14 +473,7 @@ def best_model_histogram(best_model, lpips_values, file_path, bins=20, percentil
         x_lab = [r'$\downarrow$' if i % 2 == 1 else '' for i in range(num_labels)]
         axes[1].set_xticks(ticks=x_ticks, labels=x_lab, fontsize=12)
 
-        images = []
-        for _, img_name in percentiles_file_names:
-            img_path = BASE_FOLDER / f'data/external/nexet/output_{fake_p}_test_{best_model}' / img_name
-            image = Image.open(img_path).convert('RGB')
-            image = transforms.ToTensor()(image)
-            images.append(image)
-        images_tensor = torch.stack(images)
-        img_grid = make_grid(images_tensor, nrow=len(percentiles)).permute(1, 2, 0)
+        img_grid = _image_grid(BASE_FOLDER / f'data/external/nexet/output_{fake_p}_test_{best_model}', percentiles_file_names)
         axes[2].imshow(img_grid)
         axes[2].yaxis.set_visible(False)
         num_labels = len(percentiles) * 2 + 1
@@ -357,32 +487,28 @@ def best_model_histogram(best_model, lpips_values, file_path, bins=20, percentil
         plt.savefig(file_path.parent / f'{file_path.stem}_{p}{file_path.suffix}')
         plt.close()
 
-def get_images_for_poll(best_model, lpips_values, out_folder, percentiles):
-    """Save images for poll."""
+def get_images_for_poll(best_model, table, out_folder, percentiles):
+    """Save images for poll.
+
+    `table` is the output of `lpips_table`. Files are copied without
+    being decoded.
+    """
     for p in ['A','B']:
         fake_p = 'B' if p == 'A' else 'A'
-        all_values = torch.stack(lpips_values[p]['lpips'])
-        values = all_values.mean(dim=1).numpy().flatten()
-        file_names = lpips_values[p]['file_name']
+        values, file_names = table[p][0]['lpips'], table[p][1]
         percentiles_file_names = _get_percentiles_file_names(file_names, values, percentiles)
         new_folder = out_folder / p
         new_folder.mkdir(parents=True, exist_ok=True)
+        folders = {
+            'real': f'input_{fake_p}',
+            'cyclegan': f'output_{fake_p}_cyclegan',
+            'turbo': f'output_{fake_p}_turbo',
+            f'recyclegan_{best_model}': f'output_{fake_p}_test_{best_model}',
+        }
         for perc, (_, img_name) in zip(percentiles, percentiles_file_names):
-            img_path = BASE_FOLDER / f'data/external/nexet/input_{fake_p}' / img_name
-            img_path_out = new_folder / f'{perc}_real.png'
-            shutil.copy(img_path, img_path_out)
-
-            img_path = BASE_FOLDER / f'data/external/nexet/output_{fake_p}_cyclegan' / img_name
-            img_path_out = new_folder / f'{perc}_cyclegan.png'
-            shutil.copy(img_path, img_path_out)
-
-            img_path = BASE_FOLDER / f'data/external/nexet/output_{fake_p}_turbo' / img_name
-            img_path_out = new_folder / f'{perc}_turbo.png'
-            shutil.copy(img_path, img_path_out)
-
-            img_path = BASE_FOLDER / f'data/external/nexet/output_{fake_p}_test_{best_model}' / img_name
-            img_path_out = new_folder / f'{perc}_recyclegan_{best_model}.png'
-            shutil.copy(img_path, img_path_out)
+            for suffix, folder in folders.items():
+                img_path = BASE_FOLDER / 'data/external/nexet' / folder / img_name
+                shutil.copy(img_path, new_folder / f'{perc}_{suffix}.png')
 
 
 def metric_dict_to_table(metrics, keys):
@@ -479,9 +605,7 @@ def save_samples(real_image_list, real_class, models, file_name='Samples'):
             img_path = BASE_FOLDER / f'data/external/nexet/input_{real_class}' / img_name
         else:
             img_path = BASE_FOLDER / f'data/external/nexet/output_{real_class}_{model}' / img_name
-        image = Image.open(img_path).convert('RGB')
-        image = transforms.ToTensor()(image)
-        return image
+        return _read_image(img_path)
 
     images = []
     for img_name in real_image_list:
@@ -521,14 +645,17 @@ def main():
 
     n_tests = 9
     test_cases_to_build_images = [] # Indexes of test cases to build images
-    recalculate_metrics = False # If False, will load metrics from pkl files
+    adapters_to_evaluate = {} # Test case index: [LoRA adapter names]
     n_samples = 12
     best_model = 9 # Index of the 'best' model
+    n_workers = max(1, torch.cuda.device_count()) # Metric processes (one per GPU)
 
 
     # Build translated images
     for i in test_cases_to_build_images:
         build_images(i)
+    for i, adapter_names in adapters_to_evaluate.items():
+        build_adapter_images(i, adapter_names)
 
 
     # Build image data loaders
@@ -540,6 +667,9 @@ def main():
     for i in range(1, n_tests+1):
         test_case = TEST_CASES[str(i)]
         model_list[test_case['short_description']] = f'test_{i}'
+    for i, adapter_names in adapters_to_evaluate.items():
+        for name in adapter_names:
+            model_list[f"{TEST_CASES[str(i)]['short_description']}+{name}"] = f'test_{i}_{name}'
 
     data_loaders = {}
     for k,v in model_list.items():
@@ -547,51 +677,56 @@ def main():
     labels = list(model_list.keys())
 
 
+    stages = StageCache(BASE_FOLDER / 'data/external/nexet/eval_cache')
+    metrics_key = StageCache.make_key(labels, [dataset_key(v) for v in data_loaders.values()])
+
     print('========= FID =========')
-    if recalculate_metrics:
-        fid_metrics = get_fid(data_loaders)
-        save_metrics(fid_metrics, 'fid_metrics.pkl')
-    else:
-        fid_metrics = load_metrics('fid_metrics.pkl')
+    fid_metrics = get_fid(data_loaders, stages=stages, n_workers=n_workers)
+    save_metrics(fid_metrics, 'fid_metrics.pkl')
     print_metric_pairs(fid_metrics)
-    plot_metrics(fid_metrics, labels, 'FID')
+    _run_stage(stages, 'plots/fid', metrics_key,
+               lambda: plot_metrics(fid_metrics, labels, 'FID'),
+               outputs=[ASSETS_FOLDER / f'fid_bar_images_{p}.png' for p in ['A','B']])
 
 
     print('========= LPIPS =========')
-    if recalculate_metrics:
-        lpips_metrics = get_lpips(data_loaders)
-        save_metrics(lpips_metrics, 'lpips_metrics.pkl')
-    else:
-        lpips_metrics = load_metrics('lpips_metrics.pkl')
-    plot_histograms(lpips_metrics, labels, 'LPIPS')
+    lpips_metrics = get_lpips(data_loaders, stages=stages, n_workers=n_workers)
+    save_metrics(lpips_metrics, 'lpips_metrics.pkl')
     lpips_metrics_mean = transform_metrics(lpips_metrics, transform=lambda x: float(x.mean()))
     lpips_metrics_std = transform_metrics(lpips_metrics, transform=lambda x: float(x.std()))
     print_metric_pairs(lpips_metrics_mean, lpips_metrics_std)
-    plot_metrics([lpips_metrics_mean, lpips_metrics_std], labels, 'LPIPS')
-
     lpips_metrics_dist = lpips_distance(lpips_metrics)
     print("LPIPS 'distances'")
     print_metric_pairs(lpips_metrics_dist)
-    plot_metrics(lpips_metrics_dist, labels, 'W-LPIPS')
+
+    def _plot_lpips():
+        plot_histograms(lpips_metrics, labels, 'LPIPS')
+        plot_metrics([lpips_metrics_mean, lpips_metrics_std], labels, 'LPIPS')
+        plot_metrics(lpips_metrics_dist, labels, 'W-LPIPS')
+    _run_stage(stages, 'plots/lpips', metrics_key, _plot_lpips,
+               outputs=[ASSETS_FOLDER / f'{t}_bar_images_{p}.png'
+                        for t in ['lpips', 'w-lpips'] for p in ['A','B']])
 
     # Detailed LPIPS
-    if recalculate_metrics:
-        lpips_best_model = lpips_detailed(best_model)
-        save_metrics(lpips_best_model, 'lpips_best_model.pkl')
-    else:
-        lpips_best_model = load_metrics('lpips_best_model.pkl')
-    best_model_histogram(
-        best_model=best_model,
-        lpips_values=lpips_best_model,
-        file_path= BASE_FOLDER / 'docs/assets/evaluation/lpips_best_model_histogram.png',
-        percentiles=[5, 25, 50, 75, 95])
-
-    get_images_for_poll(
-        best_model=best_model,
-        lpips_values=lpips_best_model,
-        out_folder=BASE_FOLDER / 'docs/assets/evaluation/poll',
-        percentiles=list(range(5,100,5))
-    )
+    lpips_best_model = lpips_detailed(best_model, stages=stages)
+    save_metrics(lpips_best_model, 'lpips_best_model.pkl')
+    best_model_key = stages.make_key(best_model, stages.get_key(f'lpips_detailed/{best_model}/test'))
+    table_best_model = _run_stage(stages, 'lpips_table/best_model', best_model_key,
+                                  lambda: lpips_table(lpips_best_model))
+    _run_stage(stages, 'plots/lpips_best_model', best_model_key,
+               lambda: best_model_histogram(
+                   best_model=best_model,
+                   table=table_best_model,
+                   file_path=ASSETS_FOLDER / 'lpips_best_model_histogram.png',
+                   percentiles=[5, 25, 50, 75, 95]))
+
+    _run_stage(stages, 'plots/poll', best_model_key,
+               lambda: get_images_for_poll(
+                   best_model=best_model,
+                   table=table_best_model,
+                   out_folder=ASSETS_FOLDER / 'poll',
+                   percentiles=list(range(5,100,5))),
+               outputs=[ASSETS_FOLDER / 'poll'])
 
 
     # Save samples
@@ -0,0 +1,82 @@
+# pylint: disable=C0413,E0401
+"""Export the generators of a CycleGAN checkpoint for inference.
+
+E.g., $python src/scripts/export_generators.py no_sync/test_model_7/cycle_gan_epoch_14.pth
+--format torchscript --channels_last --int8 --calibration_dir data/external/nexet/input_A
+"""
+import sys
+import argparse
+from pathlib import Path
+import torch
+from PIL import Image
+from torchvision import transforms
+
+sys.path.append(str(Path(__file__).resolve().parent.parent.parent))
+from src.utils.utils import load_json_to_dict
+from src.models.export import GENERATORS, load_generators, export_generator
+
+def load_calibration_imgs(img_dir, img_size, n_imgs=32, batch_size=8):
+    """First `n_imgs` images of a folder, as normalized batches."""
+    transformation = transforms.Compose([
+        transforms.Resize(img_size[0], transforms.InterpolationMode.BICUBIC),
+        transforms.CenterCrop(img_size),
+        transforms.ToTensor(),
+        transforms.Normalize(mean=[0.5, 0.5, 0.5], std=[0.5, 0.5, 0.5])
+    ])
+    files = sorted(f for f in Path(img_dir).iterdir()
+                   if f.suffix.lower() in ['.jpg', '.jpeg', '.png'])[:n_imgs]
+    imgs = [transformation(Image.open(f).convert('RGB')) for f in files]
+    return [torch.stack(imgs[i:i + batch_size]) for i in range(0, len(imgs), batch_size)]
+
+def main():
+    """Export gen_AtoB and gen_BtoA."""
+    parser = argparse.ArgumentParser(
+        description="Export CycleGAN generators to TorchScript or ONNX.",
+    )
+    parser.add_argument("checkpoint", type=Path)
+    parser.add_argument(
+        "-p",
+        "--params",
+        type=Path,
+        help="Training hyperparameters. Default is hyperparameters.json next to the checkpoint.",
+    )
+    parser.add_argument("-o", "--out_dir", type=Path, help="Default is the checkpoint folder.")
+    parser.add_argument("-f", "--format", choices=['torchscript', 'onnx'], default='torchscript')
+    parser.add_argument("--channels_last", action='store_true')
+    parser.add_argument("--int8", action='store_true', help="Static int8 quantization (CPU).")
+    parser.add_argument(
+        "--calibration_dir",
+        nargs=2,
+        type=Path,
+        metavar=('DIR_A', 'DIR_B'),
+        help="Images of domains A and B used to calibrate int8 quantization.",
+    )
+    parser.add_argument("--n_calibration", type=int, default=32)
+    args = parser.parse_args()
+
+    params_path = args.params or args.checkpoint.parent / 'hyperparameters.json'
+    params = load_json_to_dict(params_path)
+    img_size = (params.get('img_height', 256), params.get('img_width', 256))
+    out_dir = args.out_dir or args.checkpoint.parent
+    if args.int8 and args.calibration_dir is None:
+        parser.error('--int8 requires --calibration_dir')
+
+    generators = load_generators(args.checkpoint, params)
+    suffix = '.pt' if args.format == 'torchscript' else '.onnx'
+    for i, name in enumerate(GENERATORS):
+        calibration_imgs = None
+        if args.int8:
+            calibration_imgs = load_calibration_imgs(args.calibration_dir[i], img_size,
+                                                     n_imgs=args.n_calibration)
+        path = export_generator(
+            generators[name],
+            out_dir / f'{args.checkpoint.stem}_{name}{suffix}',
+            img_size=img_size,
+            fmt=args.format,
+            channels_last=args.channels_last,
+            int8=args.int8,
+            calibration_imgs=calibration_imgs)
+        print(f'{name}: {path}')
+
+if __name__ == '__main__':
+    main()
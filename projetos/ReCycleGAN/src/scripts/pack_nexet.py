@@ -0,0 +1,25 @@
+# pylint: disable=import-error,wrong-import-position
+"""Pack the Nexet image folders into memory-mapped shards.
+
+Run once after building the dataset. The shards are then used by
+`get_img_dataloader(..., use_shards=True)` (set `'use_shards': True`
+in the training parameters).
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent.parent))
+from src.utils.data_loader import pack_image_shards
+
+if __name__ == '__main__':
+    data_folder = Path(__file__).resolve().parent.parent.parent / 'data/external/nexet'
+    csv_type = '_filtered'
+
+    for p in ['A', 'B']:
+        csv_files = [
+            data_folder / f'input_{p}_train{csv_type}.csv',
+            data_folder / f'input_{p}_test{csv_type}.csv',
+        ]
+        shard_dir = pack_image_shards(csv_files, data_folder / f'input_{p}')
+        print(f'Shards for input_{p}: {shard_dir}')
@@ -1,15 +1,18 @@
 # pylint: disable=C0413,E0401
 """Script to Test a CycleGAN model"""
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import pandas as pd
 from tqdm import tqdm
 import torch
 from PIL import Image
+from torch.utils.data import DataLoader
 from torchvision import transforms
 
 sys.path.append(str(Path(__file__).resolve().parent.parent.parent))
 from src.utils.utils import remove_all_files, load_json_to_dict, count_parameters
+from src.utils.data_loader import ImageDataset
 from src.models.cyclegan import CycleGAN
 
 def init_new_cycle_gan(params):
@@ -24,6 +27,7 @@ def init_new_cycle_gan(params):
         norm_type=params["norm_type"],
         add_skip=params["add_skip"],
         add_attention=params["add_attention"],
+        attention_chunk_size=params.get("attention_chunk_size", None),
         add_lora=params["add_lora"],
         lora_rank=params["lora_rank"],
         use_replay_buffer=params["use_replay_buffer"],
@@ -44,10 +48,11 @@ def init_new_cycle_gan(params):
 
 def translate_image(model, input_image_path, output_dir):
     """Translate an image."""
+    device = next(model.parameters()).device
     input_img = Image.open(input_image_path).convert('RGB')
     with torch.no_grad():
         x_t = transforms.ToTensor()(input_img)
-        x_t = transforms.Normalize([0.5], [0.5])(x_t).unsqueeze(0).cuda()
+        x_t = transforms.Normalize([0.5], [0.5])(x_t).unsqueeze(0).to(device)
         output = model(x_t)
 
     output_pil = transforms.ToPILImage()(output[0].cpu() * 0.5 + 0.5)
@@ -55,6 +60,72 @@ def translate_image(model, input_image_path, output_dir):
     output_pil.save(output_path)
 
 
+def translate_batch_images(model, img_dir, file_names, output_dir,
+                           batch_size=32, num_workers=4, n_writers=4):
+    """Translate images in batches.
+
+    Images are decoded by DataLoader workers, translated in batches on the
+    model device, and PNG encoding and writing is done by a pool of
+    background threads.
+
+    Parameters:
+    ------------
+    model: nn.Module
+        Generator.
+    img_dir: str or Path
+        Folder with the input images.
+    file_names: [str]
+        Names of the images to translate.
+    output_dir: str or Path
+        Folder to save the translated images (same names as the inputs).
+    batch_size: int
+        Batch size.
+        (Default: 32)
+    num_workers: int
+        Number of DataLoader workers decoding the images.
+        (Default: 4)
+    n_writers: int
+        Number of threads encoding and writing the images.
+        (Default: 4)
+    """
+    device = next(model.parameters()).device
+    transformation = transforms.Compose([
+        transforms.ToTensor(),
+        transforms.Normalize([0.5], [0.5]),
+    ])
+    images = DataLoader(
+        ImageDataset(list(file_names), img_dir, transformation),
+        batch_size=batch_size,
+        shuffle=False,
+        num_workers=num_workers,
+        pin_memory=device.type == 'cuda')
+
+    def _save(array, file_name):
+        Image.fromarray(array).save(Path(output_dir) / file_name)
+
+    model.eval()
+    start = 0
+    with ThreadPoolExecutor(max_workers=n_writers) as writers:
+        pending = []
+        for batch in tqdm(images):
+            with torch.no_grad():
+                output = model(batch.to(device, non_blocking=True))
+                # Same rounding as transforms.ToPILImage
+                output = (output * 0.5 + 0.5).mul(255).byte().permute(0, 2, 3, 1).cpu().numpy()
+
+            for array, file_name in zip(output, file_names[start:start + len(output)]):
+                pending.append(writers.submit(_save, array, file_name))
+            start += len(output)
+
+            # Keep a bounded number of images waiting to be written
+            if len(pending) > 4 * batch_size:
+                for future in pending:
+                    future.result()
+                pending = []
+        for future in pending:
+            future.result()
+
+
 def translate_images(params):
     """Translate images using a CycleGAN model."""
     if 'params_path' in params:
@@ -62,6 +133,9 @@ def translate_images(params):
         for k,v in params_.items():
             if k not in params:
                 params[k] = v
+    if 'device' not in params:
+        use_cuda = params.get('use_cuda', True) and torch.cuda.is_available()
+        params['device'] = torch.device('cuda' if use_cuda else 'cpu')
 
     cyclegan = init_new_cycle_gan(params)
     params['restart_epoch'] = cyclegan.load_model(params['restart_path'])
@@ -74,31 +148,32 @@ def translate_images(params):
     print(f'    Discriminator A:  {count_parameters(cyclegan.dis_A):,}')
     print(f'    Discriminator B:  {count_parameters(cyclegan.dis_B):,}')
 
+    translate_generators({'gen_AtoB': cyclegan.gen_AtoB, 'gen_BtoA': cyclegan.gen_BtoA}, params)
+
+
+def translate_generators(generators, params):
+    """Translate the train and test images of both domains to output_{p}_{output_name}.
+
+    `generators` maps 'gen_AtoB' and 'gen_BtoA' to the generators
+    (e.g., a dict or an AdapterSwitcher).
+    """
     data_folder = params["data_folder"]
 
-    output_dir_  = data_folder / f"output_A_{params['output_name']}"
-    output_dir_.mkdir(parents=True, exist_ok=True)
-    remove_all_files(output_dir_)
-    df = pd.read_csv(data_folder / f"input_A_train{params['csv_type']}.csv")
-    for file_name in tqdm(df['file_name']):
-        input_image_ = data_folder / "input_A" / file_name
-        translate_image(cyclegan.gen_AtoB, input_image_, output_dir_)
-    df = pd.read_csv(data_folder / f"input_A_test{params['csv_type']}.csv")
-    for file_name in tqdm(df['file_name']):
-        input_image_ = data_folder / "input_A" / file_name
-        translate_image(cyclegan.gen_AtoB, input_image_, output_dir_)
-
-    output_dir_  = data_folder / f"output_B_{params['output_name']}"
-    output_dir_.mkdir(parents=True, exist_ok=True)
-    remove_all_files(output_dir_)
-    df = pd.read_csv(data_folder / f"input_B_train{params['csv_type']}.csv")
-    for file_name in tqdm(df['file_name']):
-        input_image_ = data_folder / "input_B" / file_name
-        translate_image(cyclegan.gen_BtoA, input_image_, output_dir_)
-    df = pd.read_csv(data_folder / f"input_B_test{params['csv_type']}.csv")
-    for file_name in tqdm(df['file_name']):
-        input_image_ = data_folder / "input_B" / file_name
-        translate_image(cyclegan.gen_BtoA, input_image_, output_dir_)
+    for p, generator in [('A', generators['gen_AtoB']), ('B', generators['gen_BtoA'])]:
+        output_dir_  = data_folder / f"output_{p}_{params['output_name']}"
+        output_dir_.mkdir(parents=True, exist_ok=True)
+        remove_all_files(output_dir_)
+        file_names = []
+        for split in ['train', 'test']:
+            df = pd.read_csv(data_folder / f"input_{p}_{split}{params['csv_type']}.csv")
+            file_names += df['file_name'].tolist()
+        translate_batch_images(
+            generator,
+            img_dir=data_folder / f"input_{p}",
+            file_names=file_names,
+            output_dir=output_dir_,
+            batch_size=params.get('batch_size', 32),
+            num_workers=params.get('num_workers', 4))
 
 
 if __name__ == '__main__':
@@ -113,6 +188,7 @@ if __name__ == '__main__':
 
         'use_cuda': True,
         'batch_size' : 64,
+        'num_workers': 4,
     }
 
     translate_images(parameters)
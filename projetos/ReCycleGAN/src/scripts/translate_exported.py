@@ -0,0 +1,102 @@
+"""Translate images with a generator exported by `export_generators.py`.
+
+This module is self-contained: it only imports torch, numpy and PIL
+(and onnxruntime, for ONNX files), so it does not load the training
+dependencies (peft, wandb, lpips, ...).
+
+E.g., $python src/scripts/translate_exported.py cycle_gan_epoch_14_gen_AtoB.pt imgs/ out/
+"""
+import sys
+import json
+from pathlib import Path
+import numpy as np
+import torch
+from PIL import Image
+
+IMG_SUFFIXES = ['.jpg', '.jpeg', '.png']
+
+class ExportedGenerator():
+    """Exported generator, with its input preprocessing.
+
+    Attributes
+    ----------
+    path : str
+        TorchScript (.pt) or ONNX (.onnx) file. The JSON file with the
+        same name, written by the export, must be in the same folder.
+    device : str
+        Device for TorchScript files. Default is 'cpu'.
+    """
+    def __init__(self, path, device='cpu'):
+        self.path = Path(path)
+        self.metadata = self.read_metadata(path)
+        self.device = torch.device(device)
+        if self.metadata['format'] == 'onnx':
+            import onnxruntime  # pylint: disable=import-outside-toplevel,import-error
+            self.session = onnxruntime.InferenceSession(str(self.path))
+            self.model = None
+        else:
+            self.session = None
+            self.model = torch.jit.load(str(self.path), map_location=self.device)
+
+    @staticmethod
+    def read_metadata(path):
+        """Read the JSON file written with an exported generator."""
+        with open(Path(path).with_suffix('.json'), 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def preprocess(self, img):
+        """Convert a PIL image to a normalized (C, H, W) tensor."""
+        img = img.convert('RGB')
+        height, width = self.metadata['img_height'], self.metadata['img_width']
+        if img.size != (width, height):
+            img = img.resize((width, height), Image.Resampling.BICUBIC)
+        array = np.asarray(img, dtype=np.float32) / 255
+        array = (array - self.metadata['mean']) / self.metadata['std']
+        return torch.from_numpy(array).permute(2, 0, 1)
+
+    @staticmethod
+    def postprocess(output):
+        """Convert a (C, H, W) output in [-1, 1] to a PIL image."""
+        output = (output * 0.5 + 0.5).mul(255).byte()
+        return Image.fromarray(output.permute(1, 2, 0).cpu().numpy())
+
+    def __call__(self, batch):
+        """Translate a batch of normalized images, with shape (N, C, H, W)."""
+        if self.session is not None:
+            output = self.session.run(None, {'input': batch.numpy()})[0]
+            return torch.from_numpy(output)
+        batch = batch.to(self.device)
+        if self.metadata['channels_last']:
+            batch = batch.contiguous(memory_format=torch.channels_last)
+        with torch.inference_mode():
+            return self.model(batch)
+
+    def translate_files(self, files, output_dir, batch_size=8):
+        """Translate image files and save them as PNG in `output_dir`."""
+        output_dir = Path(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        files = list(files)
+        for start in range(0, len(files), batch_size):
+            batch_files = files[start:start + batch_size]
+            batch = torch.stack([self.preprocess(Image.open(f)) for f in batch_files])
+            for f, output in zip(batch_files, self(batch)):
+                self.postprocess(output).save(output_dir / f'{Path(f).stem}.png')
+
+def main(model_path, input_path, output_dir):
+    """Translate an image or all images in a folder."""
+    input_path = Path(input_path)
+    if input_path.is_dir():
+        files = sorted(f for f in input_path.iterdir() if f.suffix.lower() in IMG_SUFFIXES)
+    else:
+        files = [input_path]
+    # int8 generators only run on CPU
+    use_cuda = torch.cuda.is_available() and not ExportedGenerator.read_metadata(model_path)['int8']
+    generator = ExportedGenerator(model_path, device='cuda' if use_cuda else 'cpu')
+    generator.translate_files(files, output_dir)
+    print(f'{len(files)} images saved to {output_dir}')
+
+if __name__ == '__main__':
+    if len(sys.argv) != 4:
+        print('Usage: translate_exported.py MODEL INPUT OUTPUT_DIR')
+        sys.exit(1)
+    main(*sys.argv[1:])
@@ -3,4 +3,4 @@
 from .data_transform import ImageTools
 from .utils import *
 # from .run import *
-from .data_loader import ImageDataset, get_img_dataloader
+from .data_loader import ImageDataset, ShardedImageDataset, get_img_dataloader, pack_image_shards
@@ -0,0 +1,164 @@
+"""Background writer of training checkpoints."""
+import os
+import queue
+import threading
+from pathlib import Path
+import torch
+
+
+def snapshot_state(state, pin_memory=True):
+    """Copy of the tensors of a (nested) state dict in CPU memory.
+
+    GPU tensors are copied to pinned memory without blocking, and the
+    copies are synchronized once at the end. CPU tensors are cloned, so
+    training can go on changing the parameters in place.
+    """
+    pin_memory = pin_memory and torch.cuda.is_available()
+    has_cuda = False
+
+    def _copy(value):
+        nonlocal has_cuda
+        if isinstance(value, torch.Tensor):
+            if value.device.type == 'cpu':
+                return value.detach().clone()
+            has_cuda = True
+            out = torch.empty(value.shape, dtype=value.dtype, pin_memory=pin_memory)
+            out.copy_(value.detach(), non_blocking=pin_memory)
+            return out
+        if isinstance(value, dict):
+            return {k: _copy(v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return type(value)(_copy(v) for v in value)
+        return value
+
+    out = _copy(state)
+    if has_cuda:
+        torch.cuda.synchronize()
+    return out
+
+def atomic_save(state, path):
+    """torch.save to a temporary file, fsync, and rename it to `path`."""
+    path = Path(path)
+    tmp_path = path.with_name(f'.{path.name}.tmp')
+    with open(tmp_path, 'wb') as f:
+        torch.save(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    try:
+        dir_fd = os.open(path.parent, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(dir_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
+
+
+class CheckpointWriter():
+    """Save checkpoints on a worker thread.
+
+    `submit` only takes a CPU snapshot of the state (see `snapshot_state`);
+    serialization, fsync and the atomic rename run in the background.
+    Errors of the worker are raised on the next `submit` or `wait`.
+
+    Attributes
+    ----------
+    keep_last : int
+        Number of most recent checkpoints kept on disk. If zero, all
+        checkpoints are kept. Checkpoints are only deleted after their
+        `submit` callback has run.
+        (Default: 0)
+    pin_memory : bool
+        If True, GPU tensors are copied to pinned memory.
+        (Default: True)
+    best : Path
+        Checkpoint with the lowest score, always kept.
+    """
+    def __init__(self, keep_last=0, pin_memory=True):
+        self.keep_last = keep_last
+        self.pin_memory = pin_memory
+        self.saved = []
+        self.best = None
+        self.best_score = None
+        self._error = None
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._worker, daemon=True)
+        self._thread.start()
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            state, path, score, callback, rotate = item
+            try:
+                atomic_save(state, path)
+                # Retention runs after the callback (e.g. upload), so files are not
+                # deleted before their own callback, nor if it fails
+                if callback is not None:
+                    callback(path)
+                if rotate:
+                    self._retain(Path(path), score)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _retain(self, path, score):
+        if path in self.saved:
+            self.saved.remove(path)
+        self.saved.append(path)
+        if score is not None and (self.best_score is None or score < self.best_score):
+            self.best, self.best_score = path, score
+        if self.keep_last <= 0:
+            return
+        old = [p for p in self.saved[:-self.keep_last] if p != self.best]
+        for p in old:
+            p.unlink(missing_ok=True)
+            self.saved.remove(p)
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError('Checkpoint writer failed') from error
+
+    def submit(self, state, path, score=None, callback=None, rotate=True):
+        """Snapshot `state` and save it to `path` in the background.
+
+        Parameters
+        ----------
+        state : dict
+            State to save (state dicts, epoch, ...).
+        path : str or Path
+            Checkpoint file.
+        score : float
+            Score of the checkpoint (lower is better), used to keep the
+            best checkpoint. If None, the checkpoint is never the best.
+            (Default: None)
+        callback : function
+            Called as `callback(path)` on the worker thread after the
+            file is written, e.g. to upload it.
+            (Default: None)
+        rotate : bool
+            If False, the file is not counted in, nor deleted by, the
+            `keep_last` retention (e.g. a 'best' file overwritten in place).
+            (Default: True)
+        """
+        self._raise_error()
+        self._queue.put((snapshot_state(state, self.pin_memory), path, score, callback, rotate))
+
+    def wait(self):
+        """Block until all submitted checkpoints are written."""
+        self._queue.join()
+        self._raise_error()
+
+    def close(self):
+        """Write pending checkpoints and stop the worker thread."""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self._raise_error()
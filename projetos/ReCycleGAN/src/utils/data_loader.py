@@ -1,11 +1,17 @@
 """Module that holds the image DataLoader."""
 
 from pathlib import Path
+import numpy as np
+import torch
 from torch.utils.data import Dataset, DataLoader
 from torch.utils.data import RandomSampler, SequentialSampler
 from torchvision import transforms
 from PIL import Image
 import pandas as pd
+from tqdm import tqdm
+
+SHARD_INDEX_FILE = 'index.csv'
+SHARD_SOURCE_COLS = ['mtime_ns', 'file_size'] # Source file of each image, to detect changes
 
 class ImageDataset(Dataset):
     """Custom image Dataset."""
@@ -24,6 +30,14 @@ class ImageDataset(Dataset):
         """Set the length of the dataset."""
         self.image_paths = self.image_paths[:new_len]
 
+    def get_image_keys(self):
+        """Return a 'path:mtime' key for each image, used to cache image features."""
+        keys = []
+        for img in self.image_paths:
+            img_path = (self.img_dir / img).resolve()
+            keys.append(f'{img_path}:{img_path.stat().st_mtime_ns}')
+        return keys
+
     def __getitem__(self, idx):
         img_path = self.img_dir / self.image_paths[idx]
         image = Image.open(img_path).convert('RGB')
@@ -35,8 +49,196 @@ class ImageDataset(Dataset):
 
         return image
 
+class ShardedImageDataset(Dataset):
+    """Image Dataset read from memory-mapped uint8 shards.
+
+    Images are stored already decoded (HWC, RGB, uint8) in shard files
+    built by `pack_image_shards`. Each shard is memory-mapped once per
+    process, so no file is opened or decoded per sample.
+    """
+    def __init__(self, csv_file, shard_dir, transformation=None, file_name_col='file_name'):
+        if isinstance(csv_file, list):
+            self.image_paths = csv_file
+        else:
+            self.image_paths = pd.read_csv(csv_file)[file_name_col].tolist()
+        self.shard_dir = Path(shard_dir)
+        self.transformation = transformation
+
+        index = read_shard_index(self.shard_dir)
+        missing = set(self.image_paths) - set(index['file_name'])
+        if len(missing) > 0:
+            msg = f"{len(missing)} images not found in shards at {self.shard_dir}."
+            raise KeyError(msg)
+        self.locations = {
+            row.file_name: (row.shard, int(row.offset), int(row.height), int(row.width))
+            for row in index.itertuples(index=False)
+        }
+        self._shards = {}
+
+    def __len__(self):
+        return len(self.image_paths)
+
+    def set_len(self, new_len):
+        """Set the length of the dataset."""
+        self.image_paths = self.image_paths[:new_len]
+
+    def __getstate__(self):
+        # Memory maps are reopened lazily by each DataLoader worker.
+        state = self.__dict__.copy()
+        state['_shards'] = {}
+        return state
+
+    def _get_shard(self, shard):
+        if shard not in self._shards:
+            self._shards[shard] = np.memmap(
+                self.shard_dir / shard, dtype=np.uint8, mode='r')
+        return self._shards[shard]
+
+    def get_image_keys(self):
+        """Return a 'path@offset:mtime' key for each image, used to cache image features."""
+        mtimes = {}
+        keys = []
+        for img in self.image_paths:
+            shard, start, _, _ = self.locations[img]
+            if shard not in mtimes:
+                mtimes[shard] = (self.shard_dir / shard).stat().st_mtime_ns
+            keys.append(f'{(self.shard_dir / shard).resolve()}@{start}:{mtimes[shard]}')
+        return keys
+
+    def get_array(self, idx):
+        """Return the image `idx` as a (H, W, 3) uint8 array."""
+        shard, start, height, width = self.locations[self.image_paths[idx]]
+        buffer = self._get_shard(shard)[start:start + height * width * 3]
+        return np.array(buffer).reshape(height, width, 3)
+
+    def __getitem__(self, idx):
+        image = self.get_array(idx)
+
+        if self.transformation:
+            image = self.transformation(Image.fromarray(image))
+        else:
+            image = torch.from_numpy(image).permute(2, 0, 1).float().div(255)
+
+        return image
+
+def get_shard_dir(img_dir):
+    """Default folder of the shards built from `img_dir`."""
+    img_dir = Path(img_dir)
+    return img_dir.with_name(f'{img_dir.name}_shards')
+
+def read_shard_index(shard_dir):
+    """Read the shard index. Returns an empty index if there is none.
+
+    Indexes written before the source `mtime_ns` and `file_size` columns
+    were added get empty values, so their images are packed again.
+    """
+    index_file = Path(shard_dir) / SHARD_INDEX_FILE
+    if index_file.exists():
+        index = pd.read_csv(index_file)
+    else:
+        index = pd.DataFrame(columns=['file_name', 'shard', 'offset', 'height', 'width'])
+    for col in SHARD_SOURCE_COLS:
+        if col not in index:
+            index[col] = pd.NA
+        index[col] = index[col].astype('Int64')
+    return index
+
+def _source_stat(row):
+    """(mtime_ns, file_size) of the source of an index row, or None if unknown."""
+    if pd.isna(row.mtime_ns) or pd.isna(row.file_size):
+        return None
+    return int(row.mtime_ns), int(row.file_size)
+
+def pack_image_shards(csv_files, img_dir, shard_dir=None, file_name_col='file_name',
+                      shard_size=2**30):
+    """Pack images into uint8 shard files with an offset index.
+
+    Images already present in the index are skipped, so packing the
+    train and test splits of the same folder (or repacking after adding
+    images) only decodes the new images. Images whose source file changed
+    since they were packed (modification time or size, e.g., a folder of
+    translated images written again) are packed again in a new shard, so
+    readers and the caches keyed by shard (`get_image_keys`) see the new
+    pixels. Shards no longer referenced by the index are deleted.
+
+    Parameters:
+    ------------
+    csv_files: str or [str]
+        CSV file(s) containing image names.
+    img_dir: str
+        Path to the images folder.
+    shard_dir: str, optional
+        Output folder. If None, uses `get_shard_dir(img_dir)`.
+        (Default: None)
+    file_name_col: str
+        Column name in the CSV files containing the image names.
+        (Default: 'file_name')
+    shard_size: int
+        Approximate maximum size of each shard file, in bytes.
+        (Default: 2**30)
+
+    Returns:
+    ------------
+    Path
+        Folder with the shards.
+    """
+    if not isinstance(csv_files, (list, tuple)):
+        csv_files = [csv_files]
+    img_dir = Path(img_dir)
+    shard_dir = get_shard_dir(img_dir) if shard_dir is None else Path(shard_dir)
+    shard_dir.mkdir(parents=True, exist_ok=True)
+
+    index = read_shard_index(shard_dir)
+    packed = {row.file_name: _source_stat(row) for row in index.itertuples(index=False)}
+    sources = {}
+    for csv_file in csv_files:
+        for img in pd.read_csv(csv_file)[file_name_col]:
+            if img not in sources:
+                stat = (img_dir / img).stat()
+                sources[img] = (stat.st_mtime_ns, stat.st_size)
+    img_list = [img for img, stat in sources.items() if packed.get(img) != stat]
+    if len(img_list) == 0:
+        return shard_dir
+
+    old_shards = set(index['shard'])
+    index = index[~index['file_name'].isin(img_list)]
+    shard_id = 1 + max((int(name[len('shard_'):-len('.bin')]) for name in old_shards), default=-1)
+    rows = []
+    shard_file = None
+    try:
+        for img in tqdm(img_list, desc=f'Packing {img_dir.name}'):
+            with Image.open(img_dir / img) as image:
+                array = np.asarray(image.convert('RGB'), dtype=np.uint8)
+
+            if shard_file is None or shard_file.tell() + array.nbytes > shard_size:
+                if shard_file is not None:
+                    shard_file.close()
+                shard_name = f'shard_{shard_id:05d}.bin'
+                shard_file = open(shard_dir / shard_name, 'wb')  # pylint: disable=consider-using-with
+                shard_id += 1
+
+            rows.append({
+                'file_name': img,
+                'shard': shard_name,
+                'offset': shard_file.tell(),
+                'height': array.shape[0],
+                'width': array.shape[1],
+                'mtime_ns': sources[img][0],
+                'file_size': sources[img][1],
+            })
+            shard_file.write(array.tobytes())
+    finally:
+        if shard_file is not None:
+            shard_file.close()
+        if len(rows) > 0:
+            index = pd.concat([index, pd.DataFrame(rows)], axis=0, ignore_index=True)
+        index.to_csv(shard_dir / SHARD_INDEX_FILE, index=False)
+        for shard in old_shards - set(index['shard']):
+            (shard_dir / shard).unlink(missing_ok=True)
+    return shard_dir
+
 def get_img_dataloader(csv_file, img_dir=None, transformation=None, file_name_col='file_name',
-                       batch_size=32, shuffle=True, num_workers=1):
+                       batch_size=32, shuffle=True, num_workers=1, use_shards=False):
     """Get image DataLoader.
 
     Parameters:
@@ -63,6 +265,10 @@ def get_img_dataloader(csv_file, img_dir=None, transformation=None, file_name_co
     num_workers: int
         Number of workers.
         (Default: 1)
+    use_shards: bool
+        If True, read images from memory-mapped shards (see
+        `pack_image_shards`). Missing images are packed on first use.
+        (Default: False)
     """
     if img_dir is None:
         stem = Path(csv_file).stem
@@ -75,16 +281,27 @@ def get_img_dataloader(csv_file, img_dir=None, transformation=None, file_name_co
     if not Path(img_dir).exists():
         msg = f"Folder {img_dir} not found."
         raise FileNotFoundError(msg)
-    dataset = ImageDataset(csv_file, img_dir, transformation, file_name_col)
+    if use_shards:
+        shard_dir = pack_image_shards(csv_file, img_dir, file_name_col=file_name_col)
+        dataset = ShardedImageDataset(csv_file, shard_dir, transformation, file_name_col)
+    else:
+        dataset = ImageDataset(csv_file, img_dir, transformation, file_name_col)
     return DataLoader(dataset, batch_size=batch_size, shuffle=shuffle, num_workers=num_workers)
 
 def copy_dataloader(data_loader):
     """Copy a DataLoader."""
-    dataset = ImageDataset(
-        csv_file=data_loader.dataset.image_paths,
-        img_dir=data_loader.dataset.img_dir,
-        transformation=data_loader.dataset.transformation
-    )
+    if isinstance(data_loader.dataset, ShardedImageDataset):
+        dataset = ShardedImageDataset(
+            csv_file=data_loader.dataset.image_paths,
+            shard_dir=data_loader.dataset.shard_dir,
+            transformation=data_loader.dataset.transformation
+        )
+    else:
+        dataset = ImageDataset(
+            csv_file=data_loader.dataset.image_paths,
+            img_dir=data_loader.dataset.img_dir,
+            transformation=data_loader.dataset.transformation
+        )
     new_loader = DataLoader(
         dataset,
         batch_size=data_loader.batch_size,
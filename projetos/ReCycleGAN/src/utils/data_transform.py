@@ -1,18 +1,28 @@
 # pylint: disable=import-error
 """Module with class to build image dataset with transformations."""
 
+import os
+import csv
+import functools
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import numpy as np
 import pandas as pd
 from tqdm import tqdm
 from PIL import Image
-import matplotlib.pyplot as plt
 import torch
 from torchvision import transforms
 from torchvision.utils import make_grid
-from sklearn.model_selection import train_test_split
 
 from .utils import remove_all_files
+from .lazy import lazy_import
+
+plt = lazy_import('matplotlib.pyplot')
+model_selection = lazy_import('sklearn.model_selection')
+
+MANIFEST_FILE = '.manifest.csv'
+SIZE_INDEX_FILE = '.size_index.csv'
 
 
 class ImageTools():
@@ -20,28 +30,89 @@ class ImageTools():
     def __init__(self):
         pass
 
+    @staticmethod
+    def _transform_image(img, src_folder, output_folder,
+                         transformation_function, transformation_params):
+        src = Path(src_folder) / img
+        dest = Path(output_folder) / img
+        ok = transformation_function(src, dest, **transformation_params)
+        return img, bool(ok), src.stat().st_mtime_ns
+
+    @staticmethod
+    def _read_manifest(manifest_file, key):
+        """Images already processed with the same transformation.
+
+        Returns a dict {image: (ok, source mtime)}.
+        """
+        if not manifest_file.exists():
+            return {}
+        df = pd.read_csv(manifest_file, dtype={'file_name': str, 'key': str})
+        df = df[df['key'] == key]
+        return {r.file_name: (bool(r.ok), int(r.mtime_ns)) for r in df.itertuples()}
+
     @staticmethod
     def _transform_images(img_list, img_folder, output_folder,
-                          transformation_function, transformation_params):
+                          transformation_function, transformation_params,
+                          num_workers=0, chunksize=32, resume=True):
         f = Path(output_folder)
+        src_folder = Path(img_folder)
+        manifest_file = f / MANIFEST_FILE
+        key = (f'{transformation_function.__module__}.{transformation_function.__qualname__}'
+               f'|{transformation_params!r}')
+
+        done = ImageTools._read_manifest(manifest_file, key) if resume else {}
         if not f.exists():
             f.mkdir(parents=True)
-        else:
+        elif len(done) == 0:
             remove_all_files(f)
+        if len(done) == 0 and manifest_file.exists():
+            manifest_file.unlink()
+
+        results = {}
+        pending = []
+        for img in img_list:
+            if img in done:
+                ok, mtime_ns = done[img]
+                src = src_folder / img
+                if (src.exists() and src.stat().st_mtime_ns == mtime_ns
+                        and (not ok or (f / img).exists())):
+                    results[img] = ok
+                    continue
+            pending.append(img)
+        if len(results) > 0:
+            print(f'Skipping {len(results)} images already transformed.')
+
+        worker = functools.partial(
+            ImageTools._transform_image,
+            src_folder=src_folder,
+            output_folder=f,
+            transformation_function=transformation_function,
+            transformation_params=transformation_params)
 
-        src_folder = Path(img_folder)
-        img_ok = []
-        for img in tqdm(img_list):
-            src = src_folder / img
-            dest = f / img
-            if transformation_function(src, dest, **transformation_params):
-                img_ok.append(img)
-        return img_ok
+        new_file = not manifest_file.exists()
+        with open(manifest_file, 'a', encoding='utf-8', newline='') as manifest:
+            writer = csv.writer(manifest)
+            if new_file:
+                writer.writerow(['file_name', 'ok', 'mtime_ns', 'key'])
+
+            def _save(outputs):
+                for img, ok, mtime_ns in outputs:
+                    results[img] = ok
+                    writer.writerow([img, int(ok), mtime_ns, key])
+
+            if num_workers == 0 or len(pending) < 2:
+                _save(tqdm(map(worker, pending), total=len(pending)))
+            else:
+                with multiprocessing.Pool(num_workers) as pool:
+                    _save(tqdm(pool.imap_unordered(worker, pending, chunksize=chunksize),
+                               total=len(pending)))
+
+        return [img for img in img_list if results.get(img, False)]
 
 
     @staticmethod
     def _split_dataset(img_list, csv_file, split=0.7, seed=42):
-        img_train, img_test = train_test_split(
+        img_train, img_test = model_selection.train_test_split(
             img_list, train_size=split, random_state=seed, shuffle=True)
 
         csv_file = Path(csv_file)
@@ -64,7 +135,8 @@ class ImageTools():
 
     @staticmethod
     def build_dataset(img_list, img_folder, output_folder, transformation_function,
-                      transformation_params, split, random_seed):
+                      transformation_params, split, random_seed,
+                      num_workers=0, chunksize=32, resume=True):
         """Build image dataset with transformations.
 
         Parameters:
@@ -85,13 +157,41 @@ class ImageTools():
             Percentage of images to use for training.
         random_seed: int
             Random seed for reproducibility.
+        num_workers: int
+            Number of worker processes. If None, uses all CPUs.
+            If zero, transforms the images in the current process.
+            With workers, the transformation function must be picklable, and
+            the calling script needs an `if __name__ == '__main__':` guard
+            (spawn start method, e.g. on macOS and Windows).
+            (Default: 0)
+        chunksize: int
+            Number of images sent to a worker at a time.
+            (Default: 32)
+        resume: bool
+            If True, images listed in the manifest of the output folder,
+            transformed with the same function and parameters, are skipped.
+            Otherwise, the output folder is cleaned.
+            (Default: True)
+
+        If `transformation_params` has a 'size_filter', images of other sizes
+        are discarded using the size index of `img_folder` (see `read_image_sizes`),
+        without being sent to the transformation function.
         """
+        size_filter = transformation_params.get('size_filter')
+        if size_filter is not None:
+            sizes = ImageTools.read_image_sizes(img_folder, file_names=list(img_list))
+            size_ok = {tuple(s) for s in size_filter}
+            img_list = [f for f, w, h in sizes.itertuples() if (w, h) in size_ok]
+
         img_ok = ImageTools._transform_images(
             img_list=img_list,
             img_folder=img_folder,
             output_folder=output_folder,
             transformation_function=transformation_function,
-            transformation_params=transformation_params)
+            transformation_params=transformation_params,
+            num_workers=num_workers,
+            chunksize=chunksize,
+            resume=resume)
         ImageTools._split_dataset(
             img_list=img_ok,
             csv_file=Path(output_folder).parent / f'{Path(output_folder).name}.csv',
@@ -101,27 +201,92 @@ class ImageTools():
 
 
     @staticmethod
-    def img_size_count(img_folder, extension='jpg', verbose=False):
-        """Count the number of images by size in a folder.
+    def _read_image_size(img_path):
+        try:
+            with Image.open(img_path) as img:
+                return img.size
+        except (Image.UnidentifiedImageError, OSError):
+            return (-1, -1)
+
+    @staticmethod
+    def read_image_sizes(img_folder, file_names=None, extension='jpg', num_workers=16):
+        """Read the size of images in a folder.
+
+        Only the image headers are read, in parallel threads. Sizes are
+        cached in a sidecar index in the folder, keyed by file name and
+        modification time, so only new or changed images are read again.
 
         Attributes:
         ------------
         img_folder: str
             Path to the folder containing images.
+        file_names: [str]
+            Images to read. If None, reads all images with `extension`.
+            (Default: None)
         extension: str
             Image file extension.
             (Default: 'jpg')
+        num_workers: int
+            Number of threads.
+            (Default: 16)
+
+        Returns:
+        ---------
+        pd.DataFrame
+            Columns 'width' and 'height', indexed by file name. Images that
+            could not be opened have size (-1, -1).
         """
-        sizes = []
         img_folder = Path(img_folder)
-        for img_path in tqdm(list(img_folder.glob(f'*.{extension}'))):
+        with os.scandir(img_folder) as it:
+            mtimes = {e.name: e.stat().st_mtime_ns for e in it if e.is_file()}
+        if file_names is None:
+            file_names = [f for f in mtimes if f.endswith(f'.{extension}')]
+        else:
+            file_names = [f for f in file_names if f in mtimes]
+
+        index_file = img_folder / SIZE_INDEX_FILE
+        index = {}
+        if index_file.exists():
+            df = pd.read_csv(index_file, dtype={'file_name': str})
+            index = {r.file_name: (r.mtime_ns, r.width, r.height) for r in df.itertuples()}
+
+        missing = [f for f in file_names if f not in index or index[f][0] != mtimes[f]]
+        if len(missing) > 0:
+            with ThreadPoolExecutor(max_workers=num_workers) as executor:
+                sizes = executor.map(ImageTools._read_image_size,
+                                     [img_folder / f for f in missing])
+                for f, (width, height) in zip(missing, tqdm(sizes, total=len(missing))):
+                    index[f] = (mtimes[f], width, height)
+
+            df = pd.DataFrame([(f, *v) for f, v in index.items() if f in mtimes],
+                              columns=['file_name', 'mtime_ns', 'width', 'height'])
             try:
-                with Image.open(img_path) as img:
-                    sizes.append(img.size)
-            except Image.UnidentifiedImageError:
-                if verbose:
-                    print(f'Error opening image: {img_path}')
-        df_sizes = pd.DataFrame(sizes, columns=['width', 'height'])
+                df.to_csv(index_file, index=False)
+            except OSError:
+                pass
+
+        return pd.DataFrame([index[f][1:] for f in file_names],
+                            index=pd.Index(file_names, name='file_name'),
+                            columns=['width', 'height'])
+
+    @staticmethod
+    def img_size_count(img_folder, extension='jpg', verbose=False):
+        """Count the number of images by size in a folder.
+
+        Attributes:
+        ------------
+        img_folder: str
+            Path to the folder containing images.
+        extension: str
+            Image file extension.
+            (Default: 'jpg')
+        """
+        df_sizes = ImageTools.read_image_sizes(img_folder, extension=extension)
+        invalid = df_sizes['width'] < 0
+        if verbose:
+            for f in df_sizes.index[invalid]:
+                print(f'Error opening image: {Path(img_folder) / f}')
+        df_sizes = df_sizes[~invalid].reset_index(drop=True)
         return df_sizes.value_counts().reset_index(name='count')
 
 
@@ -170,12 +335,15 @@ class ImageTools():
 
             def _remove_black_borders(img, target_width, target_height):
                 gray_img = img.convert('L')
-                np_gray = np.array(gray_img)
+                np_gray = np.asarray(gray_img)
                 mask = np_gray > 10
-                coords = np.argwhere(mask)
-                if coords.size > 0:
-                    x0, y0 = coords.min(axis=0)
-                    x1, y1 = coords.max(axis=0) + 1
+                rows = mask.any(axis=1)
+                cols = mask.any(axis=0)
+                if rows.any():
+                    x0 = rows.argmax()
+                    x1 = len(rows) - rows[::-1].argmax()
+                    y0 = cols.argmax()
+                    y1 = len(cols) - cols[::-1].argmax()
 
                     if (x1-x0<target_width) or (y1-y0<target_height):
                         return None
@@ -289,6 +457,27 @@ class ImageTools():
         plt.tight_layout()
         return fig
 
+    @staticmethod
+    def grid_to_array(img, nrow=8, padding=2):
+        """Image tensor batch as an uint8 grid (height, width, channels).
+
+        As in `show_img`, if negative values are present, the scale is
+        assumed to be [-1, 1], and is then changed to [0, 1].
+        """
+        img = img.detach().cpu()
+        if img.min() < 0:
+            img = (img + 1) / 2
+        grid = make_grid(img, nrow=nrow, padding=padding, normalize=False, scale_each=False)
+        grid = grid.mul(255).add_(0.5).clamp_(0, 255).to(torch.uint8)
+        return grid.permute(1, 2, 0).numpy()
+
+    @staticmethod
+    def save_png(array, file_path, compress_level=1):
+        """Save an uint8 image array (height, width, channels) as PNG."""
+        if array.shape[2] == 1:
+            array = array[:, :, 0]
+        Image.fromarray(array).save(file_path, format='PNG', compress_level=compress_level)
+
 
     @staticmethod
     def image_folder_to_tensor(img_dir, img_size=(256, 256), img_glob='*'):
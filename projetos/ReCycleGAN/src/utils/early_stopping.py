@@ -0,0 +1,44 @@
+"""Early stopping policy for training loops."""
+import math
+
+
+class EarlyStopping():
+    """Stop training when a score (lower is better) stops improving.
+
+    Args:
+    - patience: Number of evaluations without improvement before stopping.
+    If zero, never stops. Default is 5.
+    - min_delta: Minimum decrease of the score counted as an improvement. Default is 0.
+    """
+    def __init__(self, patience=5, min_delta=0.0):
+        self.patience = patience
+        self.min_delta = min_delta
+        self.best_score = math.inf
+        self.best_epoch = None
+        self.n_bad = 0
+
+    def update(self, score, epoch=None):
+        """Register a new score. Returns True if it is the best so far."""
+        if score < self.best_score - self.min_delta:
+            self.best_score = score
+            self.best_epoch = epoch
+            self.n_bad = 0
+            return True
+        self.n_bad += 1
+        return False
+
+    def state_dict(self):
+        """State to save with a checkpoint, to resume the policy on restart."""
+        return {'best_score': self.best_score, 'best_epoch': self.best_epoch, 'n_bad': self.n_bad}
+
+    def load_state_dict(self, state):
+        """Restore a state saved by `state_dict`."""
+        self.best_score = state['best_score']
+        self.best_epoch = state['best_epoch']
+        self.n_bad = state['n_bad']
+
+    @property
+    def should_stop(self):
+        """True if the score did not improve in the last `patience` evaluations."""
+        return self.patience > 0 and self.n_bad >= self.patience
+
@@ -0,0 +1,35 @@
+"""Deferred imports of heavy optional dependencies."""
+import importlib
+
+
+class LazyModule():
+    """Module imported on the first attribute access.
+
+    Used for dependencies only needed by some features (plots, logging,
+    metrics networks), so that importing the package stays fast.
+
+    Attributes
+    ----------
+    name : str
+        Full name of the module, e.g. 'matplotlib.pyplot'.
+    """
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        status = 'loaded' if self._module is not None else 'not loaded'
+        return f"<lazy module '{self._name}' ({status})>"
+
+
+def lazy_import(name):
+    """Return a LazyModule for `name`."""
+    return LazyModule(name)
@@ -0,0 +1,157 @@
+# pylint: disable=invalid-name
+"""Per-step timing and memory instrumentation for training loops."""
+import gc
+import time
+from contextlib import contextmanager, nullcontext
+import torch
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from .utils import get_gpu_memory_usage
+
+
+def _read_proc_status(field):
+    with open('/proc/self/status', encoding='utf-8') as f:
+        for line in f:
+            if line.startswith(f'{field}:'):
+                return int(line.split()[1]) / 1024
+    raise OSError(f'{field} not found')
+
+def reset_peak_host_memory():
+    """Reset the peak RSS of this process (Linux), and return the current RSS in MB.
+
+    Where the peak can not be reset, returns the peak RSS since the process started.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w', encoding='utf-8') as f:
+            f.write('5')
+        return _read_proc_status('VmRSS')
+    except OSError:
+        return peak_host_memory()
+
+def peak_host_memory():
+    """Peak RSS of this process (MB) since the last `reset_peak_host_memory`."""
+    try:
+        return _read_proc_status('VmHWM')
+    except OSError:
+        if resource is None:
+            return 0.0
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class StepProfiler:
+    """Collects step timings, samples memory and flushes the allocator.
+
+    Sections (e.g. 'forward', 'backward', 'step') are timed with CUDA
+    events when running on GPU, so timing does not force a host-device
+    synchronization on every step: events are only read in `summary`.
+    On CPU, `time.perf_counter` is used. Data-wait time is measured on
+    the host, between the end of a step and the start of the next one.
+
+    Args:
+    - device: Device used for training.
+    - enabled: If False, only the allocator policy is applied. Default is True.
+    - memory_interval: Steps between memory samples. If zero, never samples. Default is 50.
+    - empty_cache_interval: Steps between `gc.collect()` and `torch.cuda.empty_cache()` calls.
+    If zero, never flushes. Default is 0.
+    """
+    def __init__(self, device='cpu', enabled=True, memory_interval=50, empty_cache_interval=0):
+        self.use_cuda = torch.device(device).type == 'cuda'
+        self.enabled = enabled
+        self.memory_interval = memory_interval
+        self.empty_cache_interval = empty_cache_interval
+        self.reset()
+
+    def reset(self):
+        """Start a new epoch."""
+        self.steps = 0
+        self.times = {}
+        self.events = []
+        self.memory = {}
+        self.gpu_usage = ''
+        self._time_start = time.perf_counter()
+        self._last_step_end = self._time_start
+        if self.use_cuda:
+            torch.cuda.reset_peak_memory_stats()
+        elif self.memory_interval > 0:
+            reset_peak_host_memory()
+
+    def _add_time(self, name, value):
+        self.times[name] = self.times.get(name, 0.0) + value
+
+    def step_start(self):
+        """Mark the start of a step (after the batch is available)."""
+        if self.enabled:
+            self._add_time('data', time.perf_counter() - self._last_step_end)
+
+    def step_end(self):
+        """Mark the end of a step. Samples memory and flushes the allocator."""
+        self.steps += 1
+        if self.memory_interval > 0 and self.steps % self.memory_interval == 0:
+            self.sample_memory()
+        if self.empty_cache_interval > 0 and self.steps % self.empty_cache_interval == 0:
+            torch.cuda.empty_cache()
+            gc.collect()
+        self._last_step_end = time.perf_counter()
+
+    @contextmanager
+    def _section(self, name):
+        if self.use_cuda:
+            start = torch.cuda.Event(enable_timing=True)
+            end = torch.cuda.Event(enable_timing=True)
+            start.record()
+            yield
+            end.record()
+            self.events.append((name, start, end))
+        else:
+            time_start = time.perf_counter()
+            yield
+            self._add_time(name, time.perf_counter() - time_start)
+
+    def section(self, name):
+        """Context manager that adds the elapsed time to section `name`."""
+        if not self.enabled:
+            return nullcontext()
+        return self._section(name)
+
+    def sample_memory(self):
+        """Record the current memory usage (peak RSS of the process on CPU)."""
+        if not self.use_cuda:
+            self.memory['mem_host_peak'] = peak_host_memory()
+            return
+        allocated = torch.cuda.memory_allocated() / 1024**2
+        self.memory['mem_allocated'] = max(self.memory.get('mem_allocated', 0.0), allocated)
+        self.memory['mem_max_allocated'] = torch.cuda.max_memory_allocated() / 1024**2
+        self.gpu_usage = get_gpu_memory_usage('', True)
+
+    def summary(self):
+        """Timings of the epoch.
+
+        Returns a dict with total time, steps per second and the mean time
+        per step (in ms) of each section, plus memory samples (in MB).
+        """
+        total = time.perf_counter() - self._time_start
+        times = dict(self.times)
+        if len(self.events) > 0:
+            torch.cuda.synchronize()
+            for name, start, end in self.events:
+                times[name] = times.get(name, 0.0) + start.elapsed_time(end) / 1000
+        out = {
+            'time_total': total,
+            'steps_per_s': self.steps / total if total > 0 else 0.0,
+        }
+        if self.enabled:
+            for name, value in times.items():
+                out[f'time_{name}_ms'] = value / max(self.steps, 1) * 1000
+        out.update(self.memory)
+        return out
+
+    def __str__(self):
+        out = []
+        for k, v in self.summary().items():
+            out.append(f'{k}={v:.4g}')
+        return ', '.join(out)
+
@@ -1,23 +1,29 @@
 # pylint: disable=wrong-import-position,no-name-in-module,wrong-import-order,import-error,invalid-name,line-too-long
 """Functions to control training and testing CycleGAN models."""
-import time
-import gc
-import matplotlib.pyplot as plt
+import warnings
+import functools
 from pathlib import Path
 import torch
 from torchvision import transforms
+import pandas as pd
 from tqdm import tqdm
-import wandb
 
 from .utils import get_gpu_memory_usage, get_current_commit, remove_all_files, save_dict_as_json, load_json_to_dict
 from .data_loader import get_img_dataloader
-from .data_transform import ImageTools
+from .profiler import StepProfiler
+from .checkpoint import CheckpointWriter
+from .samples import SampleRenderer
+from .early_stopping import EarlyStopping
+from .lazy import lazy_import
 from ..models.cyclegan import CycleGAN
 from ..models.losses import LossValues, LossLists
 from ..metrics.fid import FID
 from ..metrics.lpips import LPIPS
+from ..metrics.running_stats import RunningStatistics
 
-def save_losses(loss: LossLists, filename='losses.txt'):
+wandb = lazy_import('wandb')
+
+def save_losses(loss: LossLists, filename='losses.txt', timings=None, first_epoch=0):
     """
     Saves the generator and discriminator losses to a text file.
 
@@ -27,13 +33,28 @@ def save_losses(loss: LossLists, filename='losses.txt'):
     Args:
     - loss (LossLists): An instance of LossLists containing lists of losses.
     - filename (str): The file path where the losses will be saved. Defaults to 'losses.txt'.
+    - timings (list): Training step timings per epoch (`StepProfiler.summary()`),
+    added as extra columns. If the dicts have an 'epoch' key, rows are matched by epoch,
+    otherwise by position (a warning is issued, and timings are skipped, if the
+    lengths differ). Default is None.
+    - first_epoch (int): Epoch of the first losses, e.g. after a restart. Default is 0.
     """
     df = loss.to_dataframe()
+    df.index = df.index + first_epoch
+    if timings:
+        timings_df = pd.DataFrame(timings)
+        if 'epoch' in timings_df:
+            df = df.join(timings_df.set_index('epoch'))
+        elif len(timings_df) == len(df):
+            df = df.join(timings_df.set_index(df.index))
+        else:
+            warnings.warn(f'{len(timings_df)} timings for {len(df)} epochs of losses: timings not saved.')
     df = df.rename_axis('Epoch')
     df.to_csv(filename, index=True)
 
 
-def train_one_epoch(epoch, model, train_A, train_B, device, n_samples=None, plp_step=0):
+def train_one_epoch(epoch, model, train_A, train_B, device, n_samples=None, plp_step=0, profiler=None,
+                    sync_interval=50):
     """
     Trains the CycleGAN model for a single epoch and returns the generator and discriminator losses.
 
@@ -48,6 +69,10 @@ def train_one_epoch(epoch, model, train_A, train_B, device, n_samples=None, plp_
     If None, train on all samples. Default is None.
     - plp_step: Steps between Path Length Penalty calculations. Used to adjust
     PLP loss value. Default is 0.
+    - profiler (StepProfiler): Collects step timings and memory usage.
+    If None, nothing is measured. Default is None.
+    - sync_interval (int): Steps between reads of the losses from the device
+    (progress bar and running sums). If zero, losses are only read at the end. Default is 50.
 
     Returns:
     - loss_G (float): The total loss of the generator for this epoch.
@@ -60,13 +85,15 @@ def train_one_epoch(epoch, model, train_A, train_B, device, n_samples=None, plp_
     - Progress is tracked with a `tqdm` progress bar that shows current generator
     and discriminator losses.
     """
-    time_start = time.time()
+    if profiler is None:
+        profiler = StepProfiler(device, enabled=False, memory_interval=0)
+    profiler.reset()
     model.train()
     progress_bar = tqdm(zip(train_A, train_B), desc=f'Epoch {epoch:03d}',
                         leave=False, disable=False)
 
-    losses_ = LossValues(len(train_A), len(train_B), plp_step)
-    for batch_A, batch_B in progress_bar:
+    losses_ = LossValues(len(train_A), len(train_B), plp_step, sync_interval)
+    for step, (batch_A, batch_B) in enumerate(progress_bar, start=1):
         progress_bar.set_description(f'Epoch {epoch:03d}')
 
         if n_samples is not None:
@@ -75,30 +102,33 @@ def train_one_epoch(epoch, model, train_A, train_B, device, n_samples=None, plp_
 
         real_A = batch_A.to(device)
         real_B = batch_B.to(device)
+        profiler.step_start()
 
-        loss = model.optimize(real_A, real_B)
+        loss = model.optimize(real_A, real_B, profiler=profiler)
 
         losses_.add(loss)
 
-        progress_bar.set_postfix({
-            'G_loss': f'{loss.loss_G.item():.4f}',
-            'D_A_loss': f'{loss.loss_D_A.item():.4f}',
-            'D_B_loss': f'{loss.loss_D_B.item():.4f}',
-            'GPU': f'{get_gpu_memory_usage("",True)}',
-        })
-
-        torch.cuda.empty_cache()
-        gc.collect()
+        if sync_interval > 0 and step % sync_interval == 0:
+            progress_bar.set_postfix({
+                'G_loss': f'{loss.loss_G.item():.4f}',
+                'D_A_loss': f'{loss.loss_D_A.item():.4f}',
+                'D_B_loss': f'{loss.loss_D_B.item():.4f}',
+                'GPU': profiler.gpu_usage,
+            })
+        profiler.step_end()
 
     progress_bar.close()
     losses_.normalize()
     model.update_lr()
 
-    print(f'Epoch {epoch:03d}: {str(losses_)}, Time={time.time() - time_start:.2f} s')
+    print(f'Epoch {epoch:03d}: {str(losses_)}, Time={profiler.summary()["time_total"]:.2f} s')
+    if profiler.enabled:
+        print(f'     Profile: {str(profiler)}')
     return losses_
 
 
-def evaluate(epoch, model, test_A, test_B, device, n_samples=None, plp_step=0, amp=False):
+def evaluate(epoch, model, test_A, test_B, device, n_samples=None, plp_step=0, amp=False, profiler=None,
+             sync_interval=50):
     """
     Evaluates the CycleGAN model and returns the generator and discriminator losses.
 
@@ -114,19 +144,25 @@ def evaluate(epoch, model, test_A, test_B, device, n_samples=None, plp_step=0, a
     - plp_step: Steps between Path Length Penalty calculations. Used to adjust
     PLP loss value. Default is 0.
     - amp (bool): Whether to use Automatic Mixed Precision (AMP) for training. Default is False.
+    - profiler (StepProfiler): Collects step timings and memory usage.
+    If None, nothing is measured. Default is None.
+    - sync_interval (int): Steps between reads of the losses from the device
+    (progress bar and running sums). If zero, losses are only read at the end. Default is 50.
 
     Returns:
     - loss_G (float): The total loss of the generator.
     - loss_D_A (float): The total loss of discriminator A.
     - loss_D_B (float): The total loss of discriminator B.
     """
-    time_start = time.time()
+    if profiler is None:
+        profiler = StepProfiler(device, enabled=False, memory_interval=0)
+    profiler.reset()
     model.eval()
     progress_bar = tqdm(zip(test_A, test_B), desc=f'Epoch {epoch:03d}',
                         leave=False, disable=False)
 
-    losses_ = LossValues(len(test_A), len(test_B), plp_step)
-    for batch_A, batch_B in progress_bar:
+    losses_ = LossValues(len(test_A), len(test_B), plp_step, sync_interval)
+    for step, (batch_A, batch_B) in enumerate(progress_bar, start=1):
         progress_bar.set_description(f'Epoch {epoch:03d}')
 
         if n_samples is not None:
@@ -135,26 +171,26 @@ def evaluate(epoch, model, test_A, test_B, device, n_samples=None, plp_step=0, a
 
         real_A = batch_A.to(device)
         real_B = batch_B.to(device)
+        profiler.step_start()
 
-        with torch.no_grad():
+        with torch.no_grad(), profiler.section('forward'):
             loss = model.compute_loss(real_A, real_B, training=False, amp=amp)
 
         losses_.add(loss)
 
-        progress_bar.set_postfix({
-            'G_loss': f'{loss.loss_G.item():.4f}',
-            'D_A_loss': f'{loss.loss_D_A.item():.4f}',
-            'D_B_loss': f'{loss.loss_D_B.item():.4f}',
-            'GPU': f'{get_gpu_memory_usage("",True)}',
-        })
-
-        torch.cuda.empty_cache()
-        gc.collect()
+        if sync_interval > 0 and step % sync_interval == 0:
+            progress_bar.set_postfix({
+                'G_loss': f'{loss.loss_G.item():.4f}',
+                'D_A_loss': f'{loss.loss_D_A.item():.4f}',
+                'D_B_loss': f'{loss.loss_D_B.item():.4f}',
+                'GPU': profiler.gpu_usage,
+            })
+        profiler.step_end()
 
     progress_bar.close()
     losses_.normalize()
 
-    print(f'     Test: {str(losses_)}, Time={time.time() - time_start:.2f} s')
+    print(f'     Test: {str(losses_)}, Time={profiler.summary()["time_total"]:.2f} s')
     return losses_
 
 
@@ -184,7 +220,10 @@ def init_cyclegan_train(params):
             norm_type=params["norm_type"],
             add_skip=params["add_skip"], 
             add_attention=params["add_attention"], 
+            attention_chunk_size=params.get("attention_chunk_size", None),
             add_lora=params["add_lora"],
+            lora_rank=params.get("lora_rank", 4),
+            train_lora_only=params.get("train_lora_only", False),
             use_replay_buffer=params["use_replay_buffer"],
             replay_buffer_size=params["replay_buffer_size"],
             vanilla_loss=params["vanilla_loss"],
@@ -199,6 +238,11 @@ def init_cyclegan_train(params):
             step_size=params["step_size"],
             gamma=params["gamma"],
             amp=params["amp"],
+            fused_forward=params.get("fused_forward", False),
+            compile_step=params.get("compile_step", False),
+            compile_mode=params.get("compile_mode", 'default'),
+            fused_optimizer=params.get("fused_optimizer", False),
+            checkpoint_residual=params.get("checkpoint_residual", False),
         )
 
     def _get_transformation(params):
@@ -219,18 +263,23 @@ def init_cyclegan_train(params):
         test_B_csv = params['data_folder'] / f'input_B_test{params["csv_type"]}.csv'
 
         batch_size = params["batch_size"]
+        use_shards = params.get("use_shards", False)
         train_A = get_img_dataloader(csv_file=train_A_csv,
                                     batch_size=batch_size,
-                                    transformation=transformation)
+                                    transformation=transformation,
+                                    use_shards=use_shards)
         test_A = get_img_dataloader(csv_file=test_A_csv,
                                     batch_size=batch_size,
-                                    transformation=transformation)
+                                    transformation=transformation,
+                                    use_shards=use_shards)
         train_B = get_img_dataloader(csv_file=train_B_csv,
                                     batch_size=batch_size,
-                                    transformation=transformation)
+                                    transformation=transformation,
+                                    use_shards=use_shards)
         test_B = get_img_dataloader(csv_file=test_B_csv,
                                     batch_size=batch_size,
-                                    transformation=transformation)
+                                    transformation=transformation,
+                                    use_shards=use_shards)
 
         n_train = min(len(train_A.dataset), len(train_B.dataset))
         train_A.dataset.set_len(n_train)
@@ -264,6 +313,9 @@ def init_cyclegan_train(params):
     params['commit_msg'] = commit_msg
 
     model = _init_new_cycle_gan(params)
+    if params.get('lora_base_path') is not None and params['restart_path'] is None:
+        model.load_base(params['lora_base_path'])
+        print(f"LoRA base weights from {Path(params['lora_base_path']).name}")
     if params['restart_path'] is not None:
         params['restart_epoch'] = model.load_model(params['restart_path'])
         print(f"Restarting from {Path(params['restart_path']).name} at epoch {params['restart_epoch']}")
@@ -276,12 +328,82 @@ def init_cyclegan_train(params):
     transformation = _get_transformation(params)
     train_A, test_A, train_B, test_B = _init_dataloaders(params, transformation)
 
-    fid = FID(dims=2048, cuda=params['use_cuda'], batch_size=128)
+    fid = FID(dims=2048, cuda=params['use_cuda'], batch_size=128,
+              cache_dir=params['data_folder'] / 'fid_cache')
     lpips = LPIPS(cuda=params['use_cuda'], batch_size=128)
 
     return model, (train_A, test_A, train_B, test_B), (fid, lpips)
 
 
+def get_eval_dataloaders(params):
+    """Deterministic data loaders of the full A and B test sets.
+
+    Images are only resized and center-cropped (no random crop or flip),
+    and are not shuffled.
+    """
+    transformation = transforms.Compose([
+        transforms.Resize(params["img_height"], transforms.InterpolationMode.BICUBIC),
+        transforms.CenterCrop((params["img_height"], params["img_width"])),
+        transforms.ToTensor(),
+        transforms.Normalize(mean=[0.5, 0.5, 0.5], std=[0.5, 0.5, 0.5])
+    ])
+    loaders = []
+    for p in ['A', 'B']:
+        test_csv = params['data_folder'] / f'input_{p}_test{params["csv_type"]}.csv'
+        loaders.append(get_img_dataloader(csv_file=test_csv,
+                                          batch_size=params["batch_size"],
+                                          transformation=transformation,
+                                          shuffle=False,
+                                          use_shards=params.get("use_shards", False)))
+    return loaders
+
+
+def get_real_statistics(fid, params, eval_loaders=None):
+    """FID statistics of the full A and B test sets.
+
+    Images are only center-cropped (see `get_eval_dataloaders`), so the
+    statistics are computed once and then read from the FID cache in the
+    following calls.
+    """
+    if eval_loaders is None:
+        eval_loaders = get_eval_dataloaders(params)
+    return [fid.compute_statistics_of_imgs(imgs) for imgs in eval_loaders]
+
+
+def full_test_metrics(model, metrics, test_A, test_B, real_statistics, device):
+    """FID and LPIPS of the translations of the full A and B test sets.
+
+    `test_A` and `test_B` should be deterministic (see `get_eval_dataloaders`),
+    so the scores of different epochs are comparable.
+    FID is calculated against the cached statistics of the real test
+    images (see `get_real_statistics`), and LPIPS is the mean distance
+    between each image and its translation. Generated images are not
+    kept in memory: only the running statistics of their activations.
+
+    Returns a dict with 'FID_AtoB', 'LPIPS_AtoB', 'FID_BtoA' and 'LPIPS_BtoA'.
+    """
+    fid, lpips = metrics
+    real_stats_A, real_stats_B = real_statistics
+    model.eval()
+    out = {}
+    for name, generator, imgs, (m_real, s_real) in [('AtoB', model.gen_AtoB, test_A, real_stats_B),
+                                                    ('BtoA', model.gen_BtoA, test_B, real_stats_A)]:
+        statistics = RunningStatistics(fid.dims)
+        lpips_sum = 0.0
+        with torch.no_grad():
+            for real in tqdm(imgs, desc=f'Full test metrics {name}'):
+                real = real.to(device)
+                fake = generator(real)
+                statistics.update(fid.batch_activations(fake))
+                if lpips.cuda:
+                    real, fake = real.cuda(), fake.cuda()
+                lpips_sum += lpips.model.forward(real, fake).sum().item()
+        m_fake, s_fake = statistics.get()
+        out[f'FID_{name}'] = FID.calculate_frechet_distance(m_real, s_real, m_fake, s_fake)
+        out[f'LPIPS_{name}'] = lpips_sum / max(statistics.n, 1)
+    return out
+
+
 def train_cyclegan(model, data_loaders, params, metrics):
     """Wrapper function to train the CycleGAN model."""
 
@@ -303,122 +425,195 @@ def train_cyclegan(model, data_loaders, params, metrics):
 
     train_A, test_A, train_B, test_B = data_loaders
     losses_list = LossLists()
-
-    for epoch in range(params['restart_epoch']+1, params['num_epochs']):
-        losses_ = train_one_epoch(
-            epoch=epoch,
-            model=model,
-            train_A=train_A,
-            train_B=train_B,
-            device=params['device'],
-            n_samples=params['n_samples'],
-            plp_step=params['plp_step'],
-        )
-
-        losses_test_ = evaluate(
-            epoch=epoch,
-            model=model,
-            test_A=test_A,
-            test_B=test_B,
-            device=params['device'],
-            n_samples=params['n_samples'],
-            plp_step=params['plp_step'],
-            amp=params['amp'],
-        )
-
-        # Calculate FID and LPIPS metrics
-        fid, lpips = metrics
-
-        with torch.no_grad():
-            real_A = next(iter(test_A)).to(params['device'])
-            real_B = next(iter(test_B)).to(params['device'])
-            fake_A, fake_B = model.generate_samples(real_A, real_B)
-
-            # Calculate FID and LPIPS for A → B
-            fid_score_AtoB = fid.get(real_B, fake_B)
-            lpips_score_AtoB = lpips.get(real_B, fake_B)
-
-            # Calculate FID and LPIPS for B → A
-            fid_score_BtoA = fid.get(real_A, fake_A)
-            lpips_score_BtoA = lpips.get(real_A, fake_A)
-
-        print(f'Epoch {epoch:03d} - FID A→B: {fid_score_AtoB:0.4f}, LPIPS A→B: {lpips_score_AtoB.mean():0.4f}')
-        print(f'Epoch {epoch:03d} - FID B→A: {fid_score_BtoA:0.4f}, LPIPS B→A: {lpips_score_BtoA.mean():0.4f}')
-
-        losses_list.append(losses_)
-        losses_list.append(losses_test_, test=True)
-
-        save_losses(losses_list, filename=params['out_folder'] / 'losses.txt')
-        save_checkpoint(model, params, epoch)
-        sample_A_path, sample_B_path = save_samples(model, params, test_A, test_B, epoch)
-
-        if params['run_wandb']:
-            wandb.log({
-                'G_loss/Total/train': losses_.loss_G,
-                'G_loss/Adv/train': losses_.loss_G_ad,
-                'G_loss/Cycle/train': losses_.loss_G_cycle,
-                'G_loss/ID/train': losses_.loss_G_id,
-                'G_loss/PLP/train': losses_.loss_G_plp,
-                'D_loss/Disc_A/train': losses_.loss_D_A,
-                'D_loss/Disc_B/train': losses_.loss_D_B,
-
-                'G_loss/Total/test': losses_test_.loss_G,
-                'G_loss/Adv/test': losses_test_.loss_G_ad,
-                'G_loss/Cycle/test': losses_test_.loss_G_cycle,
-                'G_loss/ID/test': losses_test_.loss_G_id,
-                'G_loss/PLP/test': losses_test_.loss_G_plp,
-                'D_loss/Disc_A/test': losses_test_.loss_D_A,
-                'D_loss/Disc_B/test': losses_test_.loss_D_B,
-
-                'FID_AtoB': fid_score_AtoB,
-                'LPIPS_AtoB': lpips_score_AtoB.mean(),
-                'FID_BtoA': fid_score_BtoA,
-                'LPIPS_BtoA': lpips_score_BtoA.mean(),
-
-                "Samples/Imgs_A": wandb.Image(str(sample_A_path)),
-                "Samples/Imgs_B": wandb.Image(str(sample_B_path)),
-            })
-
-    if (params['num_epochs']-1) % params['checkpoint_interval'] != 0:
-        save_checkpoint(model, params, epoch, force=True)
+    timings_list = []
+    eval_A, eval_B = get_eval_dataloaders(params)
+    real_stats_A, real_stats_B = get_real_statistics(metrics[0], params, (eval_A, eval_B))
+    profiler = StepProfiler(params['device'],
+                            enabled=params.get('profile_steps', True),
+                            memory_interval=params.get('memory_interval', 50),
+                            empty_cache_interval=params.get('empty_cache_interval', 0))
+    renderer = SampleRenderer(background=params.get('background_samples', True))
+    # Fixed probe batches, decoded once and kept on the device
+    probe_A = next(iter(test_A)).to(params['device'])
+    probe_B = next(iter(test_B)).to(params['device'])
+    writer = None
+    if params.get('async_checkpoint', True):
+        writer = CheckpointWriter(keep_last=params.get('keep_checkpoints', 0),
+                                  pin_memory=params['use_cuda'])
+
+    eval_interval = params.get('eval_interval', 5)
+    stopper = EarlyStopping(patience=params.get('patience', 0),
+                            min_delta=params.get('min_delta', 0.0))
+    if params['restart_path'] is not None:
+        stopper_state = CycleGAN.read_checkpoint_extra(params['restart_path']).get('early_stopping')
+        if stopper_state is not None:
+            stopper.load_state_dict(stopper_state)
+
+    # Queued checkpoints and samples are written even if training is interrupted
+    try:
+        for epoch in range(params['restart_epoch']+1, params['num_epochs']):
+            losses_ = train_one_epoch(
+                epoch=epoch,
+                model=model,
+                train_A=train_A,
+                train_B=train_B,
+                device=params['device'],
+                n_samples=params['n_samples'],
+                plp_step=params['plp_step'],
+                profiler=profiler,
+                sync_interval=params.get('loss_sync_interval', 50),
+            )
+            timings = profiler.summary()
+
+            losses_test_ = evaluate(
+                epoch=epoch,
+                model=model,
+                test_A=test_A,
+                test_B=test_B,
+                device=params['device'],
+                n_samples=params['n_samples'],
+                plp_step=params['plp_step'],
+                amp=params['amp'],
+                profiler=StepProfiler(params['device'], enabled=False,
+                                      memory_interval=params.get('memory_interval', 50),
+                                      empty_cache_interval=params.get('empty_cache_interval', 0)),
+                sync_interval=params.get('loss_sync_interval', 50),
+            )
+
+            # Calculate FID and LPIPS metrics
+            fid, lpips = metrics
+
+            with torch.no_grad():
+                real_A, real_B = probe_A, probe_B
+                fake_A, fake_B = model.generate_samples(real_A, real_B)
+
+                # Calculate FID and LPIPS for A → B
+                fid_score_AtoB = fid.get_from_statistics(real_stats_B, fake_B)
+                lpips_score_AtoB = lpips.get(real_B, fake_B)
+
+                # Calculate FID and LPIPS for B → A
+                fid_score_BtoA = fid.get_from_statistics(real_stats_A, fake_A)
+                lpips_score_BtoA = lpips.get(real_A, fake_A)
+
+            print(f'Epoch {epoch:03d} - FID A→B: {fid_score_AtoB:0.4f}, LPIPS A→B: {lpips_score_AtoB.mean():0.4f}')
+            print(f'Epoch {epoch:03d} - FID B→A: {fid_score_BtoA:0.4f}, LPIPS B→A: {lpips_score_BtoA.mean():0.4f}')
+
+            # Full test set metrics every `eval_interval` epochs (and in the last one)
+            full_scores = {}
+            score = None
+            if eval_interval > 0 and (epoch % eval_interval == 0 or epoch == params['num_epochs'] - 1):
+                full_scores = full_test_metrics(model, metrics, eval_A, eval_B,
+                                                (real_stats_A, real_stats_B), params['device'])
+                print(f'Epoch {epoch:03d} - Full test set: ' + ', '.join(f'{k}: {v:0.4f}' for k, v in full_scores.items()))
+                score = (full_scores['FID_AtoB'] + full_scores['FID_BtoA']) / 2
+                if stopper.update(score, epoch):
+                    save_checkpoint(model, params, epoch, force=True, writer=writer,
+                                    file_name='cycle_gan_best.pth', rotate=False)
+
+            sample_A_path, sample_B_path = save_samples(model, params, probe_A, probe_B, epoch, renderer)
+
+            losses_list.append(losses_)
+            losses_list.append(losses_test_, test=True)
+            timings_list.append({'epoch': epoch} | timings)
+
+            save_losses(losses_list, filename=params['out_folder'] / 'losses.txt', timings=timings_list,
+                        first_epoch=params['restart_epoch'] + 1)
+            save_checkpoint(model, params, epoch, force=stopper.should_stop, writer=writer, score=score,
+                            extra={'early_stopping': stopper.state_dict()})
+
+            if params['run_wandb']:
+                renderer.wait()
+                wandb.log({f'Profile/{k}': v for k, v in timings.items()}, commit=False)
+                if full_scores:
+                    wandb.log({f'Full/{k}': v for k, v in full_scores.items()}, commit=False)
+                wandb.log({
+                    'G_loss/Total/train': losses_.loss_G,
+                    'G_loss/Adv/train': losses_.loss_G_ad,
+                    'G_loss/Cycle/train': losses_.loss_G_cycle,
+                    'G_loss/ID/train': losses_.loss_G_id,
+                    'G_loss/PLP/train': losses_.loss_G_plp,
+                    'D_loss/Disc_A/train': losses_.loss_D_A,
+                    'D_loss/Disc_B/train': losses_.loss_D_B,
+
+                    'G_loss/Total/test': losses_test_.loss_G,
+                    'G_loss/Adv/test': losses_test_.loss_G_ad,
+                    'G_loss/Cycle/test': losses_test_.loss_G_cycle,
+                    'G_loss/ID/test': losses_test_.loss_G_id,
+                    'G_loss/PLP/test': losses_test_.loss_G_plp,
+                    'D_loss/Disc_A/test': losses_test_.loss_D_A,
+                    'D_loss/Disc_B/test': losses_test_.loss_D_B,
+
+                    'FID_AtoB': fid_score_AtoB,
+                    'LPIPS_AtoB': lpips_score_AtoB.mean(),
+                    'FID_BtoA': fid_score_BtoA,
+                    'LPIPS_BtoA': lpips_score_BtoA.mean(),
+
+                    "Samples/Imgs_A": wandb.Image(str(sample_A_path)),
+                    "Samples/Imgs_B": wandb.Image(str(sample_B_path)),
+                })
+
+            if stopper.should_stop:
+                print(f'Early stopping at epoch {epoch:03d}: best full test FID {stopper.best_score:0.4f} '
+                      f'at epoch {stopper.best_epoch:03d}')
+                break
+
+        if epoch % params['checkpoint_interval'] != 0 and not stopper.should_stop:
+            save_checkpoint(model, params, epoch, force=True, writer=writer,
+                            extra={'early_stopping': stopper.state_dict()})
+    finally:
+        try:
+            if writer is not None:
+                writer.close()
+        finally:
+            renderer.close()
 
     return model
 
-def save_samples(model, params, test_A, test_B, epoch):
-    """Saves samples of the CycleGAN model."""
-    real_A = next(iter(test_A))
-    real_B = next(iter(test_B))
+def save_samples(model, params, real_A, real_B, epoch, renderer=None):
+    """Saves samples of the CycleGAN model.
 
+    Rows of the grids are real, fake, recovered and identity images.
+    If `renderer` (SampleRenderer) is given, files are written in the
+    background; otherwise they are written before returning.
+    """
     n_images = 4
-    if params['use_cuda']:
-        real_A = real_A.cuda()
-        real_B = real_B.cuda()
-
     imgs_A, imgs_B = model.generate_samples(real_A, real_B, n_images=n_images)
 
-    imgs_A.to('cpu')
-    imgs_B.to('cpu')
-
-    ImageTools.show_img(imgs_A, title=f'Epoch {epoch} - A Images',
-                    figsize = (20, 16), nrow=n_images,
-                    labels=['Real', 'Fake', 'Recovered', 'Identity'])
-    sample_A_path = params['out_folder'] / f'imgs_{epoch}_A.png'
-    plt.savefig(sample_A_path)
-    plt.close()
-
-    ImageTools.show_img(imgs_B, title=f'Epoch {epoch} - B Images',
-                    figsize = (20, 16), nrow=n_images,
-                    labels=['Real', 'Fake', 'Recovered', 'Identity'])
-    sample_B_path = params['out_folder'] / f'imgs_{epoch}_B.png'
-    plt.savefig(sample_B_path)
-    plt.close()
+    if renderer is None:
+        renderer = SampleRenderer(background=False)
+    sample_A_path = renderer.render(imgs_A, params['out_folder'] / f'imgs_{epoch}_A.png', nrow=n_images)
+    sample_B_path = renderer.render(imgs_B, params['out_folder'] / f'imgs_{epoch}_B.png', nrow=n_images)
 
     return sample_A_path,sample_B_path
 
-def save_checkpoint(model, params, epoch, force=False):
-    """Saves a checkpoint of the CycleGAN model."""
+def upload_to_wandb(path, base_path):
+    """Saves a file of the output folder to the wandb run."""
+    wandb.save(str(path), base_path=base_path)
+
+def save_checkpoint(model, params, epoch, force=False, writer=None, score=None, file_name=None,
+                    rotate=True, extra=None):
+    """Saves a checkpoint of the CycleGAN model.
+
+    If `writer` (CheckpointWriter) is given, the file is written and
+    uploaded to wandb in the background. The default file name is
+    'cycle_gan_epoch_{epoch}.pth'. With `train_lora_only`, only the
+    generator adapters are saved, and the full state of the epoch
+    (base weights, discriminators, optimizers), to restart training, is
+    kept locally in 'cycle_gan_last.pth'. Files with `rotate=False` are
+    not deleted by the writer `keep_last` retention. `extra` (training
+    loop state) is saved with full checkpoints.
+    """
     if (epoch % params['checkpoint_interval'] == 0) or force:
-        save_path = params['out_folder'] / f'cycle_gan_epoch_{epoch}.pth'
-        model.save_model(save_path, epoch)
+        save_path = params['out_folder'] / (file_name or f'cycle_gan_epoch_{epoch}.pth')
+        callback = None
         if params['run_wandb']:
-            wandb.save(str(save_path), base_path=params['out_folder'])
+            callback = functools.partial(upload_to_wandb, base_path=params['out_folder'])
+        if params.get('train_lora_only', False):
+            model.save_adapters(save_path, epoch, writer=writer, score=score, callback=callback,
+                                rotate=rotate)
+            if file_name is None:
+                model.save_model(params['out_folder'] / 'cycle_gan_last.pth', epoch, writer=writer,
+                                 rotate=False, extra=extra)
+        else:
+            model.save_model(save_path, epoch, writer=writer, score=score, callback=callback,
+                             rotate=rotate, extra=extra)
@@ -0,0 +1,52 @@
+"""Rendering of sample image grids outside of the training loop."""
+from concurrent.futures import ProcessPoolExecutor
+import torch
+
+from .data_transform import ImageTools
+
+
+class SampleRenderer():
+    """Save image grids as PNG files in a background process.
+
+    The grid is built with `make_grid` in the calling process (a cheap
+    tensor operation), and only the uint8 array is sent to the worker
+    process, which encodes and writes the PNG file.
+
+    Attributes
+    ----------
+    background : bool
+        If False, files are written in the calling process.
+        (Default: True)
+    """
+    def __init__(self, background=True):
+        self.background = background
+        self._executor = None
+        self._pending = []
+
+    def _get_executor(self):
+        if self._executor is None:
+            context = torch.multiprocessing.get_context('spawn')
+            self._executor = ProcessPoolExecutor(max_workers=1, mp_context=context)
+        return self._executor
+
+    def render(self, img, file_path, nrow=8):
+        """Save a grid of a batch of images to `file_path`. Returns the path."""
+        array = ImageTools.grid_to_array(img, nrow=nrow)
+        if not self.background:
+            ImageTools.save_png(array, file_path)
+            return file_path
+        self._pending.append(self._get_executor().submit(ImageTools.save_png, array, file_path))
+        return file_path
+
+    def wait(self):
+        """Block until all submitted files are written."""
+        pending, self._pending = self._pending, []
+        for future in pending:
+            future.result()
+
+    def close(self):
+        """Write pending files and stop the worker process."""
+        self.wait()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
@@ -0,0 +1,98 @@
+"""Persistent cache of pipeline stage outputs."""
+
+import re
+import hashlib
+import pickle
+from pathlib import Path
+
+
+class StageCache():
+    """Cache of the outputs of pipeline stages.
+
+    Each stage is identified by a name and a key, built from everything
+    the stage depends on (input files, parameters, keys of upstream
+    stages). The output is saved to disk with the key, and a stage is
+    stale (must run again) when its key changes, when it was never run,
+    or when one of its output files is missing.
+
+    Attributes
+    ----------
+    cache_dir : str
+        Folder to save the stage outputs.
+    verbose : bool
+        If True, print the stages that are run or loaded.
+        (Default: True)
+    """
+    def __init__(self, cache_dir, verbose=True):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.verbose = verbose
+        self._keys = {}
+
+    @staticmethod
+    def make_key(*parts):
+        """Key from the representation of `parts`."""
+        text = '|'.join(repr(p) for p in parts)
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def _file(self, name):
+        safe_name = re.sub(r'[^0-9A-Za-z_.-]+', '_', name)
+        return self.cache_dir / f'{safe_name}_{self.make_key(name)[:8]}.pkl'
+
+    def _load_key(self, name):
+        if name not in self._keys:
+            key_file = self._file(name).with_suffix('.key')
+            if not key_file.exists():
+                return None
+            self._keys[name] = key_file.read_text(encoding='utf-8').strip()
+        return self._keys[name]
+
+    def get_key(self, name):
+        """Key of the last run of a stage, or None if it was never run."""
+        return self._load_key(name)
+
+    def is_stale(self, name, key, outputs=None):
+        """Check if a stage must run again."""
+        if self._load_key(name) != key:
+            return True
+        return any(not Path(f).exists() for f in outputs or [])
+
+    def load(self, name):
+        """Load the output of a stage."""
+        with open(self._file(name), 'rb') as f:
+            return pickle.load(f)['value']
+
+    def save(self, name, key, value):
+        """Save the output of a stage."""
+        file = self._file(name)
+        tmp_file = file.with_name(f'{file.stem}.tmp')
+        with open(tmp_file, 'wb') as f:
+            pickle.dump({'name': name, 'key': key, 'value': value}, f)
+        tmp_file.replace(file)
+        file.with_suffix('.key').write_text(key, encoding='utf-8')
+        self._keys[name] = key
+
+    def run(self, name, key, func, outputs=None):
+        """Return the output of a stage, running `func()` only if it is stale.
+
+        Parameters
+        ----------
+        name : str
+            Stage name.
+        key : str
+            Key of the stage inputs (see `make_key`).
+        func : function
+            Function without arguments that computes the stage output.
+        outputs : [str]
+            Files written by the stage. If one is missing, the stage is stale.
+            (Default: None)
+        """
+        if not self.is_stale(name, key, outputs):
+            if self.verbose:
+                print(f'[cached] {name}')
+            return self.load(name)
+        if self.verbose:
+            print(f'[run] {name}')
+        value = func()
+        self.save(name, key, value)
+        return value
@@ -11,12 +11,23 @@ BASE = {
 
     'data_folder': Path(NEXET),
     'csv_type': '_filtered',
+    'use_shards': False,
     'out_folder': Path(OUT_FOLDER),
     'use_cuda': True,
 
     'print_memory': True,
+    'profile_steps': True,
+    'memory_interval': 50,
+    'empty_cache_interval': 0,
+    'loss_sync_interval': 50,
     "num_epochs": 50,
     "checkpoint_interval": 2,
+    'async_checkpoint': True,
+    'keep_checkpoints': 0,
+    'background_samples': True,
+    'eval_interval': 5,
+    'patience': 0,
+    'min_delta': 0.0,
     "n_samples": None,
 
     'batch_size': 16,
@@ -26,12 +37,16 @@ BASE = {
     'channels': 3,
     'n_features': 32,
     'n_residual_blocks': 5,
+    'checkpoint_residual': False,
     'n_downsampling': 2,
     'norm_type': 'instance',
     'add_skip': False,
     'add_attention': None,
+    'attention_chunk_size': None,
     'add_lora': False,
     'lora_rank': 4,
+    'train_lora_only': False,
+    'lora_base_path': None,
 
     'use_replay_buffer': True,
     'replay_buffer_size': 50,
@@ -49,7 +64,11 @@ BASE = {
 
     'step_size': 1000,
     'gamma': 0.5,
-    'amp': True
+    'amp': True,
+    'fused_forward': False,
+    'compile_step': False,
+    'compile_mode': 'default',
+    'fused_optimizer': False,
 }
 
 # Test Cases
@@ -6,7 +6,10 @@ import json
 from pathlib import Path
 import pandas as pd
 import torch
-import pynvml
+
+from .lazy import lazy_import
+
+pynvml = lazy_import('pynvml')
 
 class Constants:
     """Project constants"""
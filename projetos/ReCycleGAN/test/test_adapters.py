@@ -0,0 +1,116 @@
+# pylint: disable=import-error,wrong-import-position,invalid-name
+"""Test LoRA adapters and adapter-only checkpoints."""
+
+import unittest
+import sys
+import tempfile
+from pathlib import Path
+import torch
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from src.models.cyclegan import CycleGAN
+from src.models.networks import Generator
+from src.models.adapters import AdapterSwitcher, is_adapter_key, load_base_weights
+
+MODEL_PARAMS = {'n_features': 8, 'n_residual_blocks': 1, 'add_lora': True, 'lora_rank': 2,
+                'plp_loss_weight': 0, 'plp_step': 16}
+
+
+def perturb_adapters(model, seed):
+    """Random (non-zero) adapters, as after fine-tuning."""
+    torch.manual_seed(seed)
+    with torch.no_grad():
+        for gen in [model.gen_AtoB, model.gen_BtoA]:
+            for name, param in gen.named_parameters():
+                if is_adapter_key(name):
+                    param.normal_(std=0.1)
+
+
+class TestAdapters(unittest.TestCase):
+    """Test adapter-only checkpoints and the adapter switcher."""
+    def setUp(self):
+        torch.manual_seed(0)
+        self.model = CycleGAN(**MODEL_PARAMS)
+        self.folder = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.base_path = Path(self.folder.name) / 'base.pth'
+        self.model.save_model(self.base_path)
+        self.x = torch.rand(2, 3, 32, 32) * 2 - 1
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_new_adapters(self):
+        """New adapters keep the output and the state dict keys of the base generator."""
+        base = Generator(3, 3, n_residual_blocks=1, n_features=8)
+        lora = Generator(3, 3, n_residual_blocks=1, n_features=8, add_lora=True, lora_rank=2)
+        lora_keys = {k for k in lora.state_dict() if not is_adapter_key(k)}
+        self.assertEqual(lora_keys, set(base.state_dict()))
+        load_base_weights(lora, base.state_dict())
+        with torch.no_grad():
+            torch.testing.assert_close(lora(self.x), base(self.x))
+
+    def test_train_lora_only(self):
+        """Only the adapters are updated by the optimizer."""
+        model = CycleGAN(train_lora_only=True, **MODEL_PARAMS)
+        base = {k: v.clone() for k, v in model.gen_AtoB.state_dict().items()}
+        model.optimize(self.x, self.x)
+        for key, value in model.gen_AtoB.state_dict().items():
+            if is_adapter_key(key) and key.endswith('lora_B'):
+                self.assertFalse(torch.equal(value, base[key]), key)
+            elif not is_adapter_key(key):
+                self.assertTrue(torch.equal(value, base[key]), key)
+
+    def test_train_lora_only_batch_norm(self):
+        """Batch norm statistics stay frozen, so the adapters load on the original base."""
+        model = CycleGAN(train_lora_only=True, norm_type='batch', **MODEL_PARAMS)
+        path = Path(self.folder.name) / 'batch_base.pth'
+        model.save_model(path)
+        model.optimize(self.x, self.x)
+        model.save_adapters(Path(self.folder.name) / 'batch_adapters.pth')
+
+        base = CycleGAN(norm_type='batch', **MODEL_PARAMS)
+        base.load_base(path)
+        base.load_adapters(Path(self.folder.name) / 'batch_adapters.pth')
+        with self.assertRaises(ValueError):
+            base.load_model(Path(self.folder.name) / 'batch_adapters.pth')
+
+    def test_save_load(self):
+        """Adapter files are small, load on the same base and are rejected on another."""
+        perturb_adapters(self.model, 1)
+        path = Path(self.folder.name) / 'adapters.pth'
+        self.model.save_adapters(path, epoch=3)
+        self.assertLess(path.stat().st_size, self.base_path.stat().st_size / 5)
+        with torch.no_grad():
+            expected = self.model.gen_AtoB(self.x)
+
+        model = CycleGAN(**MODEL_PARAMS)
+        with self.assertRaises(ValueError):
+            model.load_adapters(path)
+        model.load_base(self.base_path)
+        self.assertEqual(model.load_adapters(path), 3)
+        with torch.no_grad():
+            torch.testing.assert_close(model.gen_AtoB(self.x), expected)
+
+    def test_switcher(self):
+        """Switching adapters gives the outputs of each adapter, and of the base weights."""
+        with torch.no_grad():
+            outputs = {None: self.model.gen_BtoA(self.x)}
+        for seed in [1, 2]:
+            perturb_adapters(self.model, seed)
+            self.model.save_adapters(Path(self.folder.name) / f'{seed}.pth')
+            with torch.no_grad():
+                outputs[seed] = self.model.gen_BtoA(self.x)
+
+        model = CycleGAN(**MODEL_PARAMS)
+        model.load_base(self.base_path)
+        switcher = AdapterSwitcher({'gen_AtoB': model.gen_AtoB, 'gen_BtoA': model.gen_BtoA})
+        for seed in [1, 2]:
+            switcher.add(seed, Path(self.folder.name) / f'{seed}.pth')
+        for seed in [2, None, 1]:
+            with torch.no_grad():
+                output = switcher.use(seed)['gen_BtoA'](self.x)
+            torch.testing.assert_close(output, outputs[seed])
+
+
+if __name__ == '__main__':
+    unittest.main()
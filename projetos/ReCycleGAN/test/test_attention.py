@@ -0,0 +1,71 @@
+# pylint: disable=import-error,wrong-import-position
+"""Test the SelfAttention block."""
+
+import unittest
+import sys
+from pathlib import Path
+import torch
+import torch.nn.functional as F
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from src.models.networks import SelfAttention
+from src.models.cyclegan import CycleGAN
+
+
+def bmm_attention(module, x):
+    """SelfAttention with the explicit attention matrix."""
+    batch_size, channels, height, width = x.size()
+    x_pooled = module.pool(x)
+    pooled_height, pooled_width = x_pooled.shape[2:]
+    proj_query = module.query_conv(x_pooled).view(batch_size, -1, pooled_height * pooled_width)
+    proj_key = module.key_conv(x_pooled).view(batch_size, -1, pooled_height * pooled_width)
+    proj_value = module.value_conv(x_pooled).view(batch_size, -1, pooled_height * pooled_width)
+    attention = torch.softmax(torch.bmm(proj_query.permute(0, 2, 1), proj_key), dim=-1)
+    out = torch.bmm(proj_value, attention.permute(0, 2, 1))
+    out = out.view(batch_size, channels, pooled_height, pooled_width)
+    out = F.interpolate(out, size=(height, width), mode='bilinear', align_corners=False)
+    return module.gamma * out + x
+
+
+class TestSelfAttention(unittest.TestCase):
+    """Test that SDPA keeps the output of the bmm implementation."""
+    def setUp(self):
+        torch.manual_seed(0)
+        self.module = SelfAttention(32)
+        with torch.no_grad():
+            self.module.gamma.fill_(1.0)
+        self.x = torch.randn(2, 32, 64, 48)
+
+    def test_equivalence(self):
+        """Full and chunked SDPA paths match the explicit attention."""
+        with torch.no_grad():
+            expected = bmm_attention(self.module, self.x)
+            for chunk_size in [None, 7, 1000]:
+                self.module.chunk_size = chunk_size
+                torch.testing.assert_close(self.module(self.x), expected, atol=1e-5, rtol=1e-5)
+
+    def test_gradients(self):
+        """Gradients of the parameters match the explicit attention."""
+        expected = torch.autograd.grad(bmm_attention(self.module, self.x).square().sum(),
+                                       list(self.module.parameters()))
+        self.module.chunk_size = 50
+        grads = torch.autograd.grad(self.module(self.x).square().sum(),
+                                    list(self.module.parameters()))
+        for grad, grad_expected in zip(grads, expected):
+            torch.testing.assert_close(grad, grad_expected, atol=1e-3, rtol=1e-4)
+
+
+    def test_cyclegan_chunk_size(self):
+        """The chunk size reaches the attention layers of generators and discriminators."""
+        model = CycleGAN(n_features=8, n_residual_blocks=1, add_attention='both',
+                         attention_chunk_size=5, plp_loss_weight=0, plp_step=16)
+        layers = [m for net in [model.gen_AtoB, model.gen_BtoA, model.dis_A, model.dis_B]
+                  for m in net.modules() if isinstance(m, SelfAttention)]
+        self.assertEqual(len(layers), 2 * 2 + 2)
+        self.assertTrue(all(m.chunk_size == 5 for m in layers))
+        x = torch.rand(1, 3, 64, 64) * 2 - 1
+        model.optimize(x, x)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+# pylint: disable=import-error,wrong-import-position
+"""Test the background checkpoint writer."""
+
+import unittest
+import sys
+import tempfile
+from pathlib import Path
+import torch
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from src.utils.checkpoint import CheckpointWriter
+
+
+class TestCheckpointWriter(unittest.TestCase):
+    """Test snapshot, atomic write and retention."""
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.folder = Path(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_snapshot(self):
+        """The saved state is the one at submit time."""
+        writer = CheckpointWriter()
+        weights = torch.zeros(4)
+        writer.submit({'w': weights, 'epoch': 1}, self.folder / 'a.pth')
+        weights += 1
+        writer.close()
+        state = torch.load(self.folder / 'a.pth', weights_only=True)
+        self.assertEqual(state['epoch'], 1)
+        self.assertTrue(torch.equal(state['w'], torch.zeros(4)))
+        self.assertEqual([p.name for p in self.folder.iterdir()], ['a.pth'])
+
+    def test_retention(self):
+        """Only the last checkpoints and the best are kept."""
+        writer = CheckpointWriter(keep_last=2)
+        scores = [5.0, 1.0, 3.0, 4.0, 2.0]
+        for i, score in enumerate(scores):
+            writer.submit({'epoch': i}, self.folder / f'{i}.pth', score=score)
+        writer.wait()
+        self.assertEqual(writer.best, self.folder / '1.pth')
+        writer.close()
+        self.assertEqual(sorted(p.name for p in self.folder.iterdir()),
+                         ['1.pth', '3.pth', '4.pth'])
+
+    def test_no_rotate(self):
+        """Files submitted with rotate=False are neither counted nor deleted."""
+        writer = CheckpointWriter(keep_last=1)
+        for i in range(3):
+            writer.submit({'epoch': i}, self.folder / f'{i}.pth')
+            writer.submit({'epoch': i}, self.folder / 'best.pth', rotate=False)
+        writer.close()
+        self.assertEqual(sorted(p.name for p in self.folder.iterdir()), ['2.pth', 'best.pth'])
+
+    def test_callback_before_delete(self):
+        """Older files are only deleted after the callback of the new file has run."""
+        writer = CheckpointWriter(keep_last=1)
+        seen = []
+        def callback(path):
+            seen.append(sorted(p.name for p in self.folder.glob('*.pth')))
+        for i in range(3):
+            writer.submit({'epoch': i}, self.folder / f'{i}.pth', callback=callback)
+        writer.close()
+        self.assertEqual(seen, [['0.pth'], ['0.pth', '1.pth'], ['1.pth', '2.pth']])
+        self.assertEqual([p.name for p in self.folder.iterdir()], ['2.pth'])
+
+    def test_error(self):
+        """Errors of the worker thread are raised on wait."""
+        writer = CheckpointWriter()
+        writer.submit({'epoch': 0}, self.folder / 'missing' / 'a.pth')
+        with self.assertRaises(RuntimeError):
+            writer.wait()
+        writer.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+# pylint: disable=import-error,wrong-import-position
+"""Test activation checkpointing of the generator residual blocks."""
+
+import unittest
+import sys
+from pathlib import Path
+import torch
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from src.models.networks import Generator, get_norm_layer
+from src.models.cyclegan import CycleGAN
+
+
+class TestCheckpointResidual(unittest.TestCase):
+    """Checkpointed residual blocks must match the default forward and backward."""
+    def setUp(self):
+        torch.manual_seed(0)
+        self.generator = Generator(3, 3, n_residual_blocks=3, n_features=8)
+        self.x = torch.rand(2, 3, 32, 32) * 2 - 1
+
+    def _output_and_grads(self, checkpoint_residual):
+        self.generator.checkpoint_residual = checkpoint_residual
+        self.generator.zero_grad()
+        output = self.generator(self.x)
+        output.square().mean().backward()
+        grads = [p.grad.clone() for p in self.generator.parameters()]
+        return output.detach(), grads
+
+    def test_parity(self):
+        """Outputs and parameter gradients match the non-checkpointed path."""
+        expected_output, expected_grads = self._output_and_grads(False)
+        output, grads = self._output_and_grads(True)
+        torch.testing.assert_close(output, expected_output)
+        for grad, expected in zip(grads, expected_grads):
+            torch.testing.assert_close(grad, expected)
+
+    def test_batch_norm(self):
+        """Batch normalization is rejected (running statistics would be updated twice)."""
+        with self.assertRaises(ValueError):
+            Generator(3, 3, n_residual_blocks=1, n_features=8,
+                      norm_layer=get_norm_layer('batch'), checkpoint_residual=True)
+        with self.assertRaises(ValueError):
+            CycleGAN(n_features=8, n_residual_blocks=1, norm_type='batch', checkpoint_residual=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
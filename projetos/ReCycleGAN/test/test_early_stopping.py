@@ -0,0 +1,62 @@
+# pylint: disable=import-error,wrong-import-position
+"""Test the early stopping policy."""
+
+import unittest
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from src.utils.early_stopping import EarlyStopping
+
+
+class TestEarlyStopping(unittest.TestCase):
+    """Test improvements, patience, min_delta and the saved state."""
+    def test_patience(self):
+        """Stops after `patience` evaluations without improvement."""
+        stopper = EarlyStopping(patience=2)
+        self.assertTrue(stopper.update(10.0, 0))
+        self.assertTrue(stopper.update(8.0, 5))
+        self.assertFalse(stopper.update(9.0, 10))
+        self.assertFalse(stopper.should_stop)
+        self.assertFalse(stopper.update(8.0, 15))
+        self.assertTrue(stopper.should_stop)
+        self.assertEqual((stopper.best_score, stopper.best_epoch), (8.0, 5))
+
+    def test_improvement_resets(self):
+        """An improvement resets the count of bad evaluations."""
+        stopper = EarlyStopping(patience=2)
+        for score in [10.0, 11.0, 9.0, 12.0]:
+            stopper.update(score)
+        self.assertFalse(stopper.should_stop)
+        self.assertEqual(stopper.n_bad, 1)
+
+    def test_min_delta(self):
+        """Decreases smaller than `min_delta` are not improvements."""
+        stopper = EarlyStopping(patience=1, min_delta=0.5)
+        stopper.update(10.0)
+        self.assertFalse(stopper.update(9.7))
+        self.assertTrue(stopper.should_stop)
+        self.assertEqual(stopper.best_score, 10.0)
+
+    def test_no_patience(self):
+        """With zero patience, training never stops."""
+        stopper = EarlyStopping(patience=0)
+        stopper.update(1.0)
+        for _ in range(10):
+            stopper.update(2.0)
+        self.assertFalse(stopper.should_stop)
+
+    def test_state_dict(self):
+        """A restored policy continues from the saved state."""
+        stopper = EarlyStopping(patience=2)
+        stopper.update(5.0, 0)
+        stopper.update(6.0, 5)
+        restored = EarlyStopping(patience=2)
+        restored.load_state_dict(stopper.state_dict())
+        self.assertEqual(restored.state_dict(), stopper.state_dict())
+        restored.update(7.0, 10)
+        self.assertTrue(restored.should_stop)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+# pylint: disable=import-error,wrong-import-position
+"""Test FID statistics and cache of activations."""
+
+import os
+import unittest
+import sys
+import tempfile
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import torch
+from torchvision import transforms
+from PIL import Image
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from src.utils.data_loader import get_img_dataloader
+from src.metrics.activation_cache import ActivationCache
+from src.metrics.running_stats import RunningStatistics
+from src.metrics.sharded import run_sharded, split_indices
+
+
+def pixel_statistics_worker(loader, device):
+    """Statistics of flattened pixels, in place of the InceptionV3 activations."""
+    statistics = RunningStatistics(12)
+    for batch in loader:
+        statistics.update(batch.to(device).flatten(start_dim=1).double().numpy())
+    return statistics
+
+
+class TestRunningStatistics(unittest.TestCase):
+    """Test streaming mean and covariance."""
+    def test_same_as_numpy(self):
+        """Batched statistics match numpy.mean and numpy.cov."""
+        rng = np.random.default_rng(1)
+        act = rng.gamma(2.0, 0.3, (500, 64)) + 100.0
+        statistics = RunningStatistics(64)
+        for start in range(0, len(act), 37):
+            statistics.update(act[start:start + 37])
+        mu, sigma = statistics.get()
+        np.testing.assert_allclose(mu, np.mean(act, axis=0), rtol=1e-12)
+        np.testing.assert_allclose(sigma, np.cov(act, rowvar=False), atol=1e-10)
+
+    def test_merge(self):
+        """Merged partial statistics match the statistics of all values."""
+        rng = np.random.default_rng(2)
+        act = rng.normal(size=(300, 16))
+        parts = [RunningStatistics(16) for _ in range(3)]
+        for part, values in zip(parts, np.array_split(act, [50, 220])):
+            part.update(values)
+        total = RunningStatistics(16)
+        for part in parts:
+            total.merge(part)
+        mu, sigma = total.get()
+        np.testing.assert_allclose(mu, np.mean(act, axis=0), atol=1e-12)
+        np.testing.assert_allclose(sigma, np.cov(act, rowvar=False), atol=1e-12)
+
+
+class TestSharded(unittest.TestCase):
+    """Test evaluation split across CPU processes."""
+    def test_split_indices(self):
+        """Shards are contiguous, non-empty and cover all indices."""
+        shards = split_indices(10, 4)
+        self.assertEqual([len(s) for s in shards], [3, 3, 2, 2])
+        np.testing.assert_array_equal(np.concatenate(shards), np.arange(10))
+        self.assertEqual(len(split_indices(2, 4)), 2)
+
+    def test_merged_statistics(self):
+        """Statistics merged from 2 processes match numpy."""
+        dataset = torch.rand(23, 3, 2, 2, generator=torch.Generator().manual_seed(0))
+        parts = run_sharded(pixel_statistics_worker, dataset, n_workers=2,
+                            batch_size=5, cuda=False)
+        self.assertEqual(len(parts), 2)
+        total = RunningStatistics(12)
+        for part in parts:
+            total.merge(part)
+        mu, sigma = total.get()
+        act = dataset.flatten(start_dim=1).double().numpy()
+        np.testing.assert_allclose(mu, np.mean(act, axis=0), atol=1e-12)
+        np.testing.assert_allclose(sigma, np.cov(act, rowvar=False), atol=1e-12)
+
+
+class TestActivationCache(unittest.TestCase):
+    """Test that only new images reach the network."""
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.folder = Path(self.tmp.name)
+        self.img_dir = self.folder / 'input_A'
+        self.img_dir.mkdir()
+
+        rng = np.random.default_rng(0)
+        self.names = []
+        for i in range(12):
+            array = rng.integers(0, 256, (8, 8, 3), dtype=np.uint8)
+            name = f'img_{i}.png'
+            Image.fromarray(array).save(self.img_dir / name)
+            self.names.append(name)
+        self.csv = self.folder / 'input_A_test.csv'
+        pd.DataFrame({'file_name': self.names}).to_csv(self.csv, index=False)
+
+        self.n_evaluated = 0
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _get_activations(self, imgs):
+        act = []
+        for batch in imgs:
+            self.n_evaluated += len(batch)
+            act.append(batch.flatten(start_dim=1)[:, :16].numpy())
+        return np.concatenate(act)
+
+    def _loader(self, transformation=None):
+        return get_img_dataloader(self.csv, img_dir=self.img_dir, batch_size=5,
+                                  transformation=transformation, num_workers=0)
+
+    def test_statistics(self):
+        """Cached statistics match the direct calculation."""
+        cache = ActivationCache(self.folder / 'cache')
+        mu, sigma = cache.get_statistics(self._loader(), 16, self._get_activations)
+        self.assertEqual(self.n_evaluated, 12)
+
+        act = self._get_activations(torch.utils.data.DataLoader(self._loader().dataset))
+        np.testing.assert_allclose(mu, act.mean(axis=0), atol=1e-6)
+        np.testing.assert_allclose(sigma, np.cov(act, rowvar=False), atol=1e-6)
+
+    def test_reuse(self):
+        """Only new or modified images are evaluated again."""
+        self.n_evaluated = 0
+        cache = ActivationCache(self.folder / 'cache')
+        cache.get_statistics(self._loader(), 16, self._get_activations)
+        self.assertEqual(self.n_evaluated, 12)
+
+        self.n_evaluated = 0
+        cache = ActivationCache(self.folder / 'cache')
+        cache.get_statistics(self._loader(), 16, self._get_activations)
+        self.assertEqual(self.n_evaluated, 0)
+
+        img_path = self.img_dir / self.names[3]
+        stat = img_path.stat()
+        os.utime(img_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        cache.get_statistics(self._loader(), 16, self._get_activations)
+        self.assertEqual(self.n_evaluated, 1)
+
+    def test_random_transformation(self):
+        """Random transformations are not cached."""
+        cache = ActivationCache(self.folder / 'cache')
+        transformation = transforms.Compose([
+            transforms.RandomHorizontalFlip(),
+            transforms.ToTensor(),
+        ])
+        stats = cache.get_statistics(self._loader(transformation), 16, self._get_activations)
+        self.assertIsNone(stats)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+# pylint: disable=import-error,wrong-import-position
+"""Test loss bookkeeping."""
+
+import unittest
+import sys
+from pathlib import Path
+import torch
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from src.models.losses import Loss, LossValues, LossLists, LOSS_NAMES
+
+
+def reference_values(losses, n_a, n_b, plp_step):
+    """Averages as calculated with one `.item()` per loss and step."""
+    sums = {name: 0 for name in LOSS_NAMES}
+    for loss in losses:
+        for name in LOSS_NAMES:
+            sums[name] += getattr(loss, name).item()
+    n = (n_a + n_b) / 2
+    return {
+        'loss_G': sums['loss_G'] / n,
+        'loss_D_A': sums['loss_D_A'] / n_a,
+        'loss_D_B': sums['loss_D_B'] / n_b,
+        'loss_G_ad': sums['loss_G_ad'] / n,
+        'loss_G_cycle': sums['loss_G_cycle'] / n,
+        'loss_G_id': sums['loss_G_id'] / n,
+        'loss_G_plp': sums['loss_G_plp'] / (n * plp_step),
+    }
+
+
+class TestLossValues(unittest.TestCase):
+    """Test that device-side sums keep the logged averages."""
+    def setUp(self):
+        generator = torch.Generator().manual_seed(0)
+        self.losses = []
+        for _ in range(37):
+            values = torch.rand(len(LOSS_NAMES), generator=generator) * 10
+            self.losses.append(Loss(**{name: v.float() for name, v in zip(LOSS_NAMES, values)}))
+
+    def test_parity(self):
+        """Averages match the per-step `.item()` implementation."""
+        expected = reference_values(self.losses, 37, 35, 16)
+        for sync_interval in [0, 1, 5, 50]:
+            values = LossValues(37, 35, 16, sync_interval=sync_interval)
+            for loss in self.losses:
+                values.add(loss)
+            values.normalize()
+            for name in LOSS_NAMES:
+                self.assertAlmostEqual(getattr(values, name), expected[name], places=10)
+                self.assertIsInstance(getattr(values, name), float)
+
+    def test_lists(self):
+        """LossLists receives floats."""
+        values = LossValues(37, 35, 16, sync_interval=10)
+        for loss in self.losses:
+            values.add(loss)
+        values.normalize()
+        lists = LossLists()
+        lists.append(values)
+        lists.append(values, test=True)
+        df = lists.to_dataframe()
+        self.assertEqual(len(df), 1)
+        self.assertAlmostEqual(df['G_loss'][0], values.loss_G)
+
+
+if __name__ == '__main__':
+    unittest.main()
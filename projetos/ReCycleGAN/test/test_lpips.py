@@ -0,0 +1,86 @@
+# pylint: disable=import-error,wrong-import-position
+"""Test LPIPS embeddings."""
+
+import unittest
+import sys
+from pathlib import Path
+import torch
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from src.metrics.lpips import LPIPS
+from src.metrics.sharded import PairDataset, sharded_lpips
+
+
+class TestLPIPSEmbeddings(unittest.TestCase):
+    """Distances between embeddings must match the LPIPS network."""
+    @classmethod
+    def setUpClass(cls):
+        # Random backbone weights: avoids downloading AlexNet.
+        cls.lpips = LPIPS(batch_size=4, pnet_rand=True)
+
+        torch.manual_seed(0)
+        cls.imgs1 = torch.rand(5, 3, 64, 64)
+        cls.imgs2 = torch.rand(3, 3, 64, 64)
+
+    def _reference(self, imgs1, imgs2):
+        values = torch.empty(len(imgs1), len(imgs2))
+        with torch.no_grad():
+            for i, img1 in enumerate(imgs1):
+                for j, img2 in enumerate(imgs2):
+                    values[i, j] = self.lpips.model.forward(
+                        img1.unsqueeze(0), img2.unsqueeze(0), normalize=True).flatten()[0]
+        return values
+
+    def test_get_all_pairs(self):
+        """All-pairs matrix matches the pairwise network calls."""
+        values = self.lpips.get_all_pairs(self.imgs1, self.imgs2)
+        self.assertEqual(values.shape, (5, 3))
+        torch.testing.assert_close(values, self._reference(self.imgs1, self.imgs2),
+                                   atol=1e-5, rtol=1e-4)
+
+    def test_sampled_pairs(self):
+        """Sampled pairs of `get(..., all_pairs=True)` are valid LPIPS values."""
+        values = self.lpips.get(self.imgs1, self.imgs2, all_pairs=True)
+        self.assertEqual(values.shape, (15, 1, 1, 1))
+        reference = self._reference(self.imgs1, self.imgs2).flatten()
+        torch.testing.assert_close(values.flatten().sort().values, reference.sort().values,
+                                   atol=1e-5, rtol=1e-4)
+
+    def test_chunked_distances(self):
+        """Chunked distances from CPU embeddings match the full matrix."""
+        emb1 = self.lpips.embed(self.imgs1, device='cpu')
+        emb2 = self.lpips.embed(self.imgs2)
+        torch.testing.assert_close(LPIPS.distances(emb1, emb2, chunk_size=2),
+                                   LPIPS.distances(emb1, emb2))
+
+    def test_same_image(self):
+        """Distance of an image to itself is zero."""
+        values = self.lpips.get_all_pairs(self.imgs1[:2], self.imgs1[:2])
+        self.assertLess(float(values.diagonal().abs().max()), 1e-5)
+
+
+
+class TestShardedLPIPS(unittest.TestCase):
+    """Test LPIPS split across CPU processes."""
+    def test_random_pairs(self):
+        """Pairs are a seeded random permutation, truncated to the shortest dataset."""
+        dataset1 = torch.arange(10)
+        dataset2 = torch.arange(100, 107)
+        pairs = PairDataset(dataset1, dataset2, seed=3)
+        self.assertEqual(len(pairs), 7)
+        second = [int(pairs[i][1]) for i in range(len(pairs))]
+        self.assertEqual(len(set(second)), 7)
+        self.assertNotEqual(second, list(range(100, 107)))
+        self.assertEqual(second, [int(PairDataset(dataset1, dataset2, seed=3)[i][1]) for i in range(7)])
+
+    def test_real_real(self):
+        """LPIPS of a dataset with itself compares different images."""
+        dataset = torch.rand(12, 3, 64, 64, generator=torch.Generator().manual_seed(0)) * 2 - 1
+        values = sharded_lpips(dataset, dataset, n_workers=2, batch_size=4, cuda=False,
+                               pnet_rand=True)
+        self.assertEqual(values.shape, (12, 1, 1, 1))
+        self.assertGreater(int((values.flatten() > 1e-4).sum()), 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
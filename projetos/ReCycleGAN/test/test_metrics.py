@@ -8,11 +8,11 @@ from pathlib import Path
 import torch
 from tqdm import tqdm
 
-sys.path.append(str(Path(__file__).resolve().parent.parent / 'src'))
-from metrics.fid import FID
-from metrics.lpips import LPIPS
-from utils.data_loader import get_img_dataloader, copy_dataloader
-from utils.utils import get_gpu_memory_usage
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from src.metrics.fid import FID
+from src.metrics.lpips import LPIPS
+from src.utils.data_loader import get_img_dataloader, copy_dataloader
+from src.utils.utils import get_gpu_memory_usage
 
 class TestMetrics(unittest.TestCase):
     """Test metrics module."""
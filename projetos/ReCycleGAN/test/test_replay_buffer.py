@@ -0,0 +1,72 @@
+# pylint: disable=import-error,wrong-import-position
+"""Test the discriminator ReplayBuffer."""
+
+import unittest
+import sys
+from pathlib import Path
+import torch
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from src.models.networks import ReplayBuffer
+
+
+def images(start, n):
+    """Batch of n images, each filled with its own id."""
+    return torch.arange(start, start + n, dtype=torch.float32).view(-1, 1, 1, 1).expand(-1, 3, 2, 2).clone()
+
+
+def ids(batch):
+    """Image ids of a batch built by `images`."""
+    return set(batch[:, 0, 0, 0].long().tolist())
+
+
+class TestReplayBuffer(unittest.TestCase):
+    """Test the tensor-backed replay buffer."""
+    def setUp(self):
+        torch.manual_seed(0)
+        self.buffer = ReplayBuffer(max_size=10)
+
+    def test_fill(self):
+        """Images are returned unchanged and stored while the buffer is not full."""
+        batch = images(0, 4)
+        torch.testing.assert_close(self.buffer.push_and_pop(batch), batch)
+        self.assertEqual(self.buffer.size, 4)
+        self.assertEqual(ids(self.buffer.data[:4]), {0, 1, 2, 3})
+
+    def test_partial_fill(self):
+        """A batch larger than the free space fills it, and the rest is replayed."""
+        self.buffer.push_and_pop(images(0, 8))
+        out = self.buffer.push_and_pop(images(8, 4))
+        self.assertEqual(self.buffer.size, 10)
+        torch.testing.assert_close(out[:2], images(8, 2))
+        self.assertEqual(out.shape, (4, 3, 2, 2))
+
+    def test_replay(self):
+        """Outputs are new or previously seen images, and about half are swapped."""
+        self.buffer.push_and_pop(images(0, 10))
+        n_swapped, n_total = 0, 0
+        for step in range(1, 101):
+            batch = images(100 * step, 4)
+            out = self.buffer.push_and_pop(batch)
+            self.assertEqual(out.shape, batch.shape)
+            # Each output is a whole image (no mixed pixels)
+            self.assertTrue(bool((out == out[:, :1, :1, :1]).all()))
+            swapped = (out != batch).any(dim=(1, 2, 3))
+            # Swapped images come from previous batches
+            self.assertTrue(all(i < 100 * step for i in ids(out[swapped])))
+            n_swapped += int(swapped.sum())
+            n_total += len(batch)
+            self.assertEqual(self.buffer.size, 10)
+        self.assertGreater(n_swapped / n_total, 0.4)
+        self.assertLess(n_swapped / n_total, 0.6)
+        # Stored images were all seen (scratch row excluded)
+        self.assertTrue(ids(self.buffer.data[:10]) <= set(range(100 * 100 + 4)))
+
+    def test_detached(self):
+        """Returned images do not carry gradients."""
+        batch = images(0, 12).requires_grad_()
+        self.assertFalse(self.buffer.push_and_pop(batch).requires_grad)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+# pylint: disable=import-error,wrong-import-position
+"""Test memory-mapped image shards."""
+
+import os
+import unittest
+import sys
+import tempfile
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import torch
+from torchvision import transforms
+from PIL import Image
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from src.utils.data_loader import get_img_dataloader, copy_dataloader, pack_image_shards
+from src.utils.data_loader import ImageDataset, ShardedImageDataset, read_shard_index
+
+
+class TestShards(unittest.TestCase):
+    """Test packing and reading image shards."""
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.folder = Path(self.tmp.name)
+        self.img_dir = self.folder / 'input_A'
+        self.img_dir.mkdir()
+
+        rng = np.random.default_rng(42)
+        names = []
+        for i in range(10):
+            height, width = (32, 48) if i % 2 else (40, 40)
+            array = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+            name = f'img_{i}.png'
+            Image.fromarray(array).save(self.img_dir / name)
+            names.append(name)
+
+        self.train_csv = self.folder / 'input_A_train.csv'
+        self.test_csv = self.folder / 'input_A_test.csv'
+        pd.DataFrame({'file_name': names[:7]}).to_csv(self.train_csv, index=False)
+        pd.DataFrame({'file_name': names[7:]}).to_csv(self.test_csv, index=False)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_same_images(self):
+        """Sharded images must match the decoded image files."""
+        shard_dir = pack_image_shards([self.train_csv, self.test_csv], self.img_dir,
+                                      shard_size=10_000)
+        self.assertGreater(read_shard_index(shard_dir)['shard'].nunique(), 1)
+
+        plain = ImageDataset(self.train_csv, self.img_dir)
+        sharded = ShardedImageDataset(self.train_csv, shard_dir)
+        self.assertEqual(len(plain), len(sharded))
+        for i in range(len(plain)):
+            self.assertTrue(torch.equal(plain[i], sharded[i]))
+
+        transformation = transforms.Compose([
+            transforms.Resize(16),
+            transforms.CenterCrop(16),
+            transforms.ToTensor(),
+        ])
+        plain.transformation = transformation
+        sharded.transformation = transformation
+        self.assertTrue(torch.equal(plain[0], sharded[0]))
+
+    def test_incremental_pack(self):
+        """Packing again only appends the new images."""
+        shard_dir = pack_image_shards(self.train_csv, self.img_dir)
+        self.assertEqual(len(read_shard_index(shard_dir)), 7)
+        pack_image_shards([self.train_csv, self.test_csv], self.img_dir)
+        self.assertEqual(len(read_shard_index(shard_dir)), 10)
+
+    def test_changed_image(self):
+        """Images written again are packed again, with new cache keys."""
+        shard_dir = pack_image_shards([self.train_csv, self.test_csv], self.img_dir)
+        old_keys = ShardedImageDataset(self.train_csv, shard_dir).get_image_keys()
+
+        img_path = self.img_dir / 'img_0.png'
+        array = np.random.default_rng(7).integers(0, 256, (40, 40, 3), dtype=np.uint8)
+        Image.fromarray(array).save(img_path)
+        stat = img_path.stat()  # Same size is possible: make sure the mtime changes
+        os.utime(img_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+        loader = get_img_dataloader(self.train_csv, img_dir=self.img_dir, shuffle=False,
+                                    num_workers=0, use_shards=True)
+        self.assertTrue(torch.equal(loader.dataset[0], ImageDataset(self.train_csv, self.img_dir)[0]))
+        new_keys = loader.dataset.get_image_keys()
+        self.assertNotEqual(new_keys[0], old_keys[0])
+        self.assertEqual(new_keys[1:], old_keys[1:])
+        self.assertEqual(len(read_shard_index(shard_dir)), 10)
+
+        # Nothing changed: nothing is packed again
+        pack_image_shards([self.train_csv, self.test_csv], self.img_dir)
+        self.assertEqual(ShardedImageDataset(self.train_csv, shard_dir).get_image_keys(), new_keys)
+
+    def test_dataloader(self):
+        """DataLoader with shards and multiple workers."""
+        transformation = transforms.Compose([
+            transforms.RandomCrop(24),
+            transforms.ToTensor(),
+        ])
+        loader = get_img_dataloader(self.train_csv, img_dir=self.img_dir, batch_size=4,
+                                    transformation=transformation, num_workers=2,
+                                    use_shards=True)
+        loader.dataset.set_len(5)
+        n_imgs = sum(len(batch) for batch in loader)
+        self.assertEqual(n_imgs, 5)
+
+        loader_copy = copy_dataloader(loader)
+        self.assertIsInstance(loader_copy.dataset, ShardedImageDataset)
+        self.assertEqual(len(loader_copy.dataset), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()